@@ -1,60 +1,115 @@
-from numpy import typename
-from sqlalchemy import false
-from extractor import Extractor
-from knowledge_graph import KnowledgeGrapher
-from scraper import Scraper
+"""Streamlit UI: browse the knowledge graph stored in the database.
+
+    streamlit run app.py
+
+Ingestion is a separate, headless entry point that doesn't load any of the UI stack:
+
+    python pipeline.py --search Python https://www.w3schools.com/python/python_intro.asp
+
+The graph and its layout are loaded once per database version and shared by all sessions. Interactions
+only filter that in-memory graph or run a small paginated query, and their results are cached too.
+"""
+import streamlit
 from database_manager import DatabaseManager
+from knowledge_graph import KnowledgeGrapher, embed_html
+
+PAGE_SIZE = 50
+# How long the database version is trusted before asking again whether the graph changed
+VERSION_CHECK_SECONDS = 10
+
+
+@streamlit.cache_resource
+def get_db_manager() -> DatabaseManager:
+    db_manager = DatabaseManager()
+    db_manager.create_tables()
+    return db_manager
+
+
+@streamlit.cache_data(ttl=VERSION_CHECK_SECONDS)
+def current_version() -> str:
+    db_manager = get_db_manager()
+    try:
+        return db_manager.graph_version()
+    finally:
+        db_manager.close_db()
+
+
+@streamlit.cache_resource(max_entries=2)
+def load_grapher(version: str) -> KnowledgeGrapher:
+    """The full graph with its layout, shared by every session until the database version changes."""
+    db_manager = get_db_manager()
+    knowledge_grapher = KnowledgeGrapher(db_manager)
+    try:
+        knowledge_grapher.load_graph()
+    finally:
+        db_manager.close_db()
+    knowledge_grapher.layout()
+    return knowledge_grapher
+
+
+@streamlit.cache_data(max_entries=4)
+def type_counts(version: str) -> tuple:
+    """({entity type: count}, {relationship type: count}), most common first."""
+    db_manager = get_db_manager()
+    try:
+        return dict(db_manager.entity_type_counts()), dict(db_manager.relationship_type_counts())
+    finally:
+        db_manager.close_db()
+
+
+@streamlit.cache_data(max_entries=64)
+def graph_view(version: str, entity_types: tuple, relationship_types: tuple, center: str, depth: int, max_nodes: int) -> tuple:
+    """(HTML, nodes, edges) of the filtered graph."""
+    view = load_grapher(version).filter(list(entity_types), list(relationship_types), center or None, depth, max_nodes)
+    return view.to_html(), view.graph.number_of_nodes(), view.graph.number_of_edges()
+
+
+@streamlit.cache_data(max_entries=256)
+def entity_page(version: str, name: str, entity_types: tuple, page: int) -> tuple:
+    db_manager = get_db_manager()
+    try:
+        rows, total = db_manager.page_entities(name, list(entity_types), page * PAGE_SIZE, PAGE_SIZE)
+    finally:
+        db_manager.close_db()
+    return [{"ID": entID, "Name": name, "Type": type} for entID, name, type in rows], total
+
+
+def main():
+    streamlit.set_page_config(page_title="Knowledge graph", layout="wide")
+    version = current_version()
+    entity_counts, relationship_counts = type_counts(version)
+
+    with streamlit.sidebar:
+        entity_types = streamlit.multiselect(
+            "Entity types", list(entity_counts), format_func=lambda entity_type: f"{entity_type} ({entity_counts[entity_type]})",
+        )
+        relationship_types = streamlit.multiselect(
+            "Relationship types", list(relationship_counts),
+            format_func=lambda relationship_type: f"{relationship_type} ({relationship_counts[relationship_type]})",
+        )
+        center = streamlit.text_input("Neighbourhood of entity", help="Only show entities within the depth below of this one").strip()
+        depth = streamlit.slider("Neighbourhood depth", 1, 5, 2, disabled=not center)
+        max_nodes = int(streamlit.number_input("Max entities drawn", min_value=100, max_value=200000, value=5000, step=500))
+
+    grapher = load_grapher(version)
+    # Extracted names are stored lowercased
+    if center and center not in grapher.graph and center.lower() in grapher.graph:
+        center = center.lower()
+    if center and center not in grapher.graph:
+        streamlit.warning(f"No entity named {center!r}")
+
+    html, nodes, edges = graph_view(version, tuple(entity_types), tuple(relationship_types), center, depth, max_nodes)
+    streamlit.caption(f"Showing {nodes} of {grapher.graph.number_of_nodes()} entities and {edges} of {grapher.graph.number_of_edges()} relationships")
+    embed_html(html, height=750)
+
+    streamlit.subheader("Entities")
+    search, page_column = streamlit.columns([3, 1])
+    name = search.text_input("Name contains")
+    page = int(page_column.number_input("Page", min_value=1, value=1)) - 1
+    rows, total = entity_page(version, name, tuple(entity_types), page)
+    streamlit.dataframe(rows, hide_index=True)
+    streamlit.caption(f"Page {page + 1} of {max(1, -(-total // PAGE_SIZE))}, {total} entities")
+
 
-scraper = Scraper()
-extractor = Extractor()
-db_manager = DatabaseManager()
-
-url = "https://www.w3schools.com/python/python_intro.asp"
-# url = "https://stackoverflow.com/questions/70927568/downloading-images-with-selenium-and-requests-why-does-the-get-attribute-met/70962929#70962929"
-search_term = "Python"
-
-text = scraper.scrape(url, search_term)
-# print("\n\nText: "+str(text))
-
-for instance in text:
-    if not db_manager.load_text(text=instance):
-        if not instance == '' or not instance == ' ':
-            db_manager.add_text(instance)
-
-text_count = 400
-text = [textval.body for textval in db_manager.load_text(limit=text_count)]
-
-entities = extractor.extract_entities(text)
-
-for entity in entities:
-    if not db_manager.search_entities(name=entity[0], type=entity[1]):
-        db_manager.add_entity(entity[0], entity[1])
-
-for val in text:
-    db_manager.delete_text(textBody=val)
-# print("\n\nEntities: "+str(entities))
-
-relationships = extractor.extract_relationships(text, entities)
-for relationship in relationships:
-    sourceID = db_manager.search_entities(name=relationship[0])[0].entID
-    targetID = db_manager.search_entities(name=relationship[1])[0].entID
-    sourceFound = True if len(db_manager.search_relationships(sourceID=sourceID)) > 0 else False
-    targetFound = True if len(db_manager.search_relationships(targetID=targetID)) > 0 else False
-
-    # if sourceFound and targetFound:
-    #     continue
-    
-    relationship_type = db_manager.search_relationship_types(type_name=relationship[2])
-    if relationship_type:
-        relationshipID = relationship_type[0].typeID
-    else:
-        db_manager.add_relationship_type(relationship[2])
-        relationshipID = db_manager.search_relationship_types(type_name=relationship[2])[0].typeID
-    
-    db_manager.add_relationship(sourceID, targetID, relationshipID)
-
-
-knowledge_grapher = KnowledgeGrapher()
-knowledge_grapher.populate_graph(db_manager.search_entities(), db_manager.search_relationships())
-db_manager.close_db()
-knowledge_grapher.draw_graph()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""KnowledgeGraphIndex against the networkx graph KnowledgeGrapher builds, on a synthetic graph with hub entities.
+
+Compares build time, retained memory, k-hop neighbourhoods, shortest paths, degree statistics and typed-edge
+filtering. With --sqlite both are also loaded from a temporary SQLite database, the way the app does it.
+
+Run from the repository root:
+    python benchmarks/bench_graph_index.py [--nodes 200000] [--edges 1000000] [--queries 200] [--sqlite]
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_index import KnowledgeGraphIndex
+
+
+def make_graph(nodes: int, edges: int, entity_types: int, relationship_types: int, seed: int) -> dict:
+    """Random directed typed edges; targets are Pareto distributed over a shuffled node order, so a few hubs emerge."""
+    rng = numpy.random.default_rng(seed)
+    ranks = numpy.minimum((rng.pareto(1.0, edges) * nodes / 1000).astype(numpy.int64), nodes - 1)
+    return {
+        "names": [f"entity {node}" for node in range(nodes)],
+        "node_types": rng.integers(0, entity_types, nodes),
+        "entity_types": [f"type {code}" for code in range(entity_types)],
+        "sources": rng.integers(0, nodes, edges),
+        "targets": rng.permutation(nodes)[ranks],
+        "edge_types": rng.integers(0, relationship_types, edges),
+        "relationship_types": [f"relation {code}" for code in range(relationship_types)],
+    }
+
+
+def build_index(data: dict) -> KnowledgeGraphIndex:
+    return KnowledgeGraphIndex(
+        data["names"], data["node_types"], data["entity_types"], data["sources"], data["targets"],
+        data["edge_types"], data["relationship_types"],
+    )
+
+
+def build_networkx(data: dict):
+    """Same construction as KnowledgeGrapher.load_graph."""
+    import networkx
+    graph = networkx.Graph()
+    names, entity_types, relationship_types = data["names"], data["entity_types"], data["relationship_types"]
+    graph.add_nodes_from((name, {'entity_type': entity_types[code]}) for name, code in zip(names, data["node_types"].tolist()))
+    graph.add_edges_from(
+        (names[source], names[target], {'relationship_type': relationship_types[code]})
+        for source, target, code in zip(data["sources"].tolist(), data["targets"].tolist(), data["edge_types"].tolist())
+    )
+    return graph
+
+
+def timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def retained(function, *args) -> int:
+    """Bytes still allocated by function's result once it returns."""
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def per_query(function, arguments: list) -> float:
+    """Mean milliseconds per call."""
+    start = time.perf_counter()
+    for argument in arguments:
+        function(*argument)
+    return (time.perf_counter() - start) / len(arguments) * 1000
+
+
+def write_sqlite(path: str, data: dict):
+    from sqlalchemy import insert
+    from database_manager import DatabaseManager, Entity, Relationship, RelationshipType, normalize_name
+    db_manager = DatabaseManager(f"sqlite:///{path}")
+    db_manager.create_tables()
+    entity_types, relationship_types = data["entity_types"], data["relationship_types"]
+    with db_manager.session_scope() as session:
+        session.execute(insert(RelationshipType), [
+            {"typeID": code + 1, "type_name": name, "norm_name": normalize_name(name)} for code, name in enumerate(relationship_types)
+        ])
+        session.execute(insert(Entity), [
+            {"entID": node + 1, "name": name, "type": entity_types[code], "norm_name": normalize_name(name), "norm_type": normalize_name(entity_types[code])}
+            for node, (name, code) in enumerate(zip(data["names"], data["node_types"].tolist()))
+        ])
+        # The table is unique on (source, target, type)
+        edges = numpy.unique(numpy.stack([data["sources"], data["targets"], data["edge_types"]], axis=1), axis=0) + 1
+        session.execute(insert(Relationship), [
+            {"sourceID": source, "targetID": target, "typeID": typeID} for source, target, typeID in edges.tolist()
+        ])
+    return db_manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=200000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--entity-types", type=int, default=8)
+    parser.add_argument("--relationship-types", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200, help="random queries per measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sqlite", action="store_true", help="also time loading both from a temporary SQLite database")
+    args = parser.parse_args()
+
+    import networkx
+    data = make_graph(args.nodes, args.edges, args.entity_types, args.relationship_types, args.seed)
+    rng = numpy.random.default_rng(args.seed + 1)
+    names = data["names"]
+
+    index_build, index = timed(build_index, data)
+    networkx_build, graph = timed(build_networkx, data)
+    print(f"graph: {args.nodes} nodes, {args.edges} edges generated; index keeps {index.edge_count} directed typed edges, "
+          f"networkx {graph.number_of_edges()} undirected ones\n")
+    print(f"{'':<34}{'index':>12}{'networkx':>12}{'speedup':>9}")
+
+    def row(label: str, index_value: float, networkx_value: float, unit: str):
+        print(f"{label:<34}{index_value:>10.2f}{unit:>2}{networkx_value:>10.2f}{unit:>2}{networkx_value / max(index_value, 1e-9):>8.1f}x")
+
+    row("build from arrays", index_build, networkx_build, "s")
+    row("retained memory", retained(build_index, data) / 2 ** 20, retained(build_networkx, data) / 2 ** 20, "MB")
+
+    seeds = rng.integers(0, args.nodes, args.queries).tolist()
+    pairs = rng.integers(0, args.nodes, (args.queries, 2)).tolist()
+    for depth in (1, 2):
+        row(f"k-hop depth {depth}, per query",
+            per_query(lambda seed: index.k_hop(seed, depth), [(seed,) for seed in seeds]),
+            per_query(lambda seed: networkx.single_source_shortest_path_length(graph, names[seed], cutoff=depth), [(seed,) for seed in seeds]),
+            "ms")
+    row("k-hop depth 2, one type, per query",
+        per_query(lambda seed: index.k_hop(seed, 2, relationship_types=["relation 0"]), [(seed,) for seed in seeds]),
+        per_query(lambda seed: networkx.single_source_shortest_path_length(
+            networkx.subgraph_view(graph, filter_edge=lambda u, v: graph[u][v]['relationship_type'] == "relation 0"), names[seed], cutoff=2,
+        ), [(seed,) for seed in seeds]),
+        "ms")
+
+    def networkx_path(source, target):
+        try:
+            return networkx.shortest_path(graph, names[source], names[target])
+        except networkx.NetworkXNoPath:
+            return None
+    row("shortest path, per query", per_query(index.shortest_path, pairs), per_query(networkx_path, pairs), "ms")
+
+    def networkx_degree_stats():
+        degree = numpy.fromiter((degree for _, degree in graph.degree()), dtype=numpy.int64, count=graph.number_of_nodes())
+        return degree.mean(), numpy.median(degree), numpy.percentile(degree, 99), degree.max()
+    row("degree stats", timed(index.degree_stats)[0] * 1000, timed(networkx_degree_stats)[0] * 1000, "ms")
+
+    typed = data["relationship_types"][:2]
+    row("typed-edge subgraph (2 types)",
+        timed(index.subgraph, None, typed)[0],
+        timed(lambda: graph.edge_subgraph([(u, v) for u, v, kind in graph.edges(data='relationship_type') if kind in typed]).copy())[0],
+        "s")
+    print(f"\nto_networkx(multigraph=False) of the whole index: {timed(index.to_networkx, None, None, None, False)[0]:.2f}s")
+
+    if args.sqlite:
+        from knowledge_graph import KnowledgeGrapher
+        with tempfile.TemporaryDirectory() as directory:
+            write_time, db_manager = timed(write_sqlite, os.path.join(directory, "graph.db"), data)
+            print(f"\nwrote SQLite database in {write_time:.1f}s")
+            grapher = KnowledgeGrapher(db_manager)
+            row("load from SQLite", timed(KnowledgeGraphIndex.load, db_manager.session)[0], timed(grapher.load_graph)[0], "s")
+            db_manager.close_db()
+
+
+if __name__ == "__main__":
+    main()
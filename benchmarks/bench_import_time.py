@@ -0,0 +1,61 @@
+"""Cold-start import cost of the project modules, from `python -X importtime` in a fresh interpreter.
+
+Run from the repository root:
+    python benchmarks/bench_import_time.py [--repeat 3] [--top 8] [module ...]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["tuple_parser", "llm_cache", "database_manager", "extractor", "scraper", "knowledge_graph", "pipeline", "app"]
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def profile_import(module: str) -> tuple:
+    """(wall seconds, cumulative us of module, [(cumulative us, name)] of the imports module's body made directly)."""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    # A package is reported after everything it imported, indented two spaces deeper than it
+    total, children, pending = 0, [], []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)), len(match.group(3)) // 2, match.group(4)
+        if depth == 1:
+            pending.append((cumulative, name))
+        elif depth == 0:
+            if name == module:
+                total, children = cumulative, pending
+            pending = []
+    return wall, total, sorted(children, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module, the fastest is reported")
+    parser.add_argument("--top", type=int, default=6, help="heaviest direct imports listed per module")
+    args = parser.parse_args()
+
+    print(f"{'module':<18}{'wall ms':>9}{'import ms':>11}  heaviest direct imports (cumulative ms)")
+    for module in args.modules:
+        wall, total, children = min((profile_import(module) for _ in range(args.repeat)), key=lambda run: run[0])
+        listed = ", ".join(f"{name} {cumulative / 1000:.0f}" for cumulative, name in children[:args.top])
+        print(f"{module:<18}{wall * 1000:>9.0f}{total / 1000:>11.1f}  {listed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""End-to-end benchmark on local stand-ins: ingest throughput, graph-load time, render time and peak memory.
+
+The real Pipeline, Scraper, Extractor, DatabaseManager and KnowledgeGrapher run against fakes.py: a static HTML site
+on localhost (a tenth of it single-page-app shells for the fake browser), a deterministic fake LLM with configurable
+latency and SQLite in a temporary directory. Each corpus size goes through:
+
+- ingest: Pipeline.run over every page of the site into an empty database
+- load: KnowledgeGrapher.load_graph and KnowledgeGraphIndex.load from that database
+- render: KnowledgeGrapher.to_html, layout included (the render_limit best connected nodes of larger graphs)
+
+Every phase runs in a fresh interpreter, so its peak RSS is its own. --json saves the results with the commit they
+were measured on, --compare prints the change against such a file.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py [--sizes 1000,10000,100000] [--llm-latency 0.05] [--json results.json]
+    python benchmarks/bench_pipeline.py --sizes 1000000 --compare results.json
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# (key, label, format) of the reported measurements, in table order
+MEASUREMENTS = [
+    ("pages", "pages", "{:.0f}"),
+    ("ingest_s", "ingest time (s)", "{:.2f}"),
+    ("pages_per_s", "pages/s", "{:.0f}"),
+    ("texts_per_s", "texts/s", "{:.0f}"),
+    ("entities_per_s", "entities/s", "{:.0f}"),
+    ("relationships_per_s", "relationships/s", "{:.0f}"),
+    ("ingest_peak_mb", "ingest peak RSS, writer (MB)", "{:.0f}"),
+    ("scrape_peak_mb", "ingest peak RSS, scraper (MB)", "{:.0f}"),
+    ("stored_entities", "entities stored", "{:.0f}"),
+    ("stored_relationships", "relationships stored", "{:.0f}"),
+    ("networkx_load_s", "networkx graph load (s)", "{:.2f}"),
+    ("networkx_peak_mb", "networkx graph peak RSS (MB)", "{:.0f}"),
+    ("index_load_s", "graph index load (s)", "{:.2f}"),
+    ("index_peak_mb", "graph index peak RSS (MB)", "{:.0f}"),
+    ("rendered_nodes", "nodes rendered", "{:.0f}"),
+    ("render_s", "render incl. layout (s)", "{:.2f}"),
+    ("rerender_s", "re-render, layout cached (s)", "{:.2f}"),
+    ("html_mb", "HTML size (MB)", "{:.1f}"),
+    ("render_peak_mb", "render peak RSS (MB)", "{:.0f}"),
+]
+
+
+def _peak_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _isolated_main(connection, function, args):
+    try:
+        result = function(*args)
+        result["peak_mb"] = _peak_mb()
+        result["children_peak_mb"] = _peak_mb(resource.RUSAGE_CHILDREN)
+        connection.send(("ok", result))
+    except BaseException:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def isolated(function, *args) -> dict:
+    """function(*args) in a fresh interpreter: its result dict plus peak_mb and children_peak_mb (peak RSS)."""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_isolated_main, args=(sender, function, args))
+    process.start()
+    sender.close()
+    try:
+        status, result = receiver.recv()
+    except EOFError:
+        status, result = "error", "process died without a result"
+    process.join()
+    if status != "ok":
+        raise RuntimeError(f"{function.__name__} failed:\n{result}")
+    return result
+
+
+# Phases, each run by isolated()
+def ingest(database_url: str, entities: int, options: dict) -> dict:
+    import logging
+    from sqlalchemy import func, select
+    from database_manager import DatabaseManager, Entity, Relationship
+    from fakes import Corpus, StaticSite, make_extractor, make_scraper
+    from metrics import METRICS
+    from pipeline import Pipeline
+    logging.basicConfig(level=logging.WARNING)
+
+    corpus = Corpus(entities, options["sentences_per_page"], options["seed"])
+    with StaticSite(corpus, options["js_every"]) as site:
+        pipeline = Pipeline(
+            scrape_workers=options["scrape_workers"], llm_workers=options["llm_workers"],
+            scraper_factory=functools.partial(make_scraper, options["fetch_mode"], options["render_delay"]),
+            extractor_factory=functools.partial(make_extractor, options["llm_latency"], options["llm_workers"]),
+            db_manager_factory=functools.partial(DatabaseManager, database_url),
+        )
+        start = time.perf_counter()
+        stats = pipeline.run(site.urls())
+        elapsed = time.perf_counter() - start
+
+    with DatabaseManager(database_url).session_scope() as session:
+        stored_entities = session.scalar(select(func.count(Entity.entID)))
+        stored_relationships = session.scalar(select(func.count(Relationship.relationshipID)))
+    return {
+        "pages": stats["pages"], "ingest_s": elapsed,
+        "pages_per_s": stats["pages"] / elapsed, "texts_per_s": stats["texts"] / elapsed,
+        "entities_per_s": stats["entities"] / elapsed, "relationships_per_s": stats["relationships"] / elapsed,
+        "stored_entities": stored_entities, "stored_relationships": stored_relationships,
+        "stats": stats, "metrics": METRICS.to_dict(),
+    }
+
+def load_networkx(database_url: str) -> dict:
+    from database_manager import DatabaseManager
+    from knowledge_graph import KnowledgeGrapher
+    grapher = KnowledgeGrapher(DatabaseManager(database_url))
+    start = time.perf_counter()
+    grapher.load_graph()
+    return {"networkx_load_s": time.perf_counter() - start}
+
+def load_index(database_url: str) -> dict:
+    from database_manager import DatabaseManager
+    from graph_index import KnowledgeGraphIndex
+    session = DatabaseManager(database_url).session
+    start = time.perf_counter()
+    KnowledgeGraphIndex.load(session)
+    return {"index_load_s": time.perf_counter() - start}
+
+def render(database_url: str, render_limit: int, layout_directory: str) -> dict:
+    from database_manager import DatabaseManager
+    from graph_layout import LayoutCache
+    from knowledge_graph import KnowledgeGrapher
+    grapher = KnowledgeGrapher(DatabaseManager(database_url), layout_cache=LayoutCache(layout_directory))
+    grapher.load_graph()
+    if grapher.graph.number_of_nodes() > render_limit:
+        grapher = grapher.filter(max_nodes=render_limit)
+    start = time.perf_counter()
+    page = grapher.to_html()
+    rendered = time.perf_counter()
+    grapher.to_html()
+    return {
+        "rendered_nodes": grapher.graph.number_of_nodes(), "render_s": rendered - start,
+        "rerender_s": time.perf_counter() - rendered, "html_mb": len(page) / 2 ** 20,
+    }
+
+
+def run_size(entities: int, options: dict) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'graph.db')}"
+        result = isolated(ingest, database_url, entities, options)
+        result["ingest_peak_mb"] = result.pop("peak_mb")
+        result["scrape_peak_mb"] = result.pop("children_peak_mb")
+        for name, function, args in (("networkx", load_networkx, ()), ("index", load_index, ()),
+                                     ("render", render, (options["render_limit"], os.path.join(directory, "layouts")))):
+            measured = isolated(function, database_url, *args)
+            measured[f"{name}_peak_mb"] = measured.pop("peak_mb")
+            del measured["children_peak_mb"]
+            result.update(measured)
+    return result
+
+
+def git_commit() -> str:
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    commit = completed.stdout.strip() or None
+    return f"{commit}-dirty" if commit and dirty.stdout.strip() else commit
+
+
+def print_table(results: dict, baseline: dict=None):
+    sizes = list(results)
+    print(f"{'entities':<32}" + "".join(f"{size:>14}" for size in sizes))
+    for key, label, number_format in MEASUREMENTS:
+        cells = []
+        for size in sizes:
+            value = results[size].get(key)
+            cell = "" if value is None else number_format.format(value)
+            old = (baseline or {}).get(size, {}).get(key)
+            if value is not None and old:
+                cell += f" {(value - old) / old * 100:+.0f}%"
+            cells.append(f"{cell:>14}")
+        print(f"{label:<32}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated corpus sizes in entities (up to 1000000)")
+    parser.add_argument("--sentences-per-page", type=int, default=20)
+    parser.add_argument("--js-every", type=int, default=10, help="every n-th page needs the (fake) browser, 0 for none")
+    parser.add_argument("--fetch-mode", choices=["auto", "http", "browser"], default="auto")
+    parser.add_argument("--render-delay", type=float, default=0.05, help="seconds per fake browser page load")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--scrape-workers", type=int, default=2)
+    parser.add_argument("--llm-workers", type=int, default=4)
+    parser.add_argument("--render-limit", type=int, default=20000, help="larger graphs render their best connected nodes only")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="save the results (and the commit they were measured on) to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to show the change against")
+    args = parser.parse_args()
+
+    options = vars(args).copy()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            saved = json.load(baseline_file)
+        baseline = {int(size): result for size, result in saved["results"].items()}
+        print(f"change against {args.compare} (commit {saved.get('commit')})")
+
+    commit = git_commit()
+    print(f"commit {commit}, python {sys.version.split()[0]}, LLM latency {args.llm_latency}s, fetch mode {args.fetch_mode}\n")
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        results[size] = run_size(size, options)
+        print(f"{size} entities done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump({"commit": commit, "python": sys.version.split()[0], "options": options, "results": results},
+                      results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Micro-benchmark and fuzz corpus for tuple_parser against the old ast.literal_eval path.
+
+Run from the repository root:
+    python benchmarks/bench_tuple_parser.py [--responses 2000] [--seed 0]
+"""
+import argparse
+import ast
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuple_parser import parse_tuples
+
+WORDS = ["python", "guido van rossum", "language", "interpreter", "web development", "o'reilly", "data science",
+         "cpython", "module", "syntax", "w3schools", "tutorial", "software", "server", "machine learning"]
+
+
+def make_tuples(rng: random.Random, count: int, arity: int) -> list:
+    return [tuple(rng.choice(WORDS) for _ in range(arity)) for _ in range(count)]
+
+
+def render(tuples: list, quote: str='"') -> str:
+    def element(value):
+        if quote == "'":
+            value = value.replace("'", "\\'")
+        return f"{quote}{value}{quote}"
+    return "[" + ", ".join("(" + ", ".join(element(value) for value in values) + ")" for values in tuples) + "]"
+
+
+def mutate(rng: random.Random, response: str) -> tuple:
+    """Return (kind, mutated response) for one of the failure modes seen from the model."""
+    kind = rng.choice(["clean", "fence", "prose", "truncated", "newlines", "preamble"])
+    if kind == "fence":
+        response = f"```python\n{response}\n```"
+    elif kind == "prose":
+        response = f"{response}\n\nThese are all the entities I could find in the text."
+    elif kind == "truncated":
+        response = response[:rng.randint(len(response) // 2, len(response) - 1)]
+    elif kind == "newlines":
+        response = response.replace("), (", "),\n    (")
+    elif kind == "preamble":
+        response = f"Here is the extraction result:\n{response}"
+    return kind, response
+
+
+def build_corpus(responses: int, seed: int) -> list:
+    """(arity, expected tuples, response text, mutation kind) for each generated response."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(responses):
+        arity = rng.choice([2, 3])
+        tuples = make_tuples(rng, rng.randint(5, 60), arity)
+        kind, response = mutate(rng, render(tuples, rng.choice(['"', "'"])))
+        corpus.append((arity, tuples, response, kind))
+    return corpus
+
+
+def literal_eval_parse(text: str, arity: int) -> list:
+    # What Extractor did before tuple_parser: literal_eval, and nothing usable if that raises
+    try:
+        response = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return []
+    if not isinstance(response, list):
+        return []
+    return [item for item in response if isinstance(item, tuple) and len(item) == arity and all(isinstance(value, str) for value in item)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--responses", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.responses, args.seed)
+    expected = sum(len(tuples) for _, tuples, _, _ in corpus)
+
+    for name, parse in (("literal_eval", literal_eval_parse), ("tuple_parser", parse_tuples)):
+        seconds = min(timeit.repeat(lambda: [parse(text, arity) for arity, _, text, _ in corpus], number=1, repeat=5))
+        by_kind = {}
+        for arity, tuples, text, kind in corpus:
+            found = by_kind.setdefault(kind, [0, 0])
+            found[0] += len(parse(text, arity))
+            found[1] += len(tuples)
+        recovered = sum(found for found, _ in by_kind.values())
+        print(f"{name:>13}: {seconds * 1e6 / len(corpus):8.1f} us/response, recovered {recovered}/{expected} tuples")
+        for kind, (found, total) in sorted(by_kind.items()):
+            print(f"{'':>15}{kind:<10} {found}/{total}")
+
+
+if __name__ == "__main__":
+    main()
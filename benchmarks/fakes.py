@@ -0,0 +1,235 @@
+"""Local stand-ins for the pipeline's external services, so benchmarks run offline and reproducibly.
+
+- Corpus: a seeded synthetic corpus of entities and "A (type) relation B (type)." sentences
+- StaticSite: a threaded HTTP server serving the corpus as HTML pages (with ETags), a fraction of them as
+  empty single-page-app shells that only the fake browser can read
+- FakeDriver / FakeBrowserScraper: a Scraper whose "Chrome" loads the rendered page over HTTP after a delay
+- fake_llm: a deterministic LLM answering the extraction prompts from the sentences, with optional latency
+"""
+import asyncio
+import hashlib
+import html
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper import HttpFetcher, Scraper
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "sha", "tor", "quin", "bel", "dra", "fen", "gu",
+             "hax", "jo", "kre", "lum", "mox", "nar", "ost", "plu", "rim", "sek", "tiv", "ul", "vex", "wyn"]
+ENTITY_TYPES = ["person", "organization", "location", "concept", "event", "product"]
+RELATIONS = ["uses", "founded", "located_in", "part_of", "influences", "depends_on", "created", "competes_with"]
+
+# "Kalo Mire (person) founded Shator Bel (organization)." -> source, source type, relation, target, target type
+SENTENCE_RE = re.compile(r"([A-Z][a-z]*(?: [A-Z][a-z]*)*) \((\w+)\) (\w+) ([A-Z][a-z]*(?: [A-Z][a-z]*)*) \((\w+)\)\.")
+
+
+class Corpus:
+    """entities entity names and one sentence per entity, grouped sentences_per_page to a page.
+
+    Each sentence starts with a different entity (in shuffled order) and ends with a Pareto-distributed target,
+    so every entity is mentioned and a few hubs emerge. The same arguments always give the same corpus.
+    """
+    def __init__(self, entities: int, sentences_per_page: int=20, seed: int=0):
+        rng = numpy.random.default_rng(seed)
+        names = set()
+        self.names = []
+        while len(self.names) < entities:
+            # Two words of two or three syllables: enough combinations, and random names rarely look alike
+            for syllables in rng.integers(0, len(SYLLABLES), (entities - len(self.names), 6)).tolist():
+                first = "".join(SYLLABLES[s] for s in syllables[:2 + syllables[2] % 2])
+                second = "".join(SYLLABLES[s] for s in syllables[3:5 + syllables[5] % 2])
+                name = f"{first.capitalize()} {second.capitalize()}"
+                if name not in names:
+                    names.add(name)
+                    self.names.append(name)
+        self.types = rng.integers(0, len(ENTITY_TYPES), entities)
+        self.sources = rng.permutation(entities)
+        ranks = numpy.minimum((rng.pareto(1.0, entities) * entities / 1000).astype(numpy.int64), entities - 1)
+        self.targets = rng.permutation(entities)[ranks]
+        self.relations = rng.integers(0, len(RELATIONS), entities)
+        self.sentences_per_page = sentences_per_page
+
+    @property
+    def page_count(self) -> int:
+        return -(-len(self.names) // self.sentences_per_page)
+
+    def sentence(self, index: int) -> str:
+        source, target = int(self.sources[index]), int(self.targets[index])
+        return (f"{self.names[source]} ({ENTITY_TYPES[self.types[source]]}) {RELATIONS[self.relations[index]]} "
+                f"{self.names[target]} ({ENTITY_TYPES[self.types[target]]}).")
+
+    def page_sentences(self, page: int) -> list:
+        start = page * self.sentences_per_page
+        return [self.sentence(index) for index in range(start, min(start + self.sentences_per_page, len(self.names)))]
+
+
+class StaticSite:
+    """Serves Corpus pages at /page/<n> from a background thread on a free localhost port.
+
+    Every js_every-th page (0 for none) is an empty <div id="root"> app shell unless requested with ?rendered=1,
+    which is what FakeDriver asks for, so fetch_mode="auto" has to fall back to the browser for it.
+    """
+    def __init__(self, corpus: Corpus, js_every: int=10):
+        self.corpus = corpus
+        self.js_every = js_every
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site._serve(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="static-site", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def urls(self) -> list:
+        return [f"{self.base_url}/page/{page}" for page in range(self.corpus.page_count)]
+
+    def is_js_page(self, page: int) -> bool:
+        return bool(self.js_every) and page % self.js_every == 0
+
+    def _serve(self, request):
+        path, _, query = request.path.partition("?")
+        try:
+            page = int(path.rsplit("/", 1)[1])
+        except ValueError:
+            page = -1
+        if not path.startswith("/page/") or not 0 <= page < self.corpus.page_count:
+            request.send_error(404)
+            return
+
+        if self.is_js_page(page) and query != "rendered=1":
+            body = "<html><head><title>app</title></head><body><div id=\"root\"></div><script src=\"/app.js\"></script></body></html>"
+        else:
+            paragraphs = "".join(f"<p>{html.escape(sentence)}</p>" for sentence in self.corpus.page_sentences(page))
+            body = f"<html><head><title>page {page}</title></head><body>{paragraphs}</body></html>"
+        data = body.encode("utf-8")
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            request.send_response(304)
+            request.send_header("ETag", etag)
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", "text/html; charset=utf-8")
+        request.send_header("Content-Length", str(len(data)))
+        request.send_header("ETag", etag)
+        request.end_headers()
+        request.wfile.write(data)
+
+
+class FakeDriver:
+    """Enough of a selenium WebDriver for Scraper.extract_chunks: get() waits render_delay seconds, like a page
+    load, and execute_script() returns the chunks of the page's rendered version."""
+    def __init__(self, render_delay: float=0.05):
+        self.render_delay = render_delay
+        self.fetcher = HttpFetcher(min_text_length=0)
+        self.url = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.quit()
+
+    def set_page_load_timeout(self, timeout: float):
+        pass
+
+    def get(self, url: str):
+        time.sleep(self.render_delay)
+        self.url = url
+
+    def find_element(self, by, value):
+        return object()
+
+    def execute_script(self, script: str, search: str=""):
+        return self.fetcher.fetch_chunks(self.url + "?rendered=1", search) or []
+
+    def quit(self):
+        self.fetcher.close()
+
+
+class FakeBrowserScraper(Scraper):
+    """Scraper whose browser is a FakeDriver; everything else is the real fetch and extraction code."""
+    def __init__(self, render_delay: float=0.05, **options):
+        super().__init__(**options)
+        self.render_delay = render_delay
+
+    def new_driver(self, page_timeout: float=None):
+        return FakeDriver(self.render_delay)
+
+
+def make_scraper(fetch_mode: str="auto", render_delay: float=0.05) -> Scraper:
+    """Scraper factory for the pipeline's scrape processes (wrap it in functools.partial, which pickles)."""
+    return FakeBrowserScraper(render_delay, fetch_mode=fetch_mode)
+
+
+def _prompt_text(prompt) -> tuple:
+    # (is the relationship prompt, the text being analyzed)
+    prompt = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+    return "relationship extractor" in prompt, prompt.rsplit("Text to analyze:", 1)[-1]
+
+def _answer(prompt) -> str:
+    relationships, text = _prompt_text(prompt)
+    if relationships:
+        tuples = [(source, relation, target) for source, _, relation, target, _ in SENTENCE_RE.findall(text)]
+    else:
+        tuples = []
+        for source, source_type, _, target, target_type in SENTENCE_RE.findall(text):
+            tuples += [(source, source_type), (target, target_type)]
+    return "[" + ", ".join("(" + ", ".join(f'"{value}"' for value in item) + ")" for item in tuples) + "]"
+
+def fake_llm(latency: float=0.0):
+    """A LangChain runnable answering entity and relationship prompts from the corpus sentences in the prompt,
+    taking latency seconds per call (asyncio.sleep when awaited, so concurrent calls overlap like real ones)."""
+    from langchain_core.runnables import RunnableLambda
+
+    def invoke(prompt):
+        if latency:
+            time.sleep(latency)
+        return _answer(prompt)
+
+    async def ainvoke(prompt):
+        if latency:
+            await asyncio.sleep(latency)
+        return _answer(prompt)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+def make_extractor(latency: float=0.0, max_concurrency: int=4):
+    """Extractor on fake_llm, without a response cache so every run does the same work."""
+    from extractor import Extractor
+    return Extractor(llm=fake_llm(latency), cache=False, max_concurrency=max_concurrency)
+
+
+def check(corpus: Corpus, site: StaticSite) -> bool:
+    """Smoke test: a plain page and an app-shell page both come back with their sentences."""
+    with urllib.request.urlopen(site.urls()[-1]) as response:
+        ok = corpus.page_sentences(corpus.page_count - 1)[0] in html.unescape(response.read().decode("utf-8"))
+    scraper = make_scraper(render_delay=0)
+    return ok and scraper.scrape(site.urls()[0]) == corpus.page_sentences(0)
+
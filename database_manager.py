@@ -1,18 +1,136 @@
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, TIMESTAMP, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, inspect, bindparam, Column, Integer, Float, String, ForeignKey, TIMESTAMP, Text, Index, delete, func, insert, or_, select, text, true, tuple_, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import aliased, declarative_base, scoped_session, sessionmaker
+import hashlib
+import logging
 import os
-from psycopg2 import sql
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Max rows per INSERT / IN (...) statement, keeps us under SQLite's bound-parameter limit
+BULK_BATCH_SIZE = 500
+# Rows fetched per round-trip when streaming the graph out of the database
+GRAPH_BATCH_SIZE = 10000
+
+# Text work queue states: pending -> leased -> done, or back to pending on nack until max_attempts, then failed
+TEXT_PENDING = 'pending'
+TEXT_LEASED = 'leased'
+TEXT_DONE = 'done'
+TEXT_FAILED = 'failed'
+
+# Attribute name of the alias rows entity resolution writes: value is a merged-away name of the entity
+ALIAS_ATTRIBUTE = 'alias'
+
+def _batched(items: list, size: int=BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _unique(items: list) -> list:
+    """Drop duplicates while keeping the first-seen order."""
+    return list(dict.fromkeys(items))
+
+def normalize_name(value: str) -> str:
+    """Canonical form used for exact-match lookups: trimmed, lowercased, single-spaced."""
+    return ' '.join(value.split()).lower()
+
+def text_hash(body: str) -> str:
+    """Fingerprint of a text chunk, insensitive to surrounding and repeated whitespace."""
+    return hashlib.sha256(' '.join(body.split()).encode('utf-8')).hexdigest()
+
+def page_fingerprint(chunks: list) -> str:
+    """Fingerprint of a scraped page: hash over the hashes of its text chunks, in page order."""
+    return hashlib.sha256('\n'.join(text_hash(chunk) for chunk in chunks).encode('utf-8')).hexdigest()
+
+class LRUCache:
+    """Size-bounded mapping that evicts the least recently used key and counts hits/misses. Thread-safe."""
+    def __init__(self, maxsize: int=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class MicroBatchWriter:
+    """Buffers streamed items and hands them to flush_batch every batch_size items.
+
+    Use as a context manager: whatever is buffered is flushed on exit, also when the
+    producer raised, so a crashed run keeps everything it extracted up to that point.
+    """
+    def __init__(self, flush_batch, batch_size: int=50):
+        self.flush_batch = flush_batch
+        self.batch_size = batch_size
+        self.written = 0
+        self._buffer = []
+
+    def add(self, item):
+        self._buffer.append(item)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            self.flush_batch(batch)
+            self.written += len(batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.flush()
+
 class Entity(Base):
     __tablename__ = 'entities'
     
     entID = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(255), nullable=False)
     type = Column(String(255), nullable=False)
+    norm_name = Column(String(255), nullable=False)
+    norm_type = Column(String(255), nullable=False)
+
+    __table_args__ = (
+        Index('ix_entities_norm_name_type', 'norm_name', 'norm_type', unique=True),
+        # Trigram index for the fuzzy (substring) search, PostgreSQL only
+        Index('ix_entities_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Never reuse the ID of a deleted row: snapshot deltas (graph_snapshot) tell rows apart by ID
+        {'sqlite_autoincrement': True},
+    )
 
 class Relationship(Base):
     __tablename__ = 'relationships'
@@ -22,11 +140,20 @@ class Relationship(Base):
     targetID = Column(Integer, ForeignKey('entities.entID'), nullable=False)
     typeID = Column(Integer, ForeignKey('relationship_types.typeID'), nullable=False)
 
+    __table_args__ = (Index('ix_relationships_edge', 'sourceID', 'targetID', 'typeID', unique=True), {'sqlite_autoincrement': True})
+
 class RelationshipType(Base):
     __tablename__ = 'relationship_types'
     
     typeID = Column(Integer, primary_key=True, autoincrement=True)
     type_name = Column(String(255), nullable=False)
+    norm_name = Column(String(255), nullable=False)
+
+    __table_args__ = (
+        Index('ix_relationship_types_norm_name', 'norm_name', unique=True),
+        Index('ix_relationship_types_type_name_trgm', 'type_name', postgresql_using='gin', postgresql_ops={'type_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        {'sqlite_autoincrement': True},
+    )
 
 class Attribute(Base):
     __tablename__ = 'attributes'
@@ -36,70 +163,584 @@ class Attribute(Base):
     value = Column(String(255), nullable=False)
     entityID = Column(Integer, ForeignKey('entities.entID'), nullable=False)
 
+    __table_args__ = (Index('ix_attributes_name_value', 'name', 'value'), {'sqlite_autoincrement': True})
+
+class LLMResponse(Base):
+    __tablename__ = 'llm_cache'
+
+    key = Column(String(64), primary_key=True)  # sha256 of model + prompt template + prompt inputs
+    response = Column(Text, nullable=False)
+    created_at = Column(Float, nullable=False)
+    accessed_at = Column(Float, nullable=False, index=True)
+
+class Page(Base):
+    __tablename__ = 'pages'
+
+    pageID = Column(Integer, primary_key=True, autoincrement=True)
+    url = Column(String(2048), nullable=False, unique=True)
+    content_hash = Column(String(64), nullable=False)  # page_fingerprint of the scraped chunks
+    etag = Column(String(255))
+    last_modified = Column(String(255))
+    fetched_at = Column(Float, nullable=False)
+
 class Text(Base):
     __tablename__ = 'text'
     
     textID = Column(Integer, primary_key=True, autoincrement=True)
     body = Column(Text, nullable=False)  # Storing the HTML body as text
+    body_hash = Column(String(64), nullable=False, unique=True)  # text_hash(body), so a chunk is only stored once
+    pageID = Column(Integer, ForeignKey('pages.pageID'))
 
+    # Work queue: extractor workers claim pending rows under a lease and ack/nack them when done
+    status = Column(String(16), nullable=False, default=TEXT_PENDING)
+    lease_owner = Column(String(255))
+    lease_token = Column(String(36))
+    lease_expires_at = Column(Float)
+    attempts = Column(Integer, nullable=False, default=0)
 
-class DatabaseManager:
-    def __init__(self, connection_string=None):
+    __table_args__ = (Index('ix_text_status_lease', 'status', 'lease_expires_at'),)
+
+
+def stream_graph_nodes(session, batch_size: int=GRAPH_BATCH_SIZE):
+    """Yield (name, type) for every entity, fetched batch_size rows at a time."""
+    query = select(Entity.name, Entity.type).execution_options(yield_per=batch_size)
+    for row in session.execute(query):
+        yield row.name, row.type
+
+def stream_graph_edges(session, batch_size: int=GRAPH_BATCH_SIZE):
+    """Yield (source name, target name, relationship type) for every relationship in a single joined query."""
+    source = aliased(Entity)
+    target = aliased(Entity)
+    query = (
+        select(source.name, target.name, RelationshipType.type_name)
+        .select_from(Relationship)
+        .join(source, Relationship.sourceID == source.entID)
+        .join(target, Relationship.targetID == target.entID)
+        .join(RelationshipType, Relationship.typeID == RelationshipType.typeID)
+        .execution_options(yield_per=batch_size)
+    )
+    for source_name, target_name, type_name in session.execute(query):
+        yield source_name, target_name, type_name
+
+def stream_entity_batches(session, batch_size: int=GRAPH_BATCH_SIZE):
+    """Yield lists of up to batch_size (entID, name, type) rows, in entID order.
+
+    Runs as a Core statement on the session's connection, which skips the ORM result layer (about twice as fast here).
+    """
+    query = select(Entity.entID, Entity.name, Entity.type).order_by(Entity.entID).execution_options(yield_per=batch_size)
+    for rows in session.connection().execute(query).partitions():
+        yield rows
+
+def stream_relationship_batches(session, batch_size: int=GRAPH_BATCH_SIZE):
+    """Yield lists of up to batch_size (sourceID, targetID, typeID) rows: IDs only, no joins."""
+    query = select(Relationship.sourceID, Relationship.targetID, Relationship.typeID).execution_options(yield_per=batch_size)
+    for rows in session.connection().execute(query).partitions():
+        yield rows
+
+def relationship_type_names(session) -> dict:
+    """{typeID: type_name} of every relationship type."""
+    return dict(session.execute(select(RelationshipType.typeID, RelationshipType.type_name)).all())
+
+
+def graph_version(session) -> str:
+    """Cheap fingerprint of the graph's contents: changes whenever entities, relationship types or relationships are added or deleted.
+
+    Count, highest and sum of the IDs per table: count and highest alone miss a deletion together with an insert
+    below the highest ID (a row committed late on PostgreSQL, a reused ID on SQLite). In-place edits (renaming an
+    entity) keep the same version.
+    """
+    parts = []
+    for primary_key in (Entity.entID, RelationshipType.typeID, Relationship.relationshipID):
+        count, max_id, id_sum = session.execute(select(func.count(primary_key), func.max(primary_key), func.sum(primary_key))).one()
+        parts.append(f"{count}-{max_id or 0}-{id_sum or 0}")
+    return ':'.join(parts)
+
+
+# Engines are shared per process: one connection pool per database URL and pool settings
+_engines = {}
+_engines_lock = threading.Lock()
+_schema_ready = set()
+
+
+def get_engine(connection_string: str=None, pool_size: int=5, max_overflow: int=10, pool_pre_ping: bool=True,
+               pool_recycle: int=1800):
+    """Shared engine for connection_string (DATABASE_URL by default), created on first use.
+
+    pool_pre_ping checks connections before handing them out, pool_recycle (seconds) replaces
+    connections before the server or a proxy drops them.
+    """
+    if connection_string is None:
         load_dotenv()
-        """Initialize the database manager with the database name and connection parameters."""
-        if connection_string is None:
-            connection_string = os.getenv('DATABASE_URL')
-        
-        if not connection_string:
-            raise ValueError("DATABASE_URL is not set in the environment variables.")
+        connection_string = os.getenv('DATABASE_URL')
+    if not connection_string:
+        raise ValueError("DATABASE_URL is not set in the environment variables.")
+
+    key = (connection_string, pool_size, max_overflow, pool_pre_ping, pool_recycle)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            options = {'pool_pre_ping': pool_pre_ping, 'pool_recycle': pool_recycle}
+            url = make_url(connection_string)
+            # In-memory SQLite uses a single-connection pool that has no size to configure
+            if not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+                options.update(pool_size=pool_size, max_overflow=max_overflow)
+            engine = _engines[key] = create_engine(connection_string, **options)
+            _instrument_engine(engine)
+        return engine
+
+
+def _instrument_engine(engine):
+    # Every statement (an executemany counts once) lands in db_queries_total and db_query_seconds, per SQL verb
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        METRICS.inc('db_queries_total', statement=verb)
+        METRICS.observe('db_query_seconds', time.perf_counter() - context._query_started, statement=verb)
+
+
+def dispose_engines():
+    """Close every pooled connection, e.g. at shutdown or in a forked child."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _schema_ready.clear()
+
+
+def create_tables(engine=None):
+    """Create the extension, tables and indexes if needed. Runs once per engine and process."""
+    engine = engine if engine is not None else get_engine()
+    with _engines_lock:
+        if engine.url in _schema_ready:
+            return
+    if engine.dialect.name == 'postgresql':
+        # Needed by the trigram indexes behind the fuzzy search methods
+        with engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    Base.metadata.create_all(engine)
+    migrate_schema(engine)
+    with _engines_lock:
+        _schema_ready.add(engine.url)
+
+
+# Columns added to tables that databases created by older versions already have; create_all() never alters an
+# existing table, so migrate_schema() adds them: (table, column, DDL type and default)
+ADDED_COLUMNS = [
+    ('entities', 'norm_name', 'VARCHAR(255)'),
+    ('entities', 'norm_type', 'VARCHAR(255)'),
+    ('relationship_types', 'norm_name', 'VARCHAR(255)'),
+    ('text', 'body_hash', 'VARCHAR(64)'),
+    ('text', 'pageID', 'INTEGER REFERENCES pages ("pageID")'),
+    # Rows already there join the work queue as pending
+    ('text', 'status', f"VARCHAR(16) NOT NULL DEFAULT '{TEXT_PENDING}'"),
+    ('text', 'lease_owner', 'VARCHAR(255)'),
+    ('text', 'lease_token', 'VARCHAR(36)'),
+    ('text', 'lease_expires_at', 'FLOAT'),
+    ('text', 'attempts', 'INTEGER NOT NULL DEFAULT 0'),
+]
+# Backfilled after being added, then NOT NULL like in the models (PostgreSQL only, SQLite can't alter a column)
+NOT_NULL_COLUMNS = [('entities', 'norm_name'), ('entities', 'norm_type'), ('relationship_types', 'norm_name'), ('text', 'body_hash')]
 
-        self.engine = create_engine(connection_string)
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
-        self.session = self.Session()
+
+def migrate_schema(engine):
+    """Bring tables created by an older version up to the models: add the missing columns, backfill them, merge
+    the duplicates the unique indexes would reject, then create every missing index. A no-op on an up-to-date schema.
+    """
+    inspector = inspect(engine)
+    indexes = {table: {index['name'] for index in inspector.get_indexes(table)} for table in inspector.get_table_names()}
+    columns = {table: {column['name'] for column in inspector.get_columns(table)} for table in inspector.get_table_names()}
+    missing = [(table, column, ddl) for table, column, ddl in ADDED_COLUMNS if column not in columns.get(table, ())]
+    unique_body_hash = _has_unique(inspector, 'text', ['body_hash'])
+    if not missing and unique_body_hash and all(index.name in indexes.get(table.name, ()) for table in Base.metadata.sorted_tables
+                           for index in table.indexes if index.name and _creates_index(index, engine)):
+        return
+
+    logger.info("Migrating the database schema")
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for table, column, ddl in missing:
+            connection.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl}'))
+            logger.info("Added column %s.%s", table, column)
+        _backfill_normalized_names(connection)
+        _merge_duplicate_types(connection)
+        _merge_duplicate_entities(connection)
+        if 'ix_relationships_edge' not in indexes.get('relationships', ()):
+            keep = select(func.min(Relationship.relationshipID)).group_by(Relationship.sourceID, Relationship.targetID, Relationship.typeID)
+            removed = connection.execute(delete(Relationship).where(Relationship.relationshipID.not_in(keep))).rowcount
+            logger.info("Removed %s duplicate relationships", removed)
+        if not unique_body_hash:
+            _backfill_text_hashes(connection)
+            connection.execute(text(f'CREATE UNIQUE INDEX uq_text_body_hash ON {quote("text")} (body_hash)'))
+            logger.info("Created index uq_text_body_hash")
+        if engine.dialect.name == 'postgresql':
+            for table, column in NOT_NULL_COLUMNS:
+                connection.execute(text(f'ALTER TABLE {quote(table)} ALTER COLUMN {quote(column)} SET NOT NULL'))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in indexes.get(table.name, ()) and _creates_index(index, engine):
+                    index.create(connection)
+                    logger.info("Created index %s", index.name)
+
+def _has_unique(inspector, table: str, columns: list) -> bool:
+    if table not in inspector.get_table_names():
+        return False
+    constraints = inspector.get_unique_constraints(table) + [index for index in inspector.get_indexes(table) if index['unique']]
+    return any(constraint['column_names'] == columns for constraint in constraints)
+
+def _creates_index(index, engine) -> bool:
+    # Indexes restricted to another dialect with ddl_if() don't exist here
+    condition = index._ddl_if
+    return condition is None or condition.dialect is None or condition.dialect == engine.dialect.name
+
+def _backfill_normalized_names(connection):
+    for model, key, sources in ((Entity, Entity.entID, {'norm_name': Entity.name, 'norm_type': Entity.type}),
+                                (RelationshipType, RelationshipType.typeID, {'norm_name': RelationshipType.type_name})):
+        table = model.__table__
+        rows = connection.execute(
+            select(key, *sources.values()).where(or_(*(table.c[column].is_(None) for column in sources)))
+        ).all()
+        for batch in _batched(rows, GRAPH_BATCH_SIZE):
+            connection.execute(
+                table.update().where(key == bindparam('row_id')).values({column: bindparam(column) for column in sources}),
+                [{'row_id': row[0], **{column: normalize_name(value) for column, value in zip(sources, row[1:])}} for row in batch],
+            )
+        if rows:
+            logger.info("Backfilled %s for %s %s rows", ', '.join(sources), len(rows), table.name)
+
+def _backfill_text_hashes(connection):
+    # Rows stored twice (the old body filter never matched) become one: the oldest is kept, it may be extracted already
+    texts = Text.__table__
+    rows = connection.execute(select(Text.textID, Text.body).where(Text.body_hash.is_(None))).all()
+    for batch in _batched(rows, GRAPH_BATCH_SIZE):
+        connection.execute(texts.update().where(texts.c.textID == bindparam('row_id')).values(body_hash=bindparam('hash')),
+                           [{'row_id': textID, 'hash': text_hash(body)} for textID, body in batch])
+    keep = select(func.min(Text.textID)).group_by(Text.body_hash)
+    removed = connection.execute(delete(Text).where(Text.textID.not_in(keep))).rowcount
+    logger.info("Backfilled body_hash for %s text rows, removed %s duplicates", len(rows), removed)
+
+def _duplicates(connection, key, *columns) -> dict:
+    """{ID: lowest ID with the same values of columns} of every row that isn't the lowest one."""
+    canonical, mapping = {}, {}
+    for row_id, *values in connection.execute(select(key, *columns).order_by(key)):
+        first = canonical.setdefault(tuple(values), row_id)
+        if first != row_id:
+            mapping[row_id] = first
+    return mapping
+
+def _merge_duplicate_types(connection):
+    # The old substring lookup created a new type whenever it didn't find one, e.g. "Uses" next to "uses"
+    mapping = _duplicates(connection, RelationshipType.typeID, RelationshipType.norm_name)
+    relationships = Relationship.__table__
+    for batch in _batched(list(mapping.items())):
+        connection.execute(relationships.update().where(relationships.c.typeID == bindparam('duplicate')).values(typeID=bindparam('canonical')),
+                           [{'duplicate': duplicate, 'canonical': canonical} for duplicate, canonical in batch])
+        connection.execute(delete(RelationshipType).where(RelationshipType.typeID.in_([duplicate for duplicate, _ in batch])))
+    if mapping:
+        logger.info("Merged %s duplicate relationship types", len(mapping))
+
+def _merge_duplicate_entities(connection):
+    # Like DatabaseManager.merge_entities, without the aliases: the merged names normalize to the canonical one
+    mapping = _duplicates(connection, Entity.entID, Entity.norm_name, Entity.norm_type)
+    attributes, relationships = Attribute.__table__, Relationship.__table__
+    for batch in _batched(list(mapping.items())):
+        duplicates = [duplicate for duplicate, _ in batch]
+        parameters = [{'duplicate': duplicate, 'canonical': canonical} for duplicate, canonical in batch]
+        touched = connection.scalars(
+            select(Relationship.relationshipID).where(or_(Relationship.sourceID.in_(duplicates), Relationship.targetID.in_(duplicates)))
+        ).all()
+        connection.execute(attributes.update().where(attributes.c.entityID == bindparam('duplicate')).values(entityID=bindparam('canonical')), parameters)
+        for column in ('sourceID', 'targetID'):
+            connection.execute(relationships.update().where(relationships.c[column] == bindparam('duplicate')).values({column: bindparam('canonical')}), parameters)
+        for touched_batch in _batched(touched):
+            connection.execute(delete(Relationship).where(Relationship.relationshipID.in_(touched_batch), Relationship.sourceID == Relationship.targetID))
+        connection.execute(delete(Entity).where(Entity.entID.in_(duplicates)))
+    if mapping:
+        logger.info("Merged %s duplicate entities", len(mapping))
+
+
+class DatabaseManager:
+    def __init__(self, connection_string=None, cache_size: int=10000, engine=None, **engine_options):
+        """Initialize the database manager on the shared engine for connection_string.
+
+        engine_options (pool_size, max_overflow, pool_pre_ping, pool_recycle) go to get_engine().
+        The schema isn't touched here; call create_tables() once at startup.
+        """
+        self.engine = engine if engine is not None else get_engine(connection_string, **engine_options)
+        # Thread-local sessions: each thread using this manager gets its own session from the shared pool
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+
+        # name -> ID and ID -> name caches, so repeated resolution doesn't hit the database
+        self.entity_id_cache = LRUCache(cache_size)     # (norm_name, norm_type or None) -> entID
+        self.entity_name_cache = LRUCache(cache_size)   # entID -> (name, type)
+        self.type_id_cache = LRUCache(cache_size)       # norm_name -> typeID
+        self.type_name_cache = LRUCache(cache_size)     # typeID -> type_name
+
+    @property
+    def session(self):
+        """The calling thread's session."""
+        return self.Session()
+
+    @contextmanager
+    def session_scope(self):
+        """Unit of work on its own session: commits on success, rolls back on error, always returns the connection to the pool."""
+        session = self.Session.session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     def close_db(self):
-        """Close the connection to the PostgreSQL database."""
-        self.session.close()
+        """Close the calling thread's session and return its connection to the pool."""
+        self.Session.remove()
 
     def create_tables(self):
         """Create the necessary tables in the database."""
-        Base.metadata.create_all(self.engine)
+        create_tables(self.engine)
+
+    # Cache methods
+    def cache_stats(self) -> dict:
+        """Hit/miss counters and current size of each lookup cache."""
+        caches = {
+            'entity_id': self.entity_id_cache,
+            'entity_name': self.entity_name_cache,
+            'type_id': self.type_id_cache,
+            'type_name': self.type_name_cache,
+        }
+        return {name: {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache)} for name, cache in caches.items()}
+
+    def clear_cache(self):
+        self.entity_id_cache.clear()
+        self.entity_name_cache.clear()
+        self.type_id_cache.clear()
+        self.type_name_cache.clear()
+
+    def _cache_entity(self, entID, name, type):
+        self.entity_id_cache.put((normalize_name(name), normalize_name(type)), entID)
+        self.entity_name_cache.put(entID, (name, type))
+
+    def _forget_entity(self, entity):
+        self.entity_id_cache.pop((entity.norm_name, entity.norm_type))
+        self.entity_id_cache.pop((entity.norm_name, None))
+        self.entity_name_cache.pop(entity.entID)
+
+    def _cache_type(self, typeID, type_name):
+        self.type_id_cache.put(normalize_name(type_name), typeID)
+        self.type_name_cache.put(typeID, type_name)
+
+    def _forget_type(self, relationship_type):
+        self.type_id_cache.pop(relationship_type.norm_name)
+        self.type_name_cache.pop(relationship_type.typeID)
+
+    # Bulk methods
+    def _insert_ignore(self, model, rows: list, conflict_columns: list):
+        """Insert rows set-wise, skipping any that collide with the unique key on conflict_columns."""
+        dialect = self.engine.dialect.name
+        for batch in _batched(rows):
+            # The dialect modules are already loaded by the engine by the time we get here
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects import postgresql
+                stmt = postgresql.insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+            elif dialect == 'sqlite':
+                from sqlalchemy.dialects import sqlite
+                stmt = sqlite.insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+            else:
+                # No native upsert, so drop the keys that already exist before a plain insert
+                key_columns = [getattr(model, column) for column in conflict_columns]
+                keys = [tuple(row[column] for column in conflict_columns) for row in batch]
+                existing = set(self.session.execute(select(*key_columns).where(tuple_(*key_columns).in_(keys))).all())
+                batch = [row for row, key in zip(batch, keys) if key not in existing]
+                if not batch:
+                    continue
+                stmt = insert(model)
+            self.session.execute(stmt, batch)
+
+    def _lookup_rows(self, columns: list, key_columns: list, keys: list) -> dict:
+        """Map each key tuple to its row of columns, one SELECT per batch."""
+        rows = {}
+        for batch in _batched(keys):
+            query = select(*columns, *key_columns).where(tuple_(*key_columns).in_(batch))
+            for row in self.session.execute(query):
+                row = tuple(row)
+                rows[row[len(columns):]] = row[:len(columns)]
+        return rows
+
+    @METRICS.timed('db.bulk_upsert_entities')
+    def bulk_upsert_entities(self, entities: list) -> list:
+        """Insert any new (name, type) pairs in one batch and return the entIDs in input order."""
+        entity_keys = [(normalize_name(name), normalize_name(type)) for name, type in entities]
+        ids = {}
+        rows = {}
+        for (name, type), key in zip(entities, entity_keys):
+            if key in ids or key in rows:
+                continue
+            entID = self.entity_id_cache.get(key)
+            if entID is None:
+                rows[key] = {'name': name, 'type': type, 'norm_name': key[0], 'norm_type': key[1]}
+            else:
+                ids[key] = entID
+        if rows:
+            self._insert_ignore(Entity, list(rows.values()), ['norm_name', 'norm_type'])
+            found = self._lookup_rows([Entity.entID, Entity.name, Entity.type], [Entity.norm_name, Entity.norm_type], list(rows))
+            self.session.commit()
+            for key, (entID, name, type) in found.items():
+                self._cache_entity(entID, name, type)
+                ids[key] = entID
+        return [ids[key] for key in entity_keys]
+
+    @METRICS.timed('db.bulk_upsert_relationship_types')
+    def bulk_upsert_relationship_types(self, type_names: list) -> list:
+        """Insert any new relationship type names in one batch and return the typeIDs in input order."""
+        type_keys = [normalize_name(type_name) for type_name in type_names]
+        ids = {}
+        rows = {}
+        for type_name, key in zip(type_names, type_keys):
+            if key in ids or key in rows:
+                continue
+            typeID = self.type_id_cache.get(key)
+            if typeID is None:
+                rows[key] = {'type_name': type_name, 'norm_name': key}
+            else:
+                ids[key] = typeID
+        if rows:
+            self._insert_ignore(RelationshipType, list(rows.values()), ['norm_name'])
+            found = self._lookup_rows([RelationshipType.typeID, RelationshipType.type_name], [RelationshipType.norm_name], [(key,) for key in rows])
+            self.session.commit()
+            for (key,), (typeID, type_name) in found.items():
+                self._cache_type(typeID, type_name)
+                ids[key] = typeID
+        return [ids[key] for key in type_keys]
+
+    @METRICS.timed('db.bulk_upsert_relationships')
+    def bulk_upsert_relationships(self, relationships: list) -> list:
+        """Insert any new (sourceID, targetID, typeID) edges in one batch and return the relationshipIDs in input order."""
+        keys = _unique([tuple(relationship) for relationship in relationships])
+        if not keys:
+            return []
+        rows = [{'sourceID': sourceID, 'targetID': targetID, 'typeID': typeID} for sourceID, targetID, typeID in keys]
+        self._insert_ignore(Relationship, rows, ['sourceID', 'targetID', 'typeID'])
+        found = self._lookup_rows([Relationship.relationshipID], [Relationship.sourceID, Relationship.targetID, Relationship.typeID], keys)
+        self.session.commit()
+        return [found[tuple(relationship)][0] for relationship in relationships]
+
+    @METRICS.timed('db.bulk_upsert_named_relationships')
+    def bulk_upsert_named_relationships(self, relationships: list) -> list:
+        """Store (source name, target name, type name) triples, resolving names through the ID caches.
+
+        Triples whose source or target entity isn't stored yet are skipped.
+        Returns the relationshipIDs of the stored triples.
+        """
+        resolved = []
+        for source, target, type_name in relationships:
+            sourceID = self.get_entity_id(source)
+            targetID = self.get_entity_id(target)
+            if sourceID is not None and targetID is not None:
+                resolved.append((sourceID, targetID, type_name))
+        type_ids = self.bulk_upsert_relationship_types([type_name for _, _, type_name in resolved])
+        return self.bulk_upsert_relationships([
+            (sourceID, targetID, typeID) for (sourceID, targetID, _), typeID in zip(resolved, type_ids)
+        ])
+
+    @METRICS.timed('db.bulk_add_texts')
+    def bulk_add_texts(self, bodies: list, pageID: int=None) -> list:
+        """Add the text entries that aren't stored yet (by body_hash) with a single commit.
+
+        Returns the textIDs of the newly added entries only.
+        """
+        rows = {}
+        for body in bodies:
+            rows.setdefault(text_hash(body), {'body': body, 'body_hash': text_hash(body), 'pageID': pageID})
+        if not rows:
+            return []
+        existing = self._lookup_rows([Text.textID], [Text.body_hash], [(body_hash,) for body_hash in rows])
+        new_rows = [row for body_hash, row in rows.items() if (body_hash,) not in existing]
+        self._insert_ignore(Text, new_rows, ['body_hash'])
+        added = self._lookup_rows([Text.textID], [Text.body_hash], [(row['body_hash'],) for row in new_rows])
+        self.session.commit()
+        return [added[(row['body_hash'],)][0] for row in new_rows if (row['body_hash'],) in added]
+
+    def get_entity_id(self, name: str, type: str=None):
+        """Exact (normalized) lookup of an entity's ID, None if it doesn't exist."""
+        key = (normalize_name(name), normalize_name(type) if type else None)
+        entID = self.entity_id_cache.get(key)
+        if entID is not None:
+            return entID
+        query = select(Entity.entID).where(Entity.norm_name == key[0])
+        if type:
+            query = query.where(Entity.norm_type == key[1])
+        entID = self.session.execute(query.order_by(Entity.entID).limit(1)).scalar()
+        if entID is not None:
+            self.entity_id_cache.put(key, entID)
+        return entID
+
+    def get_entity_name(self, entID: int):
+        """Name of the entity with this ID, None if it doesn't exist."""
+        cached = self.entity_name_cache.get(entID)
+        if cached is not None:
+            return cached[0]
+        row = self.session.execute(select(Entity.name, Entity.type).where(Entity.entID == entID)).first()
+        if row is None:
+            return None
+        self._cache_entity(entID, row.name, row.type)
+        return row.name
 
     def search_entities(self, entityID: int=None, name: str=None, type: str=None):
-        """Search for entities by name or type."""
+        """Search for entities by ID, exact name or exact type."""
         query = self.session.query(Entity)
         if entityID:
             query = query.filter(Entity.entID == entityID)
+        if name:
+            query = query.filter(Entity.norm_name == normalize_name(name))
+        if type:
+            query = query.filter(Entity.norm_type == normalize_name(type))
+        return query.all()
+
+    def fuzzy_search_entities(self, name: str=None, type: str=None, limit: int=None):
+        """Substring search on entity name/type, backed by a trigram index on PostgreSQL."""
+        query = self.session.query(Entity)
         if name:
             query = query.filter(Entity.name.ilike(f'%{name}%'))
         if type:
             query = query.filter(Entity.type.ilike(f'%{type}%'))
+        if limit:
+            query = query.limit(limit)
         return query.all()
 
     def add_entity(self, name, type):
         """Add a new entity to the entities table."""
-        entity = Entity(name=name, type=type)
+        entity = Entity(name=name, type=type, norm_name=normalize_name(name), norm_type=normalize_name(type))
         self.session.add(entity)
         self.session.commit()
-        print(f"Entity added with ID: {entity.entID}")
+        self._cache_entity(entity.entID, name, type)
+        logger.debug("Entity added with ID: %s", entity.entID)
 
     def delete_entity(self, entID):
         """Delete an entity from the entities table."""
         entity = self.session.query(Entity).filter_by(entID=entID).first()
         if entity:
+            self._forget_entity(entity)
             self.session.delete(entity)
             self.session.commit()
-            print(f"Entity with ID {entID} deleted.")
+            logger.debug("Entity with ID %s deleted.", entID)
 
     def edit_entity(self, entID, new_name, new_type):
         """Edit an existing entity in the entities table."""
         entity = self.session.query(Entity).filter_by(entID=entID).first()
         if entity:
+            self._forget_entity(entity)
             entity.name = new_name
             entity.type = new_type
+            entity.norm_name = normalize_name(new_name)
+            entity.norm_type = normalize_name(new_type)
             self.session.commit()
-            print(f"Entity with ID {entID} updated.")
+            logger.debug("Entity with ID %s updated.", entID)
 
     # Relationship methods
     def add_relationship(self, sourceID, targetID, typeID):
@@ -138,13 +779,15 @@ class DatabaseManager:
 
     # RelationshipType methods
     def add_relationship_type(self, type_name):
-        new_type = RelationshipType(type_name=type_name)
+        new_type = RelationshipType(type_name=type_name, norm_name=normalize_name(type_name))
         self.session.add(new_type)
         self.session.commit()
+        self._cache_type(new_type.typeID, type_name)
 
     def delete_relationship_type(self, typeID):
         relationship_type = self.session.query(RelationshipType).filter_by(typeID=typeID).first()
         if relationship_type:
+            self._forget_type(relationship_type)
             self.session.delete(relationship_type)
             self.session.commit()
 
@@ -152,17 +795,47 @@ class DatabaseManager:
         relationship_type = self.session.query(RelationshipType).filter_by(typeID=typeID).first()
         if relationship_type:
             if type_name:
+                self._forget_type(relationship_type)
                 relationship_type.type_name = type_name
+                relationship_type.norm_name = normalize_name(type_name)
             self.session.commit()
 
+    def get_type_id(self, type_name: str):
+        """Exact (normalized) lookup of a relationship type's ID, None if it doesn't exist."""
+        key = normalize_name(type_name)
+        typeID = self.type_id_cache.get(key)
+        if typeID is not None:
+            return typeID
+        typeID = self.session.execute(select(RelationshipType.typeID).where(RelationshipType.norm_name == key)).scalar()
+        if typeID is not None:
+            self.type_id_cache.put(key, typeID)
+        return typeID
+
+    def get_type_name(self, typeID: int):
+        """Name of the relationship type with this ID, None if it doesn't exist."""
+        type_name = self.type_name_cache.get(typeID)
+        if type_name is not None:
+            return type_name
+        type_name = self.session.execute(select(RelationshipType.type_name).where(RelationshipType.typeID == typeID)).scalar()
+        if type_name is not None:
+            self._cache_type(typeID, type_name)
+        return type_name
+
     def search_relationship_types(self, type_name=None, typeID=None):
         query = self.session.query(RelationshipType)
         if type_name:
-            query = query.filter(RelationshipType.type_name.like(f'%{type_name}%'))
+            query = query.filter(RelationshipType.norm_name == normalize_name(type_name))
         if typeID:
             query = query.filter(RelationshipType.typeID == typeID)
         return query.all()
 
+    def fuzzy_search_relationship_types(self, type_name: str, limit: int=None):
+        """Substring search on relationship type names, backed by a trigram index on PostgreSQL."""
+        query = self.session.query(RelationshipType).filter(RelationshipType.type_name.ilike(f'%{type_name}%'))
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
     # Attribute methods
     def add_attribute(self, name, value, entityID):
         new_attribute = Attribute(name=name, value=value, entityID=entityID)
@@ -192,41 +865,302 @@ class DatabaseManager:
             query = query.filter(Attribute.entityID == entityID)
         return query.all()
 
+    # Alias methods
+    @METRICS.timed('db.add_aliases')
+    def add_aliases(self, aliases: list) -> int:
+        """Record (alias name, entID) pairs as alias attributes of the entities, skipping ones already recorded.
+
+        Returns the number of new alias rows.
+        """
+        keys = _unique((ALIAS_ATTRIBUTE, alias, entID) for alias, entID in aliases if entID is not None)
+        existing = self._lookup_rows([Attribute.attributeID], [Attribute.name, Attribute.value, Attribute.entityID], keys)
+        rows = [{'name': name, 'value': alias, 'entityID': entID} for name, alias, entID in keys if (name, alias, entID) not in existing]
+        for batch in _batched(rows):
+            self.session.execute(insert(Attribute), batch)
+        self.session.commit()
+        return len(rows)
+
+    def iter_aliases(self, batch_size: int=GRAPH_BATCH_SIZE):
+        """Yield (alias, entity name, entity type) for every recorded alias."""
+        query = (
+            select(Attribute.value, Entity.name, Entity.type)
+            .join(Entity, Attribute.entityID == Entity.entID)
+            .where(Attribute.name == ALIAS_ATTRIBUTE)
+            .execution_options(yield_per=batch_size)
+        )
+        for rows in self.session.connection().execute(query).partitions():
+            yield from rows
+
+    @METRICS.timed('db.merge_entities')
+    def merge_entities(self, mapping: dict) -> dict:
+        """Fold each entity of {duplicate entID: canonical entID} into its canonical entity and delete it.
+
+        The duplicate's name is kept as an alias, its attributes move over and its relationships are re-pointed;
+        re-pointed relationships that already exist are dropped, and so are ones that would become self-loops.
+        Returns counts of merged entities, re-pointed relationships and dropped self-loops.
+        """
+        stats = {'entities': 0, 'relationships': 0, 'self_loops': 0}
+        if not mapping:
+            return stats
+        session = self.session
+        duplicates = list(mapping)
+        names = self._lookup_rows([Entity.name], [Entity.entID], [(entID,) for entID in duplicates])
+        self.add_aliases([(names[(entID,)][0], mapping[entID]) for entID in duplicates if (entID,) in names])
+
+        for batch in _batched(duplicates):
+            # Core statement: the ORM form of an executemany UPDATE wants primary keys
+            attributes = Attribute.__table__
+            session.connection().execute(
+                attributes.update().where(attributes.c.entityID == bindparam('duplicate')).values(entityID=bindparam('canonical')),
+                [{'duplicate': entID, 'canonical': mapping[entID]} for entID in batch],
+            )
+            touched = session.execute(
+                select(Relationship.relationshipID, Relationship.sourceID, Relationship.targetID, Relationship.typeID)
+                .where(or_(Relationship.sourceID.in_(batch), Relationship.targetID.in_(batch)))
+            ).all()
+            if touched:
+                session.execute(delete(Relationship).where(Relationship.relationshipID.in_([row[0] for row in touched])))
+                repointed = _unique(
+                    (mapping.get(sourceID, sourceID), mapping.get(targetID, targetID), typeID) for _, sourceID, targetID, typeID in touched
+                )
+                rows = [{'sourceID': sourceID, 'targetID': targetID, 'typeID': typeID} for sourceID, targetID, typeID in repointed if sourceID != targetID]
+                self._insert_ignore(Relationship, rows, ['sourceID', 'targetID', 'typeID'])
+                stats['relationships'] += len(touched)
+                stats['self_loops'] += len(repointed) - len(rows)
+            stats['entities'] += session.execute(delete(Entity).where(Entity.entID.in_(batch))).rowcount
+        session.commit()
+        self.clear_cache()
+        return stats
+
+    # Graph methods
+    def iter_entity_batches(self, batch_size: int=GRAPH_BATCH_SIZE):
+        return stream_entity_batches(self.session, batch_size)
+
+    def iter_graph_nodes(self, batch_size: int=GRAPH_BATCH_SIZE):
+        return stream_graph_nodes(self.session, batch_size)
+
+    def iter_graph_edges(self, batch_size: int=GRAPH_BATCH_SIZE):
+        return stream_graph_edges(self.session, batch_size)
+
+    def graph_version(self) -> str:
+        return graph_version(self.session)
+
+    def export_snapshot(self, directory: str=None, full: bool=False, format: str="arrow") -> str:
+        """Write a graph_snapshot snapshot of the graph tables (a delta on the latest one unless full); returns its name."""
+        from graph_snapshot import SnapshotStore
+        return SnapshotStore(directory, format).export(self, full=full)
+
+    def entity_type_counts(self) -> list:
+        """[(entity type, number of entities)], most common first."""
+        count = func.count(Entity.entID)
+        return self.session.execute(select(Entity.type, count).group_by(Entity.type).order_by(count.desc())).all()
+
+    def relationship_type_counts(self) -> list:
+        """[(relationship type, number of relationships)], most common first."""
+        count = func.count(Relationship.relationshipID)
+        query = (
+            select(RelationshipType.type_name, count)
+            .join(Relationship, Relationship.typeID == RelationshipType.typeID)
+            .group_by(RelationshipType.type_name)
+            .order_by(count.desc())
+        )
+        return self.session.execute(query).all()
+
+    def page_entities(self, name: str=None, types: list=None, offset: int=0, limit: int=50) -> tuple:
+        """One page of entities ordered by name, optionally filtered by name substring and types: ([(entID, name, type)], total)."""
+        conditions = []
+        if name:
+            conditions.append(Entity.name.ilike(f'%{name}%'))
+        if types:
+            conditions.append(Entity.type.in_(types))
+        total = self.session.execute(select(func.count(Entity.entID)).where(*conditions)).scalar()
+        rows = self.session.execute(
+            select(Entity.entID, Entity.name, Entity.type).where(*conditions).order_by(Entity.name, Entity.entID).offset(offset).limit(limit)
+        ).all()
+        return rows, total
+
+    # LLM response cache methods
+    def get_llm_response(self, key: str, ttl: float=None):
+        """Cached LLM response for this key, None if missing or older than ttl seconds."""
+        entry = self.session.get(LLMResponse, key)
+        if entry is None:
+            return None
+        now = time.time()
+        if ttl is not None and now - entry.created_at > ttl:
+            self.session.delete(entry)
+            self.session.commit()
+            return None
+        entry.accessed_at = now
+        self.session.commit()
+        return entry.response
+
+    def set_llm_response(self, key: str, response: str):
+        now = time.time()
+        self.session.merge(LLMResponse(key=key, response=response, created_at=now, accessed_at=now))
+        self.session.commit()
+
+    def evict_llm_responses(self, ttl: float=None, max_entries: int=None):
+        """Drop expired cache entries, then the least recently used ones beyond max_entries."""
+        if ttl is not None:
+            self.session.execute(delete(LLMResponse).where(LLMResponse.created_at < time.time() - ttl))
+        if max_entries is not None:
+            keep = select(LLMResponse.key).order_by(LLMResponse.accessed_at.desc()).limit(max_entries)
+            self.session.execute(delete(LLMResponse).where(LLMResponse.key.not_in(keep)))
+        self.session.commit()
+
+    # Page methods
+    def get_page(self, url: str):
+        return self.session.query(Page).filter(Page.url == url).first()
+
+    @METRICS.timed('db.get_page_validators')
+    def get_page_validators(self, urls: list) -> dict:
+        """{url: (etag, last_modified)} for the urls fetched before, for conditional re-fetches."""
+        validators = {}
+        for batch in _batched(_unique(urls), BULK_BATCH_SIZE):
+            rows = self.session.execute(select(Page.url, Page.etag, Page.last_modified).where(Page.url.in_(batch)))
+            validators.update((url, (etag, last_modified)) for url, etag, last_modified in rows)
+        return validators
+
+    @METRICS.timed('db.record_page')
+    def record_page(self, url: str, content_hash: str, etag: str=None, last_modified: str=None):
+        """Store a fetch of url and return (pageID, changed), changed being False when the content hash is the same as last time."""
+        page = self.get_page(url)
+        changed = page is None or page.content_hash != content_hash
+        if page is None:
+            page = Page(url=url)
+            self.session.add(page)
+        page.content_hash = content_hash
+        page.etag = etag
+        page.last_modified = last_modified
+        page.fetched_at = time.time()
+        self.session.commit()
+        return page.pageID, changed
+
+    def touch_page(self, url: str):
+        """Record a fetch that came back unchanged (e.g. HTTP 304)."""
+        page = self.get_page(url)
+        if page:
+            page.fetched_at = time.time()
+            self.session.commit()
+
     # Text methods
     def add_text(self, body):
         """Add a new text entry to the text table."""
-        new_text = Text(body=body)
+        new_text = Text(body=body, body_hash=text_hash(body))
         self.session.add(new_text)
         self.session.commit()
-        print(f"Text added with ID: {new_text.textID}")
+        logger.debug("Text added with ID: %s", new_text.textID)
 
     def delete_text(self, textID: int=None, textBody: str=None):
         """Delete a text entry from the text table."""
         text_entry = None
         if textBody:
-            text_entry = self.session.query(Text).filter(Text.body == textBody)
+            text_entry = self.session.query(Text).filter(Text.body_hash == text_hash(textBody))
         if textID:
-            text_entry = self.session.query(Text).filter_by(textID=textID).first()
+            text_entry = self.session.query(Text).filter_by(textID=textID)
         if text_entry != None:
             text_entry.delete()
             self.session.commit()
-            print("Text deleted.")
+            logger.debug("Text deleted.")
+
+    # Text work queue methods
+    @METRICS.timed('db.claim_texts')
+    def claim_texts(self, worker_id: str, limit: int=400, lease_seconds: float=300) -> list:
+        """Lease up to limit pending text rows (or rows whose lease ran out) to worker_id.
+
+        Returns rows with textID, body and lease_token; ack or nack them as (textID, lease_token) pairs. On
+        PostgreSQL concurrent workers skip each other's rows with FOR UPDATE SKIP LOCKED; elsewhere the claim is a
+        single UPDATE, which SQLite serializes.
+        """
+        now = time.time()
+        token = str(uuid.uuid4())
+        claimable = or_(
+            Text.status == TEXT_PENDING,
+            (Text.status == TEXT_LEASED) & (Text.lease_expires_at < now),
+        )
+        candidates = select(Text.textID).where(claimable).order_by(Text.textID).limit(limit)
+        if self.engine.dialect.name == 'postgresql':
+            candidates = candidates.with_for_update(skip_locked=True)
+        self.session.execute(
+            update(Text)
+            .where(Text.textID.in_(candidates.scalar_subquery()))
+            .values(status=TEXT_LEASED, lease_owner=worker_id, lease_token=token,
+                    lease_expires_at=now + lease_seconds, attempts=Text.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        self.session.commit()
+        return self.session.execute(
+            select(Text.textID, Text.body, Text.lease_token).where(Text.lease_token == token).order_by(Text.textID)
+        ).all()
+
+    def _settle_texts(self, leases: list, outcomes: list) -> list:
+        """Apply (status, condition) outcomes to the (textID, lease_token) rows still under that lease.
+
+        Returns the textIDs whose lease had run out and been claimed again (or settled) since, which are left alone.
+        """
+        by_token = {}
+        for textID, token in leases:
+            by_token.setdefault(token, []).append(textID)
+        lost = []
+        for token, textIDs in by_token.items():
+            for batch in _batched(textIDs):
+                settled = set()
+                for status, condition in outcomes:
+                    settled.update(self.session.scalars(
+                        update(Text).where(Text.textID.in_(batch), Text.lease_token == token, condition)
+                        .values(status=status, lease_owner=None, lease_token=None, lease_expires_at=None)
+                        .returning(Text.textID)
+                        .execution_options(synchronize_session=False)
+                    ).all())
+                lost.extend(textID for textID in batch if textID not in settled)
+        self.session.commit()
+        return lost
+
+    @METRICS.timed('db.ack_texts')
+    def ack_texts(self, leases: list) -> list:
+        """Mark (textID, lease_token) rows from claim_texts as processed; returns the textIDs whose lease was lost."""
+        lost = self._settle_texts(leases, [(TEXT_DONE, true())])
+        if lost:
+            logger.warning("Lease lost before ack on %d texts: %s", len(lost), lost)
+        return lost
+
+    @METRICS.timed('db.nack_texts')
+    def nack_texts(self, leases: list, max_attempts: int=3) -> list:
+        """Return (textID, lease_token) rows to the queue, or mark them failed once they've used up max_attempts.
+
+        Returns the textIDs whose lease was lost.
+        """
+        lost = self._settle_texts(leases, [(TEXT_FAILED, Text.attempts >= max_attempts), (TEXT_PENDING, Text.attempts < max_attempts)])
+        if lost:
+            logger.warning("Lease lost before nack on %d texts: %s", len(lost), lost)
+        return lost
+
+    def queue_stats(self) -> dict:
+        """Number of text rows per queue status."""
+        return dict(self.session.execute(select(Text.status, func.count()).group_by(Text.status)).all())
 
     def edit_text(self, textID, new_body):
         """Edit an existing text entry in the text table."""
         text_entry = self.session.query(Text).filter_by(textID=textID).first()
         if text_entry:
             text_entry.body = new_body
+            text_entry.body_hash = text_hash(new_body)
             self.session.commit()
-            print(f"Text with ID {textID} updated.")
+            logger.debug("Text with ID %s updated.", textID)
         
     
     def load_text(self, text: str=None, offset: int=None, limit: int=None):
         query = self.session.query(Text)
         if text:
-            query = query.filter(Text.body == (f'%{text}%'))
+            query = query.filter(Text.body_hash == text_hash(text))
         if offset:
             query = query.offset(offset)
         if limit:
             query = query.limit(limit)
-        return query.all()
\ No newline at end of file
+        return query.all()
+
+if __name__ == "__main__":
+    # One-time schema setup: python database_manager.py
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    create_tables()
+    logger.info("Tables created.")
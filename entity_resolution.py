@@ -0,0 +1,346 @@
+"""Entity resolution: map near-duplicate entity names onto one canonical entity before they are stored.
+
+"Python", "python 3.11" and "the Python language" become one entity, the first one seen; the others are recorded
+as its aliases (Attribute rows named database_manager.ALIAS_ATTRIBUTE). Names are never compared all-pairs:
+
+- entity_key() blocks exactly: lowercased, punctuation, leading articles, trailing version markers ("v2", "3.11")
+  and generic qualifiers ("language", "library", ...) removed and plurals singularized. A bare trailing number
+  stays: "World War 1" and "Windows 10" are not versions of "World War" and "Windows".
+- Keys that don't match exactly are compared by character-trigram Jaccard similarity, but only against
+  candidates sharing a MinHash-LSH bucket (a few per band), so each name costs about the same however many are stored.
+- Numbers are never matched fuzzily: names only merge when their number tokens (anything with a digit, and roman
+  numerals after the first word) are the same. A name without any still merges into one of its versions by key, so
+  "Python 2.7" and "Python 3.12" both become "Python" but never each other, and "Super Bowl LVII" stays apart from
+  "Super Bowl LVIII".
+
+Merge the duplicates already in the database with:
+    python entity_resolution.py [--threshold 0.8] [--dry-run]
+"""
+import argparse
+import itertools
+import logging
+import re
+import zlib
+import numpy
+from database_manager import DatabaseManager, GRAPH_BATCH_SIZE, normalize_name
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+ARTICLES = {"the", "a", "an"}
+# Trailing words that only say what kind of thing the entity is: "python language" is python
+GENERIC_QUALIFIERS = ("programming language", "language", "library", "framework")
+# Words ending in s that are singular already: "news" is not the plural of "new"
+SINGULAR_WORDS = {
+    "news", "series", "species", "means", "windows", "lens", "corps", "diabetes", "measles", "whereabouts",
+    "physics", "mathematics", "economics", "politics", "ethics", "statistics", "analytics", "graphics", "robotics",
+    "genetics", "linguistics", "electronics", "logistics", "athletics", "gymnastics",
+}
+# Keys shorter than this are only matched exactly, their trigram sets are too small to tell names apart
+MIN_FUZZY_LENGTH = 4
+DEFAULT_THRESHOLD = 0.8
+
+# MinHash-LSH: LSH_BANDS bands of LSH_ROWS hash values. Pairs with Jaccard similarity 0.8 share a bucket with
+# probability 1 - (1 - 0.8 ** 4) ** 10 = 99.5%, pairs at 0.3 with 8%, and those are then ruled out
+LSH_BANDS = 10
+LSH_ROWS = 4
+# Canonical entities compared per bucket, the oldest ones, which bounds the work on common trigram patterns
+LSH_WINDOW = 8
+# Candidates whose MinHash estimate of the similarity is this far below the threshold are dropped before the
+# exact comparison; about 2.5 standard deviations of the estimate at 0.8 with LSH_BANDS * LSH_ROWS hashes
+ESTIMATE_MARGIN = 0.2
+# Buckets of newly added entities are merged into the sorted bucket arrays once there are this many
+LSH_MERGE_EVERY = 65536
+_PRIME = (1 << 31) - 1
+
+# Keeps c++ and c# apart from c, and the dots of version numbers like 3.11
+_NON_WORD = re.compile(r"(?!(?<=\d)\.\d)[^\w+#]+")
+_VERSION = re.compile(r"^(v\d+(\.\d+)*|\d+(\.\d+)+)[a-z]?$")  # v2, v1.2, 3.11, 2.7b; not 2 or 10
+_ROMAN = re.compile(r"^m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})$")
+_QUALIFIER_TOKENS = [tuple(qualifier.split()) for qualifier in GENERIC_QUALIFIERS]
+
+
+def _singular(token: str) -> str:
+    if token in SINGULAR_WORDS:
+        return token
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def entity_key(name: str) -> str:
+    """Blocking key of an entity name: "The Python 3.11 programming languages" -> "python"."""
+    tokens = _NON_WORD.sub(" ", name.lower()).split()
+    while len(tokens) > 1 and tokens[0] in ARTICLES:
+        tokens.pop(0)
+    stripped = True
+    while stripped and len(tokens) > 1:
+        stripped = False
+        if _VERSION.match(tokens[-1]):
+            tokens.pop()
+            stripped = True
+            continue
+        for qualifier in _QUALIFIER_TOKENS:
+            if len(tokens) > len(qualifier) and tuple(tokens[-len(qualifier):]) == qualifier:
+                del tokens[-len(qualifier):]
+                stripped = True
+                break
+    return " ".join(_singular(token) for token in tokens) or normalize_name(name)
+
+
+def number_tokens(name: str) -> tuple:
+    """The tokens of a name that number it: "Super Bowl LVII" -> ("lvii",), "Python 3.11" -> ("3.11",)."""
+    tokens = _NON_WORD.sub(" ", name.lower()).split()
+    return tuple(
+        token for position, token in enumerate(tokens)
+        if any(character.isdigit() for character in token) or (position and _ROMAN.match(token))
+    )
+
+
+def _trigrams(key: str) -> set:
+    # Without spaces, so "data frame" and "dataframe" compare equal
+    padded = f" {key.replace(' ', '')} "
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+
+def _jaccard(first: set, second: set) -> float:
+    return len(first & second) / len(first | second)
+
+
+class EntityResolver:
+    def __init__(self, threshold: float=DEFAULT_THRESHOLD, match_types: bool=True, window: int=LSH_WINDOW, seed: int=0):
+        """threshold is the trigram Jaccard similarity above which two keys are the same entity. With match_types
+        only entities of the same (normalized) type are merged.
+        """
+        self.threshold = threshold
+        self.match_types = match_types
+        self.window = window
+        rng = numpy.random.default_rng(seed)
+        permutations = LSH_BANDS * LSH_ROWS
+        self._multipliers = rng.integers(1, _PRIME, permutations, dtype=numpy.uint64)[:, None]
+        self._offsets = rng.integers(0, _PRIME, permutations, dtype=numpy.uint64)[:, None]
+        self._band_mix = rng.integers(1, 1 << 63, LSH_ROWS, dtype=numpy.uint64) | numpy.uint64(1)
+
+        # Canonical entities, by index
+        self._names, self._types, self._keys, self._numbers, self._entity_ids = [], [], [], [], []
+        self._signatures = numpy.zeros((1024, permutations), dtype=numpy.uint32)
+        self._by_key = {}         # (type key, entity key) -> canonical index
+        self._by_alias = {}       # (type key, normalized name) -> canonical index, for names seen before
+        self._alias_names = {}    # normalized alias name -> canonical index, for relationships which carry no type
+        # LSH buckets: sorted arrays of bucket -> canonical index, plus buckets added since the last merge
+        self._bucket_keys = numpy.empty(0, dtype=numpy.uint64)
+        self._bucket_ids = numpy.empty(0, dtype=numpy.int64)
+        self._recent = {}
+        self._recent_count = 0
+        self.new_aliases = []     # (alias name, canonical name, canonical type) found since the last take_aliases()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _type_key(self, type: str) -> str:
+        return normalize_name(type) if self.match_types else ""
+
+    def _buckets(self, keys: list, type_keys: list) -> tuple:
+        """MinHash signatures of the keys' trigrams and their (len(keys), LSH_BANDS) bucket IDs, in one vectorized pass."""
+        grams = [[zlib.crc32(gram.encode()) for gram in _trigrams(key)] for key in keys]
+        values = numpy.fromiter(itertools.chain.from_iterable(grams), dtype=numpy.uint64)
+        starts = numpy.zeros(len(grams), dtype=numpy.int64)
+        numpy.cumsum([len(hashes) for hashes in grams[:-1]], out=starts[1:])
+        signatures = numpy.minimum.reduceat((self._multipliers * values + self._offsets) % numpy.uint64(_PRIME), starts, axis=1).T
+        # Rows of a band mixed into one value (wrapping multiply-add), tagged with the band and the entity type
+        bands = (signatures.reshape(len(keys), LSH_BANDS, LSH_ROWS) * self._band_mix).sum(axis=2)
+        types = numpy.array([zlib.crc32(type_key.encode()) for type_key in type_keys], dtype=numpy.uint64)[:, None]
+        bands ^= types * numpy.uint64(0x9E3779B97F4A7C15)
+        return signatures.astype(numpy.uint32), (bands & ~numpy.uint64(0xFF)) | numpy.arange(LSH_BANDS, dtype=numpy.uint64)
+
+    def _stored_candidates(self, signatures: numpy.ndarray, buckets: numpy.ndarray) -> list:
+        """Per row, the canonical indexes of the sorted bucket arrays sharing a bucket with it (window per bucket)
+        whose MinHash estimate of the similarity is within ESTIMATE_MARGIN of the threshold. One pass per batch.
+        """
+        flat = buckets.ravel()
+        starts = numpy.searchsorted(self._bucket_keys, flat, side='left')
+        counts = numpy.minimum(numpy.searchsorted(self._bucket_keys, flat, side='right') - starts, self.window)
+        positions = numpy.arange(counts.sum()) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+        # (row, candidate) pairs, once each even when they share several bands, sorted by row
+        stride = max(len(self._names), 1)
+        pairs = numpy.unique(numpy.repeat(numpy.arange(len(flat)) // LSH_BANDS, counts) * stride + self._bucket_ids[positions])
+        rows, candidates = pairs // stride, pairs % stride
+        close = (self._signatures[candidates] == signatures[rows]).mean(axis=1) >= self.threshold - ESTIMATE_MARGIN
+        rows, candidates = rows[close], candidates[close]
+        bounds = numpy.searchsorted(rows, numpy.arange(len(signatures) + 1))
+        return [candidates[bounds[row]:bounds[row + 1]] for row in range(len(signatures))]
+
+    def _fuzzy_match(self, key: str, numbers: tuple, signature: numpy.ndarray, buckets: numpy.ndarray, candidates: numpy.ndarray):
+        """Canonical index of the most similar key at or above the threshold among candidates and the entities
+        added since the last merge that share a bucket, or None. Only candidates with the same number tokens count.
+        """
+        recent = {index for bucket in buckets.tolist() for index in self._recent.get(bucket, ())[:self.window]}
+        if recent:
+            recent = numpy.fromiter(recent, dtype=numpy.int64, count=len(recent))
+            recent = recent[(self._signatures[recent] == signature).mean(axis=1) >= self.threshold - ESTIMATE_MARGIN]
+            candidates = numpy.union1d(candidates, recent)
+        grams = _trigrams(key)
+        best, best_similarity = None, self.threshold
+        # In index order, so the oldest entity wins a tie
+        for index in candidates.tolist():
+            if self._numbers[index] != numbers:
+                continue
+            similarity = _jaccard(grams, _trigrams(self._keys[index]))
+            if similarity > best_similarity or (best is None and similarity == best_similarity):
+                best, best_similarity = index, similarity
+        return best
+
+    def _add(self, name: str, type: str, key: str, type_key: str, signature, buckets, entID) -> int:
+        index = len(self._names)
+        self._names.append(name)
+        self._types.append(type)
+        self._keys.append(key)
+        self._numbers.append(number_tokens(name))
+        self._entity_ids.append(entID)
+        # A key can be shared by differently numbered canonical entities ("Python 2.7", "Python 3.12"): the first
+        # keeps it, the others are found by their own name
+        self._by_key.setdefault((type_key, key), index)
+        self._by_alias.setdefault((type_key, normalize_name(name)), index)
+        if buckets is not None:
+            if index == len(self._signatures):
+                self._signatures = numpy.concatenate((self._signatures, numpy.zeros_like(self._signatures)))
+            self._signatures[index] = signature
+            for bucket in buckets.tolist():
+                self._recent.setdefault(bucket, []).append(index)
+            self._recent_count += len(buckets)
+        return index
+
+    def _merge_recent(self):
+        keys = numpy.fromiter((bucket for bucket, indexes in self._recent.items() for _ in indexes), dtype=numpy.uint64, count=self._recent_count)
+        ids = numpy.fromiter((index for indexes in self._recent.values() for index in indexes), dtype=numpy.int64, count=self._recent_count)
+        order = numpy.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        # Newer indexes go after the older ones of the same bucket, so a bucket's window keeps its oldest entities;
+        # inserting a sorted run is linear, where re-sorting everything each time would be quadratic overall
+        positions = numpy.searchsorted(self._bucket_keys, keys, side='right')
+        self._bucket_keys = numpy.insert(self._bucket_keys, positions, keys)
+        self._bucket_ids = numpy.insert(self._bucket_ids, positions, ids)
+        self._recent.clear()
+        self._recent_count = 0
+
+    def _resolve_batch(self, entities: list, entity_ids: list=None) -> list:
+        """Canonical index of each (name, type), registering the ones that match nothing as new canonical entities."""
+        entity_ids = entity_ids or [None] * len(entities)
+        type_keys = [self._type_key(type) for _, type in entities]
+        keys = [entity_key(name) for name, _ in entities]
+        fuzzy = [
+            position for position, (name, type_key, key) in enumerate(zip((name for name, _ in entities), type_keys, keys))
+            if (type_key, key) not in self._by_key and (type_key, normalize_name(name)) not in self._by_alias and len(key) >= MIN_FUZZY_LENGTH
+        ]
+        signatures, buckets, candidates = {}, {}, {}
+        if fuzzy:
+            batch_signatures, batch_buckets = self._buckets([keys[position] for position in fuzzy], [type_keys[position] for position in fuzzy])
+            signatures, buckets = dict(zip(fuzzy, batch_signatures)), dict(zip(fuzzy, batch_buckets))
+            candidates = dict(zip(fuzzy, self._stored_candidates(batch_signatures, batch_buckets)))
+
+        resolved = []
+        for position, ((name, type), type_key, key, entID) in enumerate(zip(entities, type_keys, keys, entity_ids)):
+            norm_name = normalize_name(name)
+            numbers = number_tokens(name)
+            index = self._by_alias.get((type_key, norm_name))
+            if index is None:
+                index = self._by_key.get((type_key, key))
+                if index is not None and numbers and self._numbers[index] and numbers != self._numbers[index]:
+                    index = None
+            if index is None and position in buckets:
+                index = self._fuzzy_match(key, numbers, signatures[position], buckets[position], candidates[position])
+            if index is None:
+                index = self._add(name, type, key, type_key, signatures.get(position), buckets.get(position), entID)
+            elif normalize_name(self._names[index]) != norm_name and (type_key, norm_name) not in self._by_alias:
+                self._by_alias[(type_key, norm_name)] = index
+                self._alias_names[norm_name] = index
+                self.new_aliases.append((name, self._names[index], self._types[index]))
+            resolved.append(index)
+        # Only between batches, the candidates above were looked up in the sorted arrays as they were
+        if self._recent_count >= LSH_MERGE_EVERY:
+            self._merge_recent()
+        return resolved
+
+    @METRICS.timed("resolve.entities")
+    def resolve_batch(self, entities: list) -> list:
+        """The canonical (name, type) of each (name, type) in entities, in order."""
+        return [(self._names[index], self._types[index]) for index in self._resolve_batch(entities)]
+
+    def resolve(self, name: str, type: str) -> tuple:
+        return self.resolve_batch([(name, type)])[0]
+
+    def canonical_name(self, name: str) -> str:
+        """Canonical name for a relationship endpoint; names that aren't known aliases are returned unchanged."""
+        index = self._alias_names.get(normalize_name(name))
+        return name if index is None else self._names[index]
+
+    def resolve_relationships(self, relationships: list) -> list:
+        """(source, target, type) triples with canonical endpoints, minus the ones that became self-loops."""
+        resolved = [(self.canonical_name(source), self.canonical_name(target), type) for source, target, type in relationships]
+        return [relationship for relationship in resolved if normalize_name(relationship[0]) != normalize_name(relationship[1])]
+
+    def add_alias(self, alias: str, name: str, type: str):
+        """Map alias onto the known canonical entity (name, type), without reporting it as a new alias."""
+        type_key = self._type_key(type)
+        index = self._by_alias.get((type_key, normalize_name(name)))
+        if index is None:
+            index = self._by_key.get((type_key, entity_key(name)))
+        if index is None:
+            index = self._add(name, type, entity_key(name), type_key, None, None, None)
+        self._by_alias[(type_key, normalize_name(alias))] = index
+        self._alias_names[normalize_name(alias)] = index
+
+    def take_aliases(self) -> list:
+        """(alias name, canonical name, canonical type) found since the last call."""
+        aliases, self.new_aliases = self.new_aliases, []
+        return aliases
+
+    @METRICS.timed("resolve.load")
+    def load(self, db_manager: DatabaseManager, batch_size: int=GRAPH_BATCH_SIZE) -> dict:
+        """Register the stored entities, oldest first so they stay canonical, and the recorded aliases.
+
+        Returns {duplicate entID: canonical entID} for stored entities that resolve to an older one; new names
+        are mapped onto the canonical entity in memory either way, merge_entities() folds them in the database.
+        """
+        duplicates = {}
+        for rows in db_manager.iter_entity_batches(batch_size):
+            for (entID, _, _), index in zip(rows, self._resolve_batch([(name, type) for _, name, type in rows], [entID for entID, _, _ in rows])):
+                if self._entity_ids[index] != entID:
+                    duplicates[entID] = self._entity_ids[index]
+        for alias, name, type in db_manager.iter_aliases(batch_size):
+            self.add_alias(alias, name, type)
+        self.new_aliases.clear()
+        return duplicates
+
+
+def merge_duplicates(db_manager: DatabaseManager, resolver: EntityResolver=None, dry_run: bool=False) -> dict:
+    """Find the near-duplicate entities already stored and, unless dry_run, merge each into the oldest of its group."""
+    resolver = resolver if resolver is not None else EntityResolver()
+    duplicates = resolver.load(db_manager)
+    stats = {'canonical_entities': len(resolver), 'duplicates': len(duplicates)}
+    if duplicates and not dry_run:
+        stats.update({f"merged_{key}": value for key, value in db_manager.merge_entities(duplicates).items()})
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge near-duplicate entities in the database into canonical ones.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="trigram Jaccard similarity to merge at")
+    parser.add_argument("--any-type", action="store_true", help="also merge entities of different types")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many entities would be merged")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db_manager = DatabaseManager()
+    try:
+        db_manager.create_tables()
+        stats = merge_duplicates(db_manager, EntityResolver(args.threshold, match_types=not args.any_type), args.dry_run)
+    finally:
+        db_manager.close_db()
+    logger.info(", ".join(f"{key}: {value}" for key, value in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,106 @@
-import ast
+import asyncio
+import logging
+import re
 # from langchain.chains import LLMChain
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from langchain_ollama import OllamaLLM
+# langchain is imported when an Extractor is built, not when this module is; it dominates cold-start time
+from llm_cache import SQLiteLLMCache, cache_key
+from metrics import METRICS
+from tuple_parser import TupleStreamParser, parse_json_tuples, parse_tuples
+
+CACHE_MODES = ("normal", "cache_only", "refresh")
+
+logger = logging.getLogger(__name__)
+
+# Words of entity names and text, compared lowercased; "node.js", "c++" and "o'reilly" are one word each
+WORD_RE = re.compile(r"[\w+#]+(?:[.'\-][\w+#]+)*")
+
+def _words(text: str) -> list:
+    return WORD_RE.findall(text.lower())
+
+
+class MentionIndex:
+    """Which texts mention which entity names, as whole-word case-insensitive matches.
+
+    Each text is scanned once per distinct name length in words, with a dict lookup per word, so building the
+    index is linear in the amount of text however many names there are.
+    """
+    def __init__(self, names: list, texts: list):
+        self._names = {}  # tuple of words -> name
+        for name in names:
+            key = tuple(_words(name))
+            if key:
+                self._names.setdefault(key, name)
+        self._lengths = sorted({len(key) for key in self._names})
+        self.names_by_text = [self.find(text) for text in texts]
+        self.texts_by_name = {}  # name -> indexes of the texts mentioning it
+        for index, found in enumerate(self.names_by_text):
+            for name in found:
+                self.texts_by_name.setdefault(name, []).append(index)
+
+    def find(self, text: str) -> list:
+        """The indexed names mentioned in text, in order of first mention."""
+        words = _words(text)
+        found = {}
+        for start in range(len(words)):
+            for length in self._lengths:
+                name = self._names.get(tuple(words[start:start + length]))
+                if name is not None and name not in found:
+                    found[name] = None
+        return list(found)
+
+# Appended to the prompts when Ollama is asked for JSON output (format="json")
+JSON_MODE_INSTRUCTION = """
+            The output must be valid JSON: write the list as a JSON array and each tuple as a JSON array of strings.
+            """
 
 class Extractor:
-    def __init__(self,  model_name: str = "gemma3:4b", base_url: str = "http://192.168.1.76:11434"):
+    def __init__(self,  model_name: str = "gemma3:4b", base_url: str = "http://192.168.1.76:11434",
+                 max_concurrency: int = 4, request_timeout: float = 120.0, max_retries: int = 2, retry_backoff: float = 1.0,
+                 chunk_token_budget: int = 2000, token_counter=None, llm=None, cache=None, cache_mode: str = "normal",
+                 json_mode: bool = False, max_window_entities: int = 30):
         self.model_name = model_name
         self.base_url = base_url
 
-        self.llm = OllamaLLM(base_url=base_url, model=model_name)
-
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        # Async/batched mode: how many requests may be in flight against the Ollama server at once,
+        # how long each may take, and how often a failed/timed out request is retried (exponential backoff)
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        # Any runnable (or plain function) can stand in for Ollama, e.g. a fake LLM in tests.
+        # json_mode uses Ollama's format="json" option and parses the response as JSON
+        self.json_mode = json_mode
+        if llm is None:
+            from langchain_ollama import OllamaLLM
+            llm = OllamaLLM(base_url=base_url, model=model_name, format="json" if json_mode else "")
+        self.llm = llm
+
+        # Only rows over the token budget need splitting, so the splitter is built on first use
+        self._text_splitter = None
+
+        # Chunked extraction: stored text rows are packed into prompts of at most chunk_token_budget tokens.
+        # token_counter(str) -> int defaults to a ~4 characters per token estimate. Rows over the budget are split
+        # into budget-sized pieces that repeat chunk_overlap tokens of the piece before them
+        self.chunk_token_budget = chunk_token_budget
+        self.chunk_overlap = chunk_token_budget // 5
+        self.count_tokens = token_counter or (lambda text: len(text) // 4 + 1)
+
+        # Windowed relationship extraction: a window is split until it mentions at most this many entities,
+        # which bounds the pairs the model has to consider per prompt
+        self.max_window_entities = max_window_entities
+
+        # Response cache keyed on (model, prompt template, prompt inputs). cache=None uses the on-disk
+        # SQLite cache, cache=False disables it, or pass a DatabaseLLMCache to keep it in the main database.
+        # cache_mode: "normal" reads and writes, "cache_only" never calls the LLM (misses extract nothing),
+        # "refresh" always calls the LLM and overwrites what is cached
+        if cache_mode not in CACHE_MODES:
+            raise ValueError(f"cache_mode must be one of {CACHE_MODES}")
+        self.cache = SQLiteLLMCache() if cache is None else (cache or None)
+        self.cache_mode = cache_mode
 
         # Define extraction prompts
+        from langchain_core.prompts import PromptTemplate
         self.entity_extraction_prompt = PromptTemplate(
             input_variables=["text"],
             template="""
@@ -86,6 +173,10 @@ class Extractor:
             """
         )
 
+        if json_mode:
+            self.entity_extraction_prompt.template += JSON_MODE_INSTRUCTION
+            self.relationship_extraction_prompt.template += JSON_MODE_INSTRUCTION
+
         # self.entity_chain = LLMChain(llm=self.llm, prompt=self.entity_extraction_prompt)
         # self.relationship_chain = LLMChain(llm=self.llm, prompt=self.relationship_extraction_prompt)
         # 1.0 Implementation
@@ -94,30 +185,32 @@ class Extractor:
 
     def extract_entities(self, text: list) -> list:
         #Extract entities from text using LLM
-        if not text or len(text[0]) < 10:
+        if not self._has_text(text):
             return []
         
-        result = self.entity_chain.invoke({"text": text})
+        result = self._invoke(self.entity_chain, {"text": text})
 
         # print("\n\nEntities Result: "+str(result))
 
-        #Make sure it's a list
-        if isinstance(result, dict) and "text" in result:
-            response = ast.literal_eval(result.get("text", ""))
-        elif isinstance(result, str):
-            response = self._custom_parser(result)
-        elif isinstance(result, list):
-            response = result
-        else:
-            return []
+        return self._parse_entities(result)
 
-        if not response:
+    def _parse_response(self, result, arity: int) -> list:
+        #Make sure it's a list of tuples with arity values
+        if isinstance(result, dict):
+            result = result.get("text", "")
+        if isinstance(result, list):
+            return [tuple(item) for item in result if isinstance(item, (list, tuple)) and len(item) == arity]
+        if not isinstance(result, str):
             return []
+        if self.json_mode:
+            return parse_json_tuples(result, arity)
+        return parse_tuples(result, arity)
+
+    def _parse_entities(self, result) -> list:
+        return list(self._validate_entities(self._parse_response(result, 2), set()))
 
+    def _validate_entities(self, response, seen_entities: set):
         #Validate entities
-        valid_entities = []
-        seen_entities = set()
-    
         for entity in response:
             name = entity[0].strip().lower()
             type = entity[1].strip().lower()
@@ -129,12 +222,7 @@ class Extractor:
             #Check if this entity is not already passed
             if name not in seen_entities:
                 seen_entities.add(name)
-                valid_entities.append((name, type))
-
-        if not valid_entities:
-            return []
-
-        return valid_entities
+                yield (name, type)
 
     def extract_relationships(self, text: str, entities: list) -> list:
         #Extract relationships from text using LLM
@@ -143,25 +231,15 @@ class Extractor:
 
         valid_entity_names = [entity[0].lower() for entity in entities]
         
-        result = self.relationship_chain.invoke({"text": text, "entities": valid_entity_names})
-
-        #Make sure it's a list
-        if isinstance(result, dict) and "text" in result:
-            response = ast.literal_eval(result.get("text", ""))
-        elif isinstance(result, str):
-            response = self._custom_parser(result)  
-        elif isinstance(result, list):
-            response = result
-        else:
-            return []
+        result = self._invoke(self.relationship_chain, {"text": text, "entities": valid_entity_names})
 
-        if not response:
-            return []
-        
-        # Validate relationships
-        valid_relationships = []
-        seen_relationships = set()
+        return self._parse_relationships(result, valid_entity_names)
+
+    def _parse_relationships(self, result, valid_entity_names: list) -> list:
+        return list(self._validate_relationships(self._parse_response(result, 3), valid_entity_names, set()))
 
+    def _validate_relationships(self, response, valid_entity_names: list, seen_relationships: set):
+        # Validate relationships
         for relationship in response:
             source = relationship[0].strip().lower()    
             target = relationship[2].strip().lower()
@@ -182,36 +260,383 @@ class Extractor:
 
             if rel_key not in seen_relationships and type != '':
                 seen_relationships.add(rel_key)
-                valid_relationships.append((source,target,type))
+                yield (source,target,type)
+
+    # Response cache
+    def _cache_key(self, chain, inputs: dict) -> str:
+        return cache_key(self.model_name, chain.first.template, inputs)
+
+    def _cache_get(self, key: str):
+        if self.cache is None or self.cache_mode == "refresh":
+            return None
+        return self.cache.get(key)
+
+    def _cache_set(self, key: str, result):
+        if self.cache is not None and isinstance(result, str):
+            self.cache.set(key, result)
+
+    def _invoke(self, chain, inputs: dict):
+        key = self._cache_key(chain, inputs)
+        kind = self._kind(chain)
+        result = self._cache_get(key)
+        if result is not None:
+            METRICS.inc("llm_cache_hits_total", kind=kind)
+            return result
+        if self.cache_mode == "cache_only":
+            return "[]"
+        with METRICS.timer(f"llm.{kind}"):
+            result = chain.invoke(inputs)
+        self._record_request(chain, inputs, result)
+        self._cache_set(key, result)
+        return result
+
+    # Instrumentation
+    def _kind(self, chain) -> str:
+        return "entities" if chain is self.entity_chain else "relationships"
+
+    def _record_request(self, chain, inputs: dict, result):
+        # Token counts are count_tokens estimates of the rendered prompt and of the response
+        kind = self._kind(chain)
+        METRICS.inc("llm_requests_total", kind=kind)
+        METRICS.inc("llm_prompt_tokens_total", self.count_tokens(chain.first.format(**inputs)), kind=kind)
+        if isinstance(result, str):
+            METRICS.inc("llm_completion_tokens_total", self.count_tokens(result), kind=kind)
+
+    # Streaming extraction
+    def _stream(self, chain, inputs: dict, arity: int):
+        # Yields parsed tuples as the response streams in; the full response still lands in the cache
+        key = self._cache_key(chain, inputs)
+        kind = self._kind(chain)
+        cached = self._cache_get(key)
+        if cached is not None:
+            METRICS.inc("llm_cache_hits_total", kind=kind)
+            yield from self._parse_response(cached, arity)
+            return
+        if self.cache_mode == "cache_only":
+            return
+
+        if self.json_mode:
+            # A JSON document can't be validated before it is complete
+            with METRICS.timer(f"llm.{kind}"):
+                result = chain.invoke(inputs)
+            self._record_request(chain, inputs, result)
+            self._cache_set(key, result)
+            yield from self._parse_response(result, arity)
+            return
+
+        # Timed from the request to the last piece, including the time the consumer spends on each tuple
+        parser = TupleStreamParser(arity)
+        pieces = []
+        with METRICS.timer(f"llm.{kind}"):
+            for piece in chain.stream(inputs):
+                pieces.append(piece)
+                yield from parser.feed(piece)
+            yield from parser.close()
+        result = "".join(pieces)
+        self._record_request(chain, inputs, result)
+        self._cache_set(key, result)
+
+    def stream_entities(self, text):
+        """Like extract_entities, but yields each entity as soon as the model has finished writing it."""
+        if not self._has_text(text):
+            return
+        yield from self._validate_entities(self._stream(self.entity_chain, {"text": text}, 2), set())
+
+    def stream_relationships(self, text, entities: list):
+        """Like extract_relationships, but yields each relationship as soon as the model has finished writing it."""
+        if not entities or len(entities) < 2:
+            return
+        valid_entity_names = [entity[0].lower() for entity in entities]
+        response = self._stream(self.relationship_chain, {"text": text, "entities": valid_entity_names}, 3)
+        yield from self._validate_relationships(response, valid_entity_names, set())
+
+    async def _astream(self, chain, inputs: dict, arity: int, semaphore: asyncio.Semaphore):
+        # _stream for the event loop, with _ainvoke's concurrency limit, timeout and retries. A request is only
+        # retried until its first tuple is out; after that a failure raises, the consumer already has part of it
+        key = self._cache_key(chain, inputs)
+        kind = self._kind(chain)
+        cached = self._cache_get(key)
+        if cached is not None:
+            METRICS.inc("llm_cache_hits_total", kind=kind)
+            for item in self._parse_response(cached, arity):
+                yield item
+            return
+        if self.cache_mode == "cache_only":
+            return
+
+        if self.json_mode:
+            for item in self._parse_response(await self._ainvoke(chain, inputs, semaphore), arity):
+                yield item
+            return
+
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            parser = TupleStreamParser(arity)
+            pieces = []
+            yielded = False
+            try:
+                async with semaphore:
+                    with METRICS.timer(f"llm.{kind}"):
+                        deadline = loop.time() + self.request_timeout
+                        stream = aiter(chain.astream(inputs))
+                        try:
+                            while True:
+                                try:
+                                    piece = await asyncio.wait_for(anext(stream), timeout=deadline - loop.time())
+                                except StopAsyncIteration:
+                                    break
+                                pieces.append(piece)
+                                for item in parser.feed(piece):
+                                    yielded = True
+                                    yield item
+                        finally:
+                            await stream.aclose()
+                        for item in parser.close():
+                            yield item
+            except Exception as e:
+                if yielded or attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                METRICS.inc("llm_retries_total", kind=kind)
+                logger.warning("LLM request failed (%r), retrying in %ss", e, delay)
+                await asyncio.sleep(delay)
+                continue
+            result = "".join(pieces)
+            self._record_request(chain, inputs, result)
+            self._cache_set(key, result)
+            return
+
+    async def astream_entities(self, text, semaphore: asyncio.Semaphore = None):
+        """Async stream_entities, limited by semaphore like aextract_entities."""
+        if not self._has_text(text):
+            return
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        seen_entities = set()
+        async for entity in self._astream(self.entity_chain, {"text": text}, 2, semaphore):
+            for valid in self._validate_entities([entity], seen_entities):
+                yield valid
 
-        if not valid_relationships:
+    async def astream_relationships(self, text, entities: list, semaphore: asyncio.Semaphore = None):
+        """Async stream_relationships, limited by semaphore like aextract_relationships."""
+        if not entities or len(entities) < 2:
+            return
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        valid_entity_names = [entity[0].lower() for entity in entities]
+        seen_relationships = set()
+        response = self._astream(self.relationship_chain, {"text": text, "entities": valid_entity_names}, 3, semaphore)
+        async for relationship in response:
+            for valid in self._validate_relationships([relationship], valid_entity_names, seen_relationships):
+                yield valid
+
+    def _has_text(self, text) -> bool:
+        # Too little text (across all rows, not just the first) to be worth an LLM request
+        if isinstance(text, str):
+            text = [text]
+        return sum(len(row.strip()) for row in text or []) >= 10
+
+    # Chunked extraction
+    def chunk_text(self, rows: list) -> list:
+        """Pack text rows into newline-joined chunks that each fit in chunk_token_budget tokens."""
+        chunks = []
+        current = []
+        current_tokens = 0
+        seen_rows = set()
+
+        for row in rows:
+            row = row.strip()
+            if not row or row in seen_rows:
+                continue
+            seen_rows.add(row)
+
+            pieces = self.text_splitter.split_text(row) if self.count_tokens(row) > self.chunk_token_budget else [row]
+            previous = None
+            for piece in pieces:
+                tokens = self.count_tokens(piece)
+                if current and current_tokens + tokens > self.chunk_token_budget:
+                    chunks.append("\n".join(current))
+                    current = []
+                    current_tokens = 0
+                elif previous is not None:
+                    # Same chunk as the previous piece of this row, so drop the splitter's overlap
+                    piece = self._strip_overlap(previous, piece)
+                    tokens = self.count_tokens(piece)
+                current.append(piece)
+                current_tokens += tokens
+                previous = piece
+
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+
+    @property
+    def text_splitter(self):
+        if self._text_splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+            self._text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_token_budget, chunk_overlap=self.chunk_overlap, length_function=self.count_tokens
+            )
+        return self._text_splitter
+
+    def _strip_overlap(self, previous: str, piece: str) -> str:
+        # Longest prefix of piece that repeats the end of previous, which is at most chunk_overlap tokens of it
+        low, high = 0, min(len(previous), len(piece))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(previous[-middle:]) <= self.chunk_overlap:
+                low = middle
+            else:
+                high = middle - 1
+        for size in range(low, 0, -1):
+            if previous.endswith(piece[:size]):
+                return piece[size:].lstrip()
+        return piece
+
+    def extract_chunked(self, rows: list) -> tuple:
+        """Extract entities and relationships chunk by chunk (in parallel) and merge the results.
+
+        Relationships are looked for per relationship_windows() window, between the entities it mentions.
+        Merging is deterministic: results keep chunk order, and the first type seen for a name wins. An LLM request
+        that still fails after its retries raises, rather than leaving its chunk's results out.
+        """
+        chunks = self.chunk_text(rows)
+        if not chunks:
+            return [], []
+
+        chunk_entities = self.extract_entities_batch(chunks)
+        entities = self.merge_entities(chunk_entities)
+        window_relationships = self.extract_relationships_batch(self.relationship_windows(chunks, entities, chunk_entities))
+        return entities, self.merge_relationships(window_relationships)
+
+    def merge_entities(self, chunk_entities: list) -> list:
+        """Concatenate per-chunk entity lists, keeping the first type seen for each name."""
+        entities = {}
+        for name, type in (entity for found in chunk_entities for entity in found):
+            entities.setdefault(name, type)
+        return list(entities.items())
+
+    def merge_relationships(self, window_relationships: list) -> list:
+        """Concatenate per-window relationship lists without duplicates, in order."""
+        return list(dict.fromkeys(relationship for found in window_relationships for relationship in found))
+
+    # Windowed relationship extraction
+    def relationship_windows(self, chunks: list, entities: list, chunk_entities: list=None) -> list:
+        """(text, entities) prompts for relationship extraction: each chunk with the entities it mentions.
+
+        Mentions come from a MentionIndex over all the entities, so a name extracted from one chunk is paired in
+        every chunk that mentions it. The entities extracted from a chunk (chunk_entities, per chunk) always count
+        as mentioned there, even when the model reworded the name. A chunk mentioning more than max_window_entities
+        is split at line breaks into smaller windows (a single line is never split). Windows with fewer than two
+        entities are dropped, so prompts stay bounded and the number of calls follows co-occurrences, not the
+        square of the entities.
+        """
+        types = dict(entities)
+        index = MentionIndex(list(types), chunks)
+        windows = []
+        for position, (chunk, names) in enumerate(zip(chunks, index.names_by_text)):
+            # Extracted from this chunk but not found in its text: kept in every window the chunk is split into
+            found = set(names)
+            unmatched = [name for name, _ in (chunk_entities[position] if chunk_entities else ()) if name not in found and name in types]
+            self._split_window(chunk.split("\n"), names, list(dict.fromkeys(unmatched)), index, types, windows)
+        return windows
+
+    def _split_window(self, lines: list, names: list, unmatched: list, index: MentionIndex, types: dict, windows: list):
+        names = names + unmatched
+        if len(names) < 2:
+            return
+        if len(names) <= self.max_window_entities or len(lines) == 1:
+            windows.append(("\n".join(lines), [(name, types[name]) for name in names]))
+            return
+        middle = len(lines) // 2
+        for half in (lines[:middle], lines[middle:]):
+            self._split_window(half, index.find("\n".join(half)), unmatched, index, types, windows)
+
+    # Async/batched mode
+    async def _ainvoke(self, chain, inputs: dict, semaphore: asyncio.Semaphore):
+        # One LLM request with the concurrency limit, a timeout and retries with exponential backoff
+        key = self._cache_key(chain, inputs)
+        kind = self._kind(chain)
+        result = self._cache_get(key)
+        if result is not None:
+            METRICS.inc("llm_cache_hits_total", kind=kind)
+            return result
+        if self.cache_mode == "cache_only":
+            return "[]"
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    # Timed inside the semaphore, so waiting for a free slot doesn't count as LLM latency
+                    with METRICS.timer(f"llm.{kind}"):
+                        result = await asyncio.wait_for(chain.ainvoke(inputs), timeout=self.request_timeout)
+                self._record_request(chain, inputs, result)
+                self._cache_set(key, result)
+                return result
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                METRICS.inc("llm_retries_total", kind=kind)
+                logger.warning("LLM request failed (%r), retrying in %ss", e, delay)
+                await asyncio.sleep(delay)
+
+    async def aextract_entities(self, text: list, semaphore: asyncio.Semaphore = None) -> list:
+        if not self._has_text(text):
             return []
-        
-        return valid_relationships
-    
-    def _custom_parser(self, input_str):
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        result = await self._ainvoke(self.entity_chain, {"text": text}, semaphore)
+        return self._parse_entities(result)
+
+    async def aextract_relationships(self, text, entities: list, semaphore: asyncio.Semaphore = None) -> list:
+        if not entities or len(entities) < 2:
+            return []
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        valid_entity_names = [entity[0].lower() for entity in entities]
+        result = await self._ainvoke(self.relationship_chain, {"text": text, "entities": valid_entity_names}, semaphore)
+        return self._parse_relationships(result, valid_entity_names)
+
+    async def _as_completed(self, calls: list, return_exceptions: bool=False):
+        # Yields (index, result) in completion order. A call that still fails after its retries raises and cancels
+        # the others, or with return_exceptions yields (index, the exception), never something that looks like "none found"
+        async def run(index, call):
+            try:
+                return index, await call
+            except Exception as e:
+                logger.error("LLM request %d failed: %r", index, e)
+                if not return_exceptions:
+                    raise
+                return index, e
+
+        tasks = [asyncio.ensure_future(run(index, call)) for index, call in enumerate(calls)]
         try:
-            retval = ast.literal_eval(input_str)
-            return retval
-        except:
-            # Remove leading and trailing whitespace
-            input_str = input_str.strip()
-            
-            # Remove leading and trailing brackets if present
-            if input_str.startswith('[') and input_str.endswith(']'):
-                input_str = input_str[1:-1].strip()
-            
-            # Split the string by commas to get potential list elements
-            elements = input_str.split(',')
-            
-            # Process each element to handle unclosed string literals
-            processed_elements = []
-            for element in elements:
-                element = element.strip()
-                if element.startswith("'") and not element.endswith("'"):
-                    element += "'"
-                elif element.startswith('"') and not element.endswith('"'):
-                    element += '"'
-                processed_elements.append(element)
-            
-            return processed_elements
\ No newline at end of file
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def aextract_entities_as_completed(self, chunks: list, return_exceptions: bool=False):
+        """Async generator of (chunk index, entities), fanned out with bounded concurrency.
+
+        A request that fails after its retries raises, or with return_exceptions comes back as (chunk index, exception).
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._as_completed([self.aextract_entities(chunk, semaphore) for chunk in chunks], return_exceptions)
+
+    def aextract_relationships_as_completed(self, chunks: list, return_exceptions: bool=False):
+        """Async generator of (chunk index, relationships) for a list of (text, entities) chunks; failures as above."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._as_completed([self.aextract_relationships(text, entities, semaphore) for text, entities in chunks], return_exceptions)
+
+    def extract_entities_batch(self, chunks: list) -> list:
+        """Blocking wrapper: entities for every chunk, in input order. Raises if a request fails after its retries."""
+        return asyncio.run(self._collect(self.aextract_entities_as_completed(chunks), len(chunks)))
+
+    def extract_relationships_batch(self, chunks: list) -> list:
+        """Blocking wrapper: relationships for every (text, entities) chunk, in input order. Raises like extract_entities_batch."""
+        return asyncio.run(self._collect(self.aextract_relationships_as_completed(chunks), len(chunks)))
+
+    async def _collect(self, results, count: int) -> list:
+        ordered = [[] for _ in range(count)]
+        async for index, result in results:
+            ordered[index] = result
+        return ordered
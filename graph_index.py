@@ -0,0 +1,415 @@
+"""Compact, read-only index of the knowledge graph for neighbourhood, path and degree queries.
+
+Entities are numbered 0..n-1 in entID order. Relationships are kept as directed, typed edges in NumPy CSR (by
+source) and CSC (by target) arrays, so unlike the networkx graph their direction and parallel relationships of
+different types survive. Names live in one UTF-8 buffer found through a sorted hash table rather than one Python
+string and dict entry per entity, and queries work a whole BFS frontier at a time in NumPy.
+
+Anywhere a node is expected it can be given as its integer index or as a name, which stands for every entity of
+that name (names are only unique per entity type).
+"""
+import itertools
+import zlib
+import numpy
+from database_manager import GRAPH_BATCH_SIZE, graph_version, relationship_type_names, stream_entity_batches, stream_relationship_batches
+from metrics import METRICS
+
+DIRECTIONS = ("out", "in", "both")
+REVERSED = {"out": "in", "in": "out", "both": "both"}
+# k_hop switches from a sorted visited array to per-node flags past this share of the graph
+DENSE_FRACTION = 1 / 64
+
+
+def _codes(values) -> tuple:
+    """(int32 code per value, distinct values in first-seen order)."""
+    lookup = {}
+    codes = numpy.fromiter((lookup.setdefault(value, len(lookup)) for value in values), dtype=numpy.int32, count=len(values))
+    return codes, list(lookup)
+
+
+def _indptr(sorted_nodes: numpy.ndarray, count: int) -> numpy.ndarray:
+    indptr = numpy.zeros(count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sorted_nodes, minlength=count), out=indptr[1:])
+    return indptr
+
+
+def _sorted_unique(values: numpy.ndarray) -> numpy.ndarray:
+    """numpy.unique by sorting, which beats its hash-based default on the integer arrays here."""
+    values = numpy.sort(values)
+    return values[numpy.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+
+def map_edges(entity_ids: numpy.ndarray, type_ids: numpy.ndarray, source_ids, target_ids, relationship_type_ids) -> tuple:
+    """(sources, targets, edge_types) as node indexes and type codes for relationships given by entID and typeID.
+
+    entity_ids and type_ids must be sorted. Relationships pointing at unknown IDs (rows deleted without their
+    relationships, SQLite doesn't enforce foreign keys by default) are skipped.
+    """
+    sources = numpy.searchsorted(entity_ids, source_ids)
+    targets = numpy.searchsorted(entity_ids, target_ids)
+    edge_types = numpy.searchsorted(type_ids, relationship_type_ids)
+    if not len(entity_ids) or not len(type_ids):
+        return sources[:0], targets[:0], edge_types[:0]
+    valid = (
+        (entity_ids[numpy.minimum(sources, len(entity_ids) - 1)] == source_ids) &
+        (entity_ids[numpy.minimum(targets, len(entity_ids) - 1)] == target_ids) &
+        (type_ids[numpy.minimum(edge_types, len(type_ids) - 1)] == relationship_type_ids)
+    )
+    return sources[valid], targets[valid], edge_types[valid]
+
+
+def _expand(indptr: numpy.ndarray, nodes: numpy.ndarray) -> tuple:
+    """(positions in the CSR column arrays of every edge of nodes, the node each position belongs to)."""
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    # One arange over the concatenated ranges, each shifted back to where its node's range starts
+    positions = numpy.arange(int(counts.sum()), dtype=numpy.int64) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+    return positions, numpy.repeat(nodes, counts)
+
+
+class KnowledgeGraphIndex:
+    def __init__(self, names: list, node_types, entity_types: list, sources, targets, edge_types, relationship_types: list,
+                 entity_ids=None, version: str=None):
+        """Node i is names[i] of type entity_types[node_types[i]]; edge j goes sources[j] -> targets[j] and has type
+        relationship_types[edge_types[j]]. entity_ids are the nodes' entIDs in the database, if they came from one.
+        """
+        encoded = [name.encode() for name in names]
+        name_offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.fromiter(map(len, encoded), dtype=numpy.int64, count=len(encoded)), out=name_offsets[1:])
+        name_hashes = numpy.fromiter(map(zlib.crc32, encoded), dtype=numpy.uint32, count=len(encoded))
+        self._build(name_offsets, b''.join(encoded), name_hashes, node_types, entity_types, sources, targets, edge_types,
+                    relationship_types, entity_ids, version)
+
+    @classmethod
+    def from_buffers(cls, name_offsets, name_data, name_hashes, node_types, entity_types: list, sources, targets, edge_types,
+                     relationship_types: list, entity_ids=None, version: str=None) -> 'KnowledgeGraphIndex':
+        """Like the constructor, but with the names already encoded: node i is called
+        name_data[name_offsets[i]:name_offsets[i + 1]] (UTF-8) and name_hashes[i] is the zlib.crc32 of that.
+
+        The buffers are used as they are, not copied, so they can be the columns of a memory-mapped Arrow file.
+        """
+        index = cls.__new__(cls)
+        index._build(name_offsets, name_data, name_hashes, node_types, entity_types, sources, targets, edge_types,
+                     relationship_types, entity_ids, version)
+        return index
+
+    def _build(self, name_offsets, name_data, name_hashes, node_types, entity_types: list, sources, targets, edge_types,
+               relationship_types: list, entity_ids, version: str):
+        count = len(node_types)
+        index_dtype = numpy.int32 if count < 2 ** 31 else numpy.int64
+        type_dtype = numpy.int16 if len(relationship_types) <= numpy.iinfo(numpy.int16).max else numpy.int32
+        self.version = version
+        self.entity_types = list(entity_types)
+        self.relationship_types = list(relationship_types)
+        self.node_types = numpy.asarray(node_types, dtype=numpy.int32)
+        self.entity_ids = numpy.arange(count, dtype=numpy.int64) if entity_ids is None else numpy.asarray(entity_ids, dtype=numpy.int64)
+
+        self._name_offsets = numpy.asarray(name_offsets, dtype=numpy.int64)
+        self._name_data = numpy.frombuffer(name_data, dtype=numpy.uint8)
+        hashes = numpy.asarray(name_hashes, dtype=numpy.uint32)
+        self._name_order = numpy.argsort(hashes, kind='stable').astype(index_dtype)
+        self._name_hashes = hashes[self._name_order]
+
+        # Edges are stored sorted by source, which makes them the CSR arrays; the CSC side is a permuted copy
+        sources = numpy.asarray(sources, dtype=index_dtype)
+        order = numpy.argsort(sources, kind='stable')
+        self.sources = sources[order]
+        self.targets = numpy.asarray(targets, dtype=index_dtype)[order]
+        self.edge_types = numpy.asarray(edge_types, dtype=type_dtype)[order]
+        self.out_indptr = _indptr(self.sources, count)
+        order = numpy.argsort(self.targets, kind='stable')
+        self.in_sources = self.sources[order]
+        self.in_edge_types = self.edge_types[order]
+        self.in_indptr = _indptr(self.targets[order], count)
+
+    @classmethod
+    @METRICS.timed("graph_index.load")
+    def load(cls, session, batch_size: int=GRAPH_BATCH_SIZE) -> 'KnowledgeGraphIndex':
+        """Build the index from the database with one entity query and one ID-only relationship query."""
+        # Taken before reading, so rows written during the load give a newer version next time
+        version = graph_version(session)
+        entity_ids, names, types = [], [], []
+        for rows in stream_entity_batches(session, batch_size):
+            for entID, name, type in rows:
+                entity_ids.append(entID)
+                names.append(name)
+                types.append(type)
+        entity_ids = numpy.array(entity_ids, dtype=numpy.int64)
+        node_types, entity_types = _codes(types)
+        del types
+
+        # Flattened with fromiter: numpy.array() on SQLAlchemy rows goes through their slow mapping fallback
+        batches = [numpy.fromiter(itertools.chain.from_iterable(rows), dtype=numpy.int64) for rows in stream_relationship_batches(session, batch_size)]
+        edges = numpy.concatenate(batches).reshape(-1, 3) if batches else numpy.empty((0, 3), dtype=numpy.int64)
+        del batches
+        type_names = relationship_type_names(session)
+        type_ids = numpy.array(sorted(type_names), dtype=numpy.int64)
+
+        sources, targets, edge_types = map_edges(entity_ids, type_ids, edges[:, 0], edges[:, 1], edges[:, 2])
+        return cls(
+            names, node_types, entity_types, sources, targets, edge_types,
+            [type_names[typeID] for typeID in type_ids.tolist()], entity_ids, version,
+        )
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_types)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.sources)
+
+    def __len__(self):
+        return self.node_count
+
+    def memory_usage(self) -> int:
+        """Bytes held by the index's arrays, name buffer included."""
+        arrays = [value for value in vars(self).values() if isinstance(value, numpy.ndarray)]
+        return sum(array.nbytes for array in arrays)
+
+    # Names
+    def name(self, node: int) -> str:
+        return self._name_data[self._name_offsets[node]:self._name_offsets[node + 1]].tobytes().decode()
+
+    def names(self, nodes) -> list:
+        return [self.name(node) for node in nodes]
+
+    def lookup(self, name: str, entity_type: str=None) -> numpy.ndarray:
+        """Sorted indexes of the nodes called name, only those of entity_type if given."""
+        encoded = name.encode()
+        key = zlib.crc32(encoded)
+        start = numpy.searchsorted(self._name_hashes, key, side='left')
+        end = numpy.searchsorted(self._name_hashes, key, side='right')
+        offsets = self._name_offsets
+        nodes = [node for node in self._name_order[start:end].tolist() if self._name_data[offsets[node]:offsets[node + 1]].tobytes() == encoded]
+        nodes = numpy.array(sorted(nodes), dtype=numpy.int64)
+        if entity_type is not None:
+            mask = self._type_mask([entity_type], self.entity_types)
+            nodes = nodes[mask[self.node_types[nodes]]]
+        return nodes
+
+    def _resolve(self, nodes) -> numpy.ndarray:
+        if isinstance(nodes, numpy.ndarray):
+            return numpy.unique(nodes.astype(numpy.int64))
+        if isinstance(nodes, (str, int, numpy.integer)):
+            nodes = [nodes]
+        resolved = []
+        for node in nodes:
+            if isinstance(node, str):
+                found = self.lookup(node)
+                if not len(found):
+                    raise KeyError(node)
+                resolved.extend(found.tolist())
+            else:
+                if not 0 <= node < self.node_count:
+                    raise KeyError(node)
+                resolved.append(node)
+        return numpy.unique(numpy.array(resolved, dtype=numpy.int64))
+
+    # Traversal
+    @staticmethod
+    def _type_mask(names: list, known: list):
+        """Boolean table over type codes for the given type names, None when not filtering. Unknown names match nothing."""
+        if not names:
+            return None
+        codes = {name: code for code, name in enumerate(known)}
+        mask = numpy.zeros(len(known), dtype=bool)
+        mask[[codes[name] for name in names if name in codes]] = True
+        return mask
+
+    def _step(self, frontier: numpy.ndarray, direction: str, edge_mask) -> tuple:
+        """(neighbours, the frontier node each was reached from) over one hop of allowed edges."""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {DIRECTIONS}, not {direction!r}")
+        neighbours, types, origins = [], [], []
+        if direction != "in":
+            positions, from_nodes = _expand(self.out_indptr, frontier)
+            neighbours.append(self.targets[positions])
+            types.append(self.edge_types[positions])
+            origins.append(from_nodes)
+        if direction != "out":
+            positions, from_nodes = _expand(self.in_indptr, frontier)
+            neighbours.append(self.in_sources[positions])
+            types.append(self.in_edge_types[positions])
+            origins.append(from_nodes)
+        neighbours, origins = numpy.concatenate(neighbours), numpy.concatenate(origins)
+        if edge_mask is not None:
+            keep = edge_mask[numpy.concatenate(types)]
+            neighbours, origins = neighbours[keep], origins[keep]
+        return neighbours, origins
+
+    def _visit(self, frontier: numpy.ndarray, parent: numpy.ndarray, direction: str, edge_mask, node_mask) -> numpy.ndarray:
+        """Expand frontier by one hop, record where each newly reached node came from in parent and return them."""
+        neighbours, origins = self._step(frontier, direction, edge_mask)
+        new = parent[neighbours] < 0
+        if node_mask is not None:
+            new &= node_mask[self.node_types[neighbours]]
+        # Any frontier node is a valid BFS parent, so whichever write lands last is fine
+        parent[neighbours[new]] = origins[new]
+        return _sorted_unique(neighbours[new])
+
+    def _seeds(self, nodes, node_mask) -> numpy.ndarray:
+        seeds = self._resolve(nodes)
+        return seeds if node_mask is None else seeds[node_mask[self.node_types[seeds]]]
+
+    def bfs_levels(self, nodes, depth: int=None, direction: str="both", relationship_types: list=None,
+                   entity_types: list=None) -> numpy.ndarray:
+        """Hop distance of every node from the nearest of nodes, -1 if not reached within depth.
+
+        Only edges of relationship_types and nodes of entity_types are walked, when given.
+        """
+        edge_mask = self._type_mask(relationship_types, self.relationship_types)
+        node_mask = self._type_mask(entity_types, self.entity_types)
+        distance = numpy.full(self.node_count, -1, dtype=numpy.int32)
+        parent = numpy.full(self.node_count, -1, dtype=numpy.int64)
+        frontier = self._seeds(nodes, node_mask)
+        parent[frontier] = frontier
+        distance[frontier] = level = 0
+        while len(frontier) and (depth is None or level < depth):
+            frontier = self._visit(frontier, parent, direction, edge_mask, node_mask)
+            level += 1
+            distance[frontier] = level
+        return distance
+
+    def k_hop(self, nodes, depth: int=1, direction: str="both", relationship_types: list=None, entity_types: list=None) -> numpy.ndarray:
+        """Sorted indexes of the nodes within depth hops of nodes (unlimited for None), including them.
+
+        Small neighbourhoods keep the visited set as a sorted array, so they cost time in their own size rather
+        than the graph's; once it passes DENSE_FRACTION of the graph a per-node flag array is cheaper.
+        """
+        edge_mask = self._type_mask(relationship_types, self.relationship_types)
+        node_mask = self._type_mask(entity_types, self.entity_types)
+        visited = frontier = self._seeds(nodes, node_mask)
+        seen = None
+        level = 0
+        while len(frontier) and (depth is None or level < depth):
+            neighbours, _ = self._step(frontier, direction, edge_mask)
+            if node_mask is not None:
+                neighbours = neighbours[node_mask[self.node_types[neighbours]]]
+            if seen is None and len(visited) + len(neighbours) > self.node_count * DENSE_FRACTION:
+                seen = numpy.zeros(self.node_count, dtype=bool)
+                seen[visited] = True
+            if seen is None:
+                frontier = numpy.setdiff1d(_sorted_unique(neighbours), visited, assume_unique=True)
+                visited = _sorted_unique(numpy.concatenate((visited, frontier)))
+            else:
+                frontier = _sorted_unique(neighbours[~seen[neighbours]])
+                seen[frontier] = True
+            level += 1
+        return visited if seen is None else numpy.flatnonzero(seen)
+
+    def shortest_path(self, source, target, direction: str="both", relationship_types: list=None, entity_types: list=None):
+        """Node indexes along a shortest path from source to target, or None if there is none.
+
+        Bidirectional BFS that always grows the smaller frontier, so on small-world graphs it only touches a small
+        part of the graph. direction applies to the source -> target walk.
+        """
+        edge_mask = self._type_mask(relationship_types, self.relationship_types)
+        node_mask = self._type_mask(entity_types, self.entity_types)
+        forward_frontier, backward_frontier = self._seeds(source, node_mask), self._seeds(target, node_mask)
+        forward = numpy.full(self.node_count, -1, dtype=numpy.int64)
+        backward = numpy.full(self.node_count, -1, dtype=numpy.int64)
+        # A seed is its own parent, which marks it visited and ends the walk back along the parents
+        forward[forward_frontier] = forward_frontier
+        backward[backward_frontier] = backward_frontier
+        meeting = numpy.intersect1d(forward_frontier, backward_frontier)
+        while not len(meeting) and len(forward_frontier) and len(backward_frontier):
+            if len(forward_frontier) <= len(backward_frontier):
+                forward_frontier = self._visit(forward_frontier, forward, direction, edge_mask, node_mask)
+                meeting = forward_frontier[backward[forward_frontier] >= 0]
+            else:
+                backward_frontier = self._visit(backward_frontier, backward, REVERSED[direction], edge_mask, node_mask)
+                meeting = backward_frontier[forward[backward_frontier] >= 0]
+        if not len(meeting):
+            return None
+
+        path = [int(meeting[0])]
+        while forward[path[-1]] != path[-1]:
+            path.append(int(forward[path[-1]]))
+        path.reverse()
+        while backward[path[-1]] != path[-1]:
+            path.append(int(backward[path[-1]]))
+        return path
+
+    # Statistics
+    def degree(self, direction: str="both", relationship_types: list=None) -> numpy.ndarray:
+        """Number of (allowed) edges at each node; a self-loop counts twice for "both"."""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {DIRECTIONS}, not {direction!r}")
+        edge_mask = self._type_mask(relationship_types, self.relationship_types)
+        if edge_mask is None:
+            out_degree, in_degree = numpy.diff(self.out_indptr), numpy.diff(self.in_indptr)
+        else:
+            keep = edge_mask[self.edge_types]
+            out_degree = numpy.bincount(self.sources[keep], minlength=self.node_count)
+            in_degree = numpy.bincount(self.targets[keep], minlength=self.node_count)
+        if direction == "out":
+            return out_degree
+        return in_degree if direction == "in" else out_degree + in_degree
+
+    def degree_stats(self, direction: str="both", relationship_types: list=None, top: int=10) -> dict:
+        degree = self.degree(direction, relationship_types)
+        if not len(degree):
+            return {"nodes": 0, "edges": self.edge_count, "mean": 0.0, "median": 0.0, "p99": 0.0, "max": 0, "isolated": 0, "top": []}
+        top = min(top, len(degree))
+        highest = numpy.argpartition(-degree, top - 1)[:top] if top else numpy.empty(0, dtype=numpy.int64)
+        highest = highest[numpy.argsort(-degree[highest], kind='stable')]
+        return {
+            "nodes": self.node_count,
+            "edges": self.edge_count,
+            "mean": float(degree.mean()),
+            "median": float(numpy.median(degree)),
+            "p99": float(numpy.percentile(degree, 99)),
+            "max": int(degree.max()),
+            "isolated": int((degree == 0).sum()),
+            "top": [(self.name(node), int(degree[node])) for node in highest.tolist()],
+        }
+
+    # Subsets and export
+    def subgraph(self, nodes=None, relationship_types: list=None, entity_types: list=None) -> 'KnowledgeGraphIndex':
+        """A new index of the given nodes (all by default) limited to entity and relationship types, renumbered."""
+        keep = numpy.ones(self.node_count, dtype=bool)
+        if nodes is not None:
+            keep[:] = False
+            keep[self._resolve(nodes)] = True
+        node_mask = self._type_mask(entity_types, self.entity_types)
+        if node_mask is not None:
+            keep &= node_mask[self.node_types]
+        edge_mask = self._type_mask(relationship_types, self.relationship_types)
+        kept_edges = keep[self.sources] & keep[self.targets]
+        if edge_mask is not None:
+            kept_edges &= edge_mask[self.edge_types]
+
+        kept_nodes = numpy.flatnonzero(keep)
+        renumber = numpy.cumsum(keep) - 1
+        return KnowledgeGraphIndex(
+            self.names(kept_nodes.tolist()), self.node_types[kept_nodes], self.entity_types,
+            renumber[self.sources[kept_edges]], renumber[self.targets[kept_edges]], self.edge_types[kept_edges],
+            self.relationship_types, self.entity_ids[kept_nodes], self.version,
+        )
+
+    def to_networkx(self, nodes=None, relationship_types: list=None, entity_types: list=None, multigraph: bool=True):
+        """The (sub)graph in networkx, keyed by name with entity_type and relationship_type attributes.
+
+        A MultiDiGraph keeps direction and parallel relationships (keyed by type); multigraph=False gives the
+        undirected simple Graph that KnowledgeGrapher.load_graph builds. Entities sharing a name become one node either way.
+        """
+        import networkx
+        index = self if nodes is None and not relationship_types and not entity_types else self.subgraph(nodes, relationship_types, entity_types)
+        graph = networkx.MultiDiGraph() if multigraph else networkx.Graph()
+        names = index.names(range(index.node_count))
+        graph.add_nodes_from(
+            (name, {'entity_type': index.entity_types[code]}) for name, code in zip(names, index.node_types.tolist())
+        )
+        edges = zip(index.sources.tolist(), index.targets.tolist(), index.edge_types.tolist())
+        relationship_names = index.relationship_types
+        if multigraph:
+            graph.add_edges_from(
+                (names[source], names[target], relationship_names[code], {'relationship_type': relationship_names[code]})
+                for source, target, code in edges
+            )
+        else:
+            graph.add_edges_from(
+                (names[source], names[target], {'relationship_type': relationship_names[code]}) for source, target, code in edges
+            )
+        return graph
@@ -0,0 +1,307 @@
+"""Graph layouts: computed once per graph version, persisted to disk and updated incrementally as nodes are added.
+
+Positions are {node: (x, y)} dicts scaled to [-1, 1], whatever the engine.
+"""
+import hashlib
+import json
+import os
+import numpy
+
+LAYOUT_ENGINES = ("forceatlas2", "spring", "sfdp")
+DEFAULT_LAYOUT_ENGINE = "forceatlas2"
+
+# Up to this many nodes forceatlas2 repulsion is exact; above it every node is pushed by a random sample
+# of this many nodes, scaled up to the full graph, which keeps each iteration O(nodes * sample)
+REPULSION_SAMPLE = 256
+# Rows of the (nodes x sample) repulsion computed at once, bounds the temporary arrays to a few MB
+REPULSION_CHUNK = 2048
+# Incremental layouts: an added node is pushed by at most this many random nodes of each grid cell around it,
+# scaled up to the cell's population, so dense regions cost the same as sparse ones
+SETTLE_CELL_SAMPLE = 32
+
+
+def _normalize(positions: numpy.ndarray) -> numpy.ndarray:
+    positions = positions - positions.mean(axis=0)
+    extent = numpy.abs(positions).max()
+    return positions / extent if extent > 0 else positions
+
+
+def forceatlas2_layout(graph, pos: dict=None, iterations: int=100, scaling: float=0.1, gravity: float=1.0,
+                       sample_size: int=REPULSION_SAMPLE, seed: int=42) -> dict:
+    """ForceAtlas2-style layout in numpy: degree-weighted repulsion, linear attraction along edges and gravity.
+
+    Nodes in pos (a previous [-1, 1] layout) start there instead of at random.
+    """
+    nodes = list(graph)
+    count = len(nodes)
+    if count == 0:
+        return {}
+    index = {node: i for i, node in enumerate(nodes)}
+    rng = numpy.random.default_rng(seed)
+
+    # Internal coordinates spread the graph over about sqrt(count) units, where the forces balance
+    spread = max(numpy.sqrt(count), 1.0)
+    positions = rng.uniform(-spread, spread, (count, 2))
+    for node, xy in (pos or {}).items():
+        if node in index:
+            positions[index[node]] = numpy.asarray(xy, dtype=float) * spread
+
+    edges = numpy.array([(index[u], index[v]) for u, v in graph.edges() if u != v], dtype=numpy.int64).reshape(-1, 2)
+    mass = numpy.bincount(edges.ravel(), minlength=count).astype(float) + 1.0
+
+    # Linear cooling from a tenth of the layout's width, as in Fruchterman-Reingold
+    temperature = spread / 5
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        displacement = numpy.zeros_like(positions)
+
+        # Repulsion: F = scaling * mass_i * mass_j / distance, exact or against a random sample
+        if count <= sample_size:
+            others, weight = numpy.arange(count), 1.0
+        else:
+            others, weight = rng.choice(count, sample_size, replace=False), count / sample_size
+        # sum_j f_ij * (p_i - p_j) = p_i * sum_j f_ij - f @ p, so each chunk is two matrix products
+        other_positions = positions[others]
+        other_norms = (other_positions ** 2).sum(axis=1)
+        other_mass = mass[others] * (scaling * weight)
+        for start in range(0, count, REPULSION_CHUNK):
+            end = min(start + REPULSION_CHUNK, count)
+            chunk = positions[start:end]
+            distance2 = (chunk ** 2).sum(axis=1)[:, None] + other_norms[None, :] - 2 * chunk @ other_positions.T
+            # Coincident pairs (a node and itself) push nothing
+            force = numpy.divide(mass[start:end, None] * other_mass[None, :], distance2,
+                                 out=numpy.zeros_like(distance2), where=distance2 > 1e-9)
+            displacement[start:end] += chunk * force.sum(axis=1)[:, None] - force @ other_positions
+
+        # Attraction: F = distance along every edge
+        if len(edges):
+            delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+            numpy.add.at(displacement, edges[:, 0], -delta)
+            numpy.add.at(displacement, edges[:, 1], delta)
+
+        # Gravity: constant pull towards the centre, proportional to mass, keeps components together
+        distance = numpy.linalg.norm(positions, axis=1) + 1e-9
+        displacement -= (gravity * mass / distance)[:, None] * positions
+
+        # Cap each step at the current temperature, then cool down
+        length = numpy.linalg.norm(displacement, axis=1) + 1e-9
+        displacement *= (numpy.minimum(length, temperature) / length)[:, None]
+        positions += displacement
+        temperature -= cooling
+
+    return {node: (float(x), float(y)) for node, (x, y) in zip(nodes, _normalize(positions))}
+
+
+def compute_layout(graph, engine: str=DEFAULT_LAYOUT_ENGINE, seed: int=42) -> dict:
+    """Full layout of graph with the given engine."""
+    if engine not in LAYOUT_ENGINES:
+        raise ValueError(f"engine must be one of {LAYOUT_ENGINES}")
+    if graph.number_of_nodes() == 0:
+        return {}
+    if engine == "forceatlas2":
+        return forceatlas2_layout(graph, seed=seed)
+
+    import networkx
+    if engine == "spring":
+        positions = networkx.spring_layout(graph, k=1.5 / numpy.sqrt(graph.number_of_nodes()), iterations=100, seed=seed)
+    else:
+        # Graphviz's multilevel Barnes-Hut layout; needs Graphviz and pygraphviz installed
+        try:
+            positions = networkx.nx_agraph.graphviz_layout(graph, prog="sfdp")
+        except ImportError as e:
+            raise ImportError("The sfdp layout engine requires Graphviz and pygraphviz (pip install pygraphviz)") from e
+    nodes = list(positions)
+    normalized = _normalize(numpy.array([positions[node] for node in nodes], dtype=float))
+    return {node: (float(x), float(y)) for node, (x, y) in zip(nodes, normalized)}
+
+
+def place_new_nodes(graph, positions: dict, offset: float=0.02, seed: int=42) -> dict:
+    """Start positions for nodes missing from positions: about offset away from their placed neighbours, or anywhere for loners."""
+    rng = numpy.random.default_rng(seed)
+    placed = dict(positions)
+    missing = [node for node in graph if node not in placed]
+    # Repeated passes let chains of new nodes grow out from the placed part of the graph
+    while missing:
+        still_missing = []
+        for node in missing:
+            neighbours = [placed[neighbour] for neighbour in graph[node] if neighbour in placed]
+            if neighbours:
+                angle = rng.uniform(0, 2 * numpy.pi)
+                placed[node] = tuple(numpy.mean(neighbours, axis=0) + offset * numpy.array([numpy.cos(angle), numpy.sin(angle)]))
+            else:
+                still_missing.append(node)
+        if len(still_missing) == len(missing):
+            for node in still_missing:
+                placed[node] = tuple(rng.uniform(-1, 1, 2))
+            break
+        missing = still_missing
+    return placed
+
+
+def _edge_length(graph, positions: dict) -> float:
+    # Median length of the edges already laid out: the distance new nodes should keep to their neighbours
+    ends = [(positions[u], positions[v]) for u, v in graph.edges() if u != v and u in positions and v in positions]
+    if not ends:
+        return 1 / numpy.sqrt(max(graph.number_of_nodes(), 1))
+    delta = numpy.subtract(*numpy.array(ends, dtype=float).transpose(1, 0, 2))
+    return float(numpy.median(numpy.hypot(delta[:, 0], delta[:, 1])))
+
+
+_CELL_OFFSETS = numpy.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype=numpy.int64)
+
+
+def _cell_keys(cells: numpy.ndarray) -> numpy.ndarray:
+    # One sortable int64 per (x, y) grid cell
+    return (cells[:, 0] << 32) + cells[:, 1]
+
+
+def _grid_pairs(grid_keys: numpy.ndarray, grid_ids: numpy.ndarray, cells: numpy.ndarray, sample: int) -> tuple:
+    """(query, grid id, weight) for the first sample grid entries of each of the 3 x 3 cells around each query cell,
+    weighted by the cell's population over the entries taken. grid_keys sorted, entries of a cell in random order.
+    """
+    keys = _cell_keys((cells[:, None, :] + _CELL_OFFSETS[None, :, :]).reshape(-1, 2))
+    starts = numpy.searchsorted(grid_keys, keys, side='left')
+    population = numpy.searchsorted(grid_keys, keys, side='right') - starts
+    counts = numpy.minimum(population, sample)
+    positions = numpy.arange(counts.sum()) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+    weights = numpy.repeat(population / numpy.maximum(counts, 1), counts)
+    return numpy.repeat(numpy.arange(len(keys)) // len(_CELL_OFFSETS), counts), grid_ids[positions], weights
+
+
+def settle_new_nodes(graph, positions: dict, added: list, length: float, iterations: int=30,
+                     sample_size: int=SETTLE_CELL_SAMPLE, seed: int=42) -> dict:
+    """Relax only the added nodes, leaving everything else where it was.
+
+    Forces are local, Fruchterman-Reingold style with length (the layout's median edge length) as the rest length:
+    attraction to graph neighbours and repulsion from nodes within two edge lengths, found through a grid,
+    so the cost depends on the number of added nodes rather than the size of the graph. All added nodes move at
+    once each iteration, in numpy; each is pushed by at most sample_size nodes per grid cell.
+    """
+    rng = numpy.random.default_rng(seed)
+    nodes = list(graph)
+    index = {node: i for i, node in enumerate(nodes)}
+    points = numpy.array([positions[node] for node in nodes], dtype=float)
+    moving = numpy.array([index[node] for node in added], dtype=numpy.int64)
+    # Edges of the moving nodes as (position in moving, neighbour index) pairs
+    ends = [[index[neighbour] for neighbour in graph[node] if neighbour != node] for node in added]
+    edge_from = numpy.repeat(numpy.arange(len(moving)), [len(neighbours) for neighbours in ends])
+    edge_to = numpy.fromiter((j for neighbours in ends for j in neighbours), dtype=numpy.int64, count=len(edge_from))
+    cell_size = 2 * length
+
+    # Everything but the moving nodes stays put, so their grid is built once
+    fixed = numpy.ones(len(nodes), dtype=bool)
+    fixed[moving] = False
+    fixed_ids = numpy.flatnonzero(fixed)
+    fixed_ids = rng.permutation(fixed_ids)
+    fixed_keys = _cell_keys(numpy.floor(points[fixed_ids] / cell_size).astype(numpy.int64))
+    order = numpy.argsort(fixed_keys, kind='stable')
+    fixed_keys, fixed_ids = fixed_keys[order], fixed_ids[order]
+
+    temperature = length
+    for iteration in range(iterations):
+        current = points[moving]
+        displacement = numpy.zeros_like(current)
+        if len(edge_from):
+            delta = points[edge_to] - current[edge_from]
+            pull = delta * numpy.hypot(delta[:, 0], delta[:, 1])[:, None] / length
+            for axis in (0, 1):
+                displacement[:, axis] += numpy.bincount(edge_from, pull[:, axis], minlength=len(moving))
+
+        # Repulsion from the nodes in the surrounding cells: the fixed grid, and one of the moving nodes as they are now
+        cells = numpy.floor(current / cell_size).astype(numpy.int64)
+        shuffled = rng.permutation(len(moving))
+        moving_keys = _cell_keys(cells[shuffled])
+        order = numpy.argsort(moving_keys, kind='stable')
+        fixed_rows, fixed_close, fixed_weights = _grid_pairs(fixed_keys, fixed_ids, cells, sample_size)
+        moving_rows, moving_close, moving_weights = _grid_pairs(moving_keys[order], shuffled[order], cells, sample_size)
+        others = moving_close != moving_rows
+        rows = numpy.concatenate([fixed_rows, moving_rows[others]])
+        weights = numpy.concatenate([fixed_weights, moving_weights[others]])
+        delta = current[rows] - numpy.concatenate([points[fixed_close], current[moving_close[others]]])
+        distance2 = numpy.maximum((delta ** 2).sum(axis=1), 1e-12)
+        near = distance2 < cell_size ** 2
+        push = delta[near] * (weights[near] * length ** 2 / distance2[near])[:, None]
+        for axis in (0, 1):
+            displacement[:, axis] += numpy.bincount(rows[near], push[:, axis], minlength=len(moving))
+
+        step = numpy.hypot(displacement[:, 0], displacement[:, 1])
+        scale = numpy.divide(numpy.minimum(step, temperature), step, out=numpy.zeros_like(step), where=step > 0)
+        points[moving] = current + displacement * scale[:, None]
+        temperature = length * (1 - (iteration + 1) / iterations) + 1e-3 * length
+
+    settled = dict(positions)
+    for i in moving.tolist():
+        settled[nodes[i]] = (float(points[i, 0]), float(points[i, 1]))
+    return settled
+
+
+def update_layout(graph, previous: dict, engine: str=DEFAULT_LAYOUT_ENGINE, iterations: int=30, seed: int=42) -> dict:
+    """Layout for graph that keeps previous positions and only settles the nodes added since.
+
+    Falls back to a full layout with engine when there is nothing to start from or most of the graph is new.
+    """
+    kept = {node: xy for node, xy in (previous or {}).items() if node in graph}
+    added = [node for node in graph if node not in kept]
+    if not kept or len(added) > len(kept):
+        return compute_layout(graph, engine, seed)
+    if not added:
+        return kept
+    length = _edge_length(graph, kept)
+    start = place_new_nodes(graph, kept, offset=length, seed=seed)
+    return settle_new_nodes(graph, start, added, length, iterations)
+
+
+class LayoutCache:
+    """Layouts on disk, one JSON file per (graph version, engine). Only the newest keep files per engine are kept."""
+    def __init__(self, directory: str=None, keep: int=5):
+        self.directory = directory or os.getenv('LAYOUT_CACHE_DIR', '.layout_cache')
+        self.keep = keep
+
+    def _path(self, version: str, engine: str) -> str:
+        digest = hashlib.sha256(version.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{engine}-{digest}.json")
+
+    def _files(self, engine: str) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.startswith(f"{engine}-") and name.endswith(".json")]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        with open(path) as layout_file:
+            data = json.load(layout_file)
+        return {node: tuple(xy) for node, xy in zip(data["nodes"], data["positions"])}
+
+    def get(self, version: str, engine: str):
+        path = self._path(version, engine)
+        return self._read(path) if os.path.exists(path) else None
+
+    def latest(self, engine: str):
+        """Most recently stored layout for engine, whatever its version; the base for incremental updates."""
+        files = self._files(engine)
+        return self._read(files[0]) if files else None
+
+    def put(self, version: str, engine: str, positions: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(version, engine)
+        nodes = list(positions)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as layout_file:
+            json.dump({"version": version, "engine": engine, "nodes": nodes,
+                       "positions": [[round(coordinate, 5) for coordinate in positions[node]] for node in nodes]}, layout_file)
+        os.replace(temporary, path)
+        for stale in self._files(engine)[self.keep:]:
+            os.remove(stale)
+
+
+def get_layout(graph, version: str, engine: str=DEFAULT_LAYOUT_ENGINE, cache: LayoutCache=None) -> dict:
+    """Cached layout for this graph version; computed incrementally from the latest stored layout on a miss."""
+    cache = cache or LayoutCache()
+    positions = cache.get(version, engine)
+    if positions is not None and all(node in positions for node in graph):
+        return positions
+    positions = update_layout(graph, positions or cache.latest(engine), engine)
+    cache.put(version, engine, positions)
+    return positions
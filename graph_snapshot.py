@@ -0,0 +1,324 @@
+"""Versioned columnar snapshots of the knowledge graph, for fast reloads and offline analytics.
+
+A snapshot is a numbered directory (000001, 000002, ...) with one Arrow IPC (or Parquet) file per table - entities,
+relationship_types, relationships, attributes - and a manifest.json recording the graph_version() it was taken at
+and the highest ID exported per table (its watermark).
+
+- A full snapshot holds every row.
+- A delta holds the rows above its base snapshot's watermarks, plus the IDs of rows deleted since then
+  (<table>-deleted files). Reading a snapshot applies its chain of deltas to the full snapshot underneath.
+- A delta also holds the rows at or below the base's watermarks that the chain doesn't have: on PostgreSQL a
+  transaction can commit after one that took a higher ID, and its rows only show up once the snapshot that set the
+  watermark was already written.
+
+Arrow files are memory-mapped and each table is one record batch, so a full snapshot loads without copying: the
+entity name column (large_string: int64 offsets + UTF-8 data) is exactly the name table KnowledgeGraphIndex keeps.
+Parquet is smaller and readable by any analytics tool, but is decoded on read.
+
+Deltas only see inserts and deletes. In-place edits (edit_entity, attributes re-pointed by merge_entities) are
+picked up by the next full snapshot, which export() writes every max_deltas deltas or when asked to. So is a reused
+ID: the tables are created with AUTOINCREMENT on SQLite so an ID is never handed out twice, but a SQLite database
+created before that can give the ID of a deleted highest row to the next insert; export --full after deletions there.
+
+    python graph_snapshot.py export [--full] [--format parquet] [--directory .graph_snapshots]
+    python graph_snapshot.py list
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import zlib
+import numpy
+from sqlalchemy import and_, func, or_, select
+from database_manager import GRAPH_BATCH_SIZE, Attribute, DatabaseManager, Entity, Relationship, RelationshipType, graph_version
+from graph_index import KnowledgeGraphIndex, map_edges
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("arrow", "parquet")
+EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet"}
+MANIFEST = "manifest.json"
+# Layout of the snapshot files; bumped when it changes, older snapshots then need a new full export
+SNAPSHOT_FORMAT_VERSION = 1
+
+# table -> (model, primary key); the columns are in _schemas()
+TABLES = {
+    "entities": (Entity, "entID"),
+    "relationship_types": (RelationshipType, "typeID"),
+    "relationships": (Relationship, "relationshipID"),
+    "attributes": (Attribute, "attributeID"),
+}
+# Watermarks are taken in this order: a relationship or attribute only exists after its entity (and type) does,
+# so every row at or below the first two watermarks refers to rows at or below the last two
+WATERMARK_ORDER = ("relationships", "attributes", "relationship_types", "entities")
+
+
+def _schemas() -> dict:
+    import pyarrow
+    return {
+        # large_string has the int64 offsets KnowledgeGraphIndex uses; name_hash is zlib.crc32 of the UTF-8 name
+        "entities": pyarrow.schema([("entID", pyarrow.int64()), ("name", pyarrow.large_string()),
+                                    ("type", pyarrow.string()), ("name_hash", pyarrow.uint32())]),
+        "relationship_types": pyarrow.schema([("typeID", pyarrow.int64()), ("type_name", pyarrow.string())]),
+        "relationships": pyarrow.schema([("relationshipID", pyarrow.int64()), ("sourceID", pyarrow.int64()),
+                                         ("targetID", pyarrow.int64()), ("typeID", pyarrow.int64())]),
+        "attributes": pyarrow.schema([("attributeID", pyarrow.int64()), ("name", pyarrow.string()),
+                                      ("value", pyarrow.string()), ("entityID", pyarrow.int64())]),
+    }
+
+
+def _column(table, name: str):
+    """The column as one Arrow array; zero-copy unless it spans several chunks (a snapshot with deltas)."""
+    column = table.column(name)
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+class SnapshotStore:
+    """Snapshots under directory (GRAPH_SNAPSHOT_DIR, default .graph_snapshots), written in format ("arrow" or "parquet").
+
+    Only the newest keep full snapshots and the deltas on top of them are kept.
+    """
+    def __init__(self, directory: str=None, format: str="arrow", max_deltas: int=10, keep: int=2):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}")
+        self.directory = directory or os.getenv('GRAPH_SNAPSHOT_DIR', '.graph_snapshots')
+        self.format = format
+        self.max_deltas = max_deltas
+        self.keep = keep
+
+    # Listing
+    def snapshots(self) -> list:
+        """Names of the complete snapshots, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.isdigit() and os.path.exists(os.path.join(self.directory, name, MANIFEST)))
+
+    def latest(self) -> str:
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def manifest(self, name: str=None) -> dict:
+        name = name or self.latest()
+        if name is None:
+            raise FileNotFoundError(f"No snapshots in {self.directory}")
+        with open(os.path.join(self.directory, name, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Snapshot {name} has format version {manifest['format_version']}, "
+                             f"not {SNAPSHOT_FORMAT_VERSION}; export a new full snapshot")
+        return manifest
+
+    def chain(self, name: str=None) -> list:
+        """The snapshot's full base followed by its deltas up to and including name."""
+        name = name or self.latest()
+        chain = [name]
+        while (base := self.manifest(chain[0])["base"]) is not None:
+            chain.insert(0, base)
+        return chain
+
+    # Export
+    @METRICS.timed("snapshot.export")
+    def export(self, db_manager: DatabaseManager, full: bool=False, batch_size: int=GRAPH_BATCH_SIZE) -> str:
+        """Snapshot the database and return the snapshot's name.
+
+        Writes a delta on top of the latest snapshot unless full is set, there is none yet, or its chain already has
+        max_deltas deltas. Nothing is written when the graph_version() hasn't changed since the latest snapshot.
+        """
+        base = self.latest()
+        base_manifest = self.manifest(base) if base else None
+        if base_manifest and len(self.chain(base)) > self.max_deltas:
+            full = True
+
+        with db_manager.session_scope() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                # One MVCC snapshot for every query below
+                session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            version = graph_version(session)
+            if not full and base_manifest and base_manifest["graph_version"] == version:
+                logger.info("Graph unchanged since snapshot %s (version %s)", base, version)
+                return base
+            watermarks = {}
+            for table in WATERMARK_ORDER:
+                model, key = TABLES[table]
+                watermarks[table] = session.scalar(select(func.max(getattr(model, key)))) or 0
+
+            name = f"{int(base or 0) + 1:06d}"
+            path = os.path.join(self.directory, name)
+            partial = path + ".partial"
+            shutil.rmtree(partial, ignore_errors=True)
+            os.makedirs(partial)
+            schemas = _schemas()
+            tables = {}
+            for table, (model, key) in TABLES.items():
+                low = 0 if full or base is None else base_manifest["tables"][table]["watermark"]
+                deleted = late = numpy.empty(0, dtype=numpy.int64)
+                if low:
+                    deleted, late = self._compare(session, base, table, low, batch_size)
+                if len(deleted):
+                    import pyarrow
+                    self._write_table(pyarrow.table({key: deleted}), partial, f"{table}-deleted")
+                rows = self._write(session, table, schemas[table], low, watermarks[table], late, partial, batch_size)
+                tables[table] = {"watermark": watermarks[table], "rows": rows, "deleted": len(deleted), "late": len(late)}
+
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION, "format": self.format, "kind": "full" if full or base is None else "delta",
+            "base": None if full or base is None else base, "graph_version": version, "created_at": time.time(),
+            "tables": tables,
+        }
+        with open(os.path.join(partial, MANIFEST), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        # Readers only see directories with a manifest, and the rename makes it appear with every file in place
+        os.rename(partial, path)
+        logger.info("Wrote %s snapshot %s (version %s): %s", manifest["kind"], name, version,
+                    ", ".join(f"{table} +{stats['rows']} -{stats['deleted']}" for table, stats in tables.items()))
+        self._prune()
+        return name
+
+    def _write(self, session, table: str, schema, low: int, high: int, late: numpy.ndarray, directory: str, batch_size: int) -> int:
+        """Write the rows with low < ID <= high, and those with the late IDs, as a single record batch; returns how
+        many there were."""
+        import pyarrow
+        model, key = TABLES[table]
+        primary_key = getattr(model, key)
+        condition = and_(primary_key > low, primary_key <= high)
+        if len(late):
+            condition = or_(condition, primary_key.in_(late.tolist()))
+        query = (
+            select(*(getattr(model, field) for field in schema.names if field != "name_hash"))
+            .where(condition).order_by(primary_key)
+            .execution_options(yield_per=batch_size)
+        )
+        batches = []
+        for rows in session.connection().execute(query).partitions():
+            columns = [list(column) for column in zip(*rows)]
+            if table == "entities":
+                columns.append([zlib.crc32(name.encode()) for name in columns[1]])
+            batches.append(pyarrow.record_batch(columns, schema=schema))
+        self._write_table(pyarrow.Table.from_batches(batches, schema=schema).combine_chunks(), directory, table)
+        return sum(batch.num_rows for batch in batches)
+
+    def _compare(self, session, base: str, table: str, watermark: int, batch_size: int) -> tuple:
+        """IDs up to watermark the base snapshot has and the database no longer does (deleted), and the other way
+        round (late)."""
+        model, key = TABLES[table]
+        primary_key = getattr(model, key)
+        query = select(primary_key).where(primary_key <= watermark).execution_options(yield_per=batch_size)
+        current = [numpy.fromiter((row[0] for row in rows), dtype=numpy.int64, count=len(rows))
+                   for rows in session.connection().execute(query).partitions()]
+        current = numpy.concatenate(current) if current else numpy.empty(0, dtype=numpy.int64)
+        exported = _column(self.read_table(base, table, [key]), key).to_numpy()
+        return numpy.setdiff1d(exported, current, assume_unique=True), numpy.setdiff1d(current, exported, assume_unique=True)
+
+    def _write_table(self, table, directory: str, name: str):
+        path = os.path.join(directory, name + EXTENSIONS[self.format])
+        if self.format == "parquet":
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, path)
+            return
+        import pyarrow.ipc
+        with pyarrow.OSFile(path, "wb") as sink, pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+
+    def _prune(self):
+        fulls = [name for name in self.snapshots() if self.manifest(name)["kind"] == "full"]
+        if len(fulls) <= self.keep:
+            return
+        oldest_kept = fulls[-self.keep]
+        for name in self.snapshots():
+            if name < oldest_kept:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    # Reading
+    def _read_file(self, name: str, file: str, columns: list=None):
+        """One file of a snapshot as a pyarrow Table; None if the snapshot has no such file."""
+        import pyarrow
+        format = self.manifest(name)["format"]
+        path = os.path.join(self.directory, name, file + EXTENSIONS[format])
+        if not os.path.exists(path):
+            return None
+        if format == "parquet":
+            import pyarrow.parquet
+            return pyarrow.parquet.read_table(path, columns=columns, memory_map=True)
+        import pyarrow.ipc
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+        return table.select(columns) if columns else table
+
+    def read_table(self, name: str=None, table: str="entities", columns: list=None):
+        """A table as of the snapshot: its full base with every delta's deletions and new rows applied, in ID order."""
+        import pyarrow
+        import pyarrow.compute
+        key = TABLES[table][1]
+        if columns and key not in columns:
+            columns = [key, *columns]
+        result = None
+        late = False
+        for snapshot in self.chain(name):
+            deleted = self._read_file(snapshot, f"{table}-deleted")
+            if result is not None and deleted is not None:
+                result = result.filter(pyarrow.compute.invert(pyarrow.compute.is_in(result.column(key), deleted.column(key))))
+            rows = self._read_file(snapshot, table, columns)
+            result = rows if result is None else pyarrow.concat_tables([result, rows])
+            late = late or self.manifest(snapshot)["tables"][table].get("late", 0) > 0
+        # Rows that committed late have IDs below the ones before them; only then is the concatenation out of order
+        return result.sort_by(key) if late else result
+
+    def read_tables(self, name: str=None) -> dict:
+        """{table: pyarrow Table} for every table, e.g. for offline analytics in pandas or DuckDB."""
+        return {table: self.read_table(name, table) for table in TABLES}
+
+    @METRICS.timed("snapshot.load_index")
+    def load_index(self, name: str=None) -> KnowledgeGraphIndex:
+        """KnowledgeGraphIndex of the snapshot (the latest by default), built on its memory-mapped columns."""
+        import pyarrow.compute
+        name = name or self.latest()
+        entities = self.read_table(name, "entities")
+        names = _column(entities, "name")
+        _, offsets, data = names.buffers()
+        name_offsets = numpy.frombuffer(offsets, dtype=numpy.int64)[names.offset:names.offset + len(names) + 1]
+        types = pyarrow.compute.dictionary_encode(_column(entities, "type"))
+        entity_ids = _column(entities, "entID").to_numpy()
+
+        relationship_types = self.read_table(name, "relationship_types")
+        type_ids = _column(relationship_types, "typeID").to_numpy()
+        relationships = self.read_table(name, "relationships")
+        sources, targets, edge_types = map_edges(
+            entity_ids, type_ids, _column(relationships, "sourceID").to_numpy(),
+            _column(relationships, "targetID").to_numpy(), _column(relationships, "typeID").to_numpy(),
+        )
+        return KnowledgeGraphIndex.from_buffers(
+            name_offsets, b"" if data is None else data, _column(entities, "name_hash").to_numpy(),
+            types.indices.to_numpy(), types.dictionary.to_pylist(), sources, targets, edge_types,
+            _column(relationship_types, "type_name").to_pylist(), entity_ids, self.manifest(name)["graph_version"],
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or list columnar snapshots of the knowledge graph.")
+    parser.add_argument("command", choices=["export", "list"])
+    parser.add_argument("--directory", help="snapshot directory (default: $GRAPH_SNAPSHOT_DIR or .graph_snapshots)")
+    parser.add_argument("--format", choices=FORMATS, default="arrow")
+    parser.add_argument("--full", action="store_true", help="write a full snapshot rather than a delta")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    store = SnapshotStore(args.directory, args.format)
+    if args.command == "export":
+        db_manager = DatabaseManager()
+        try:
+            db_manager.create_tables()
+            store.export(db_manager, full=args.full)
+        finally:
+            db_manager.close_db()
+        return
+    for name in store.snapshots():
+        manifest = store.manifest(name)
+        counts = ", ".join(f"{table} +{stats['rows']} -{stats['deleted']}" for table, stats in manifest["tables"].items())
+        print(f"{name} {manifest['kind']:<5} {manifest['format']:<7} {manifest['graph_version']:<24} {counts}")
+
+
+if __name__ == "__main__":
+    main()
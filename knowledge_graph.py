@@ -1,28 +1,266 @@
-import networkx, streamlit
-import matplotlib.pyplot as pyplot
-from database_manager import DatabaseManager
+# networkx, matplotlib and streamlit are imported on first use, so ingest-only workers never pay for them
+import html
+import json
+from database_manager import DatabaseManager, GRAPH_BATCH_SIZE, graph_version, stream_graph_edges, stream_graph_nodes
+from metrics import METRICS
 # import matplotlib.cm as colourmaps
 # import matplotlib.colors as mplotcolours
 
+# Colours per entity type in the HTML export, most common type first
+PALETTE = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+# Self-contained page rendering the graph with sigma.js (WebGL). Positions come precomputed, so the browser does
+# no layout work. Labels are level-of-detail: sigma only draws those of nodes big enough on screen and spaced
+# out on its label grid, so more appear as you zoom in. Hovering a node highlights its neighbourhood.
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+  html, body, #graph { margin: 0; width: 100%; height: 100%; background: #fff; }
+  #info { position: absolute; top: 8px; left: 8px; font: 12px sans-serif; background: rgba(255, 255, 255, 0.85); padding: 4px 8px; }
+</style>
+<script src="https://cdn.jsdelivr.net/npm/graphology@0.25.4/dist/graphology.umd.min.js"></script>
+<script src="https://cdn.jsdelivr.net/npm/sigma@2.4.0/build/sigma.min.js"></script>
+</head>
+<body>
+<div id="graph"></div>
+<div id="info"></div>
+<script>
+const data = __DATA__;
+const graph = new graphology.Graph({type: "undirected"});
+data.nodes.forEach(([label, x, y, size, type], i) => graph.addNode(i, {label, x, y, size, color: data.colors[type] || "#999", entityType: type}));
+data.edges.forEach(([source, target, label]) => graph.mergeEdge(source, target, {label, size: 0.5, color: "#d0d0d0"}));
+
+const renderer = new Sigma(graph, document.getElementById("graph"), {
+  renderEdgeLabels: data.edgeLabels,
+  labelRenderedSizeThreshold: data.labelThreshold,
+  labelDensity: 0.07,
+  labelGridCellSize: 60,
+});
+
+let hovered = null;
+renderer.on("enterNode", ({node}) => { hovered = node; renderer.refresh(); });
+renderer.on("leaveNode", () => { hovered = null; renderer.refresh(); });
+renderer.setSetting("nodeReducer", (node, attributes) =>
+  hovered !== null && node !== hovered && !graph.areNeighbors(node, hovered) ? {...attributes, color: "#eee", label: ""} : attributes);
+renderer.setSetting("edgeReducer", (edge, attributes) =>
+  hovered !== null && !graph.hasExtremity(edge, hovered) ? {...attributes, hidden: true} : attributes);
+document.getElementById("info").textContent = `${graph.order} entities, ${graph.size} relationships`;
+</script>
+</body>
+</html>
+"""
+
+def embed_html(page: str, height: int=750):
+    """Show a full HTML page (with scripts) in Streamlit."""
+    import streamlit
+    if hasattr(streamlit, 'iframe'):
+        streamlit.iframe(page, height=height)
+    else:
+        import streamlit.components.v1 as components
+        components.html(page, height=height)
+
 class KnowledgeGrapher:
-    def __init__(self):
+    def __init__(self, db_manager: DatabaseManager=None, session=None, layout_cache=None):
+        """Use an existing DatabaseManager or SQLAlchemy session; one is only opened if neither is given.
+
+        layout_cache is a graph_layout.LayoutCache; the default one keeps layouts under .layout_cache.
+        """
+        import networkx
         self.graph = networkx.Graph()
-        self.db_manager = DatabaseManager()
-    
+        self._db_manager = db_manager
+        self.session = session
+        self.layout_cache = layout_cache
+        # graph_version() of the database when the graph was loaded, None for graphs built by hand
+        self.version = None
+        self._layouts = {}  # engine -> positions of the current graph
+        self._nodes_by_type = None  # entity type -> node names, built on the first filter()
+        self._edges_by_type = None  # relationship type -> [(source, target)]
+
+    @property
+    def db_manager(self) -> DatabaseManager:
+        if self._db_manager is None:
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    @METRICS.timed("graph.load")
+    def load_graph(self, batch_size: int=GRAPH_BATCH_SIZE):
+        """Build the graph from the database with one node query and one joined edge query, replacing the current one."""
+        import networkx
+        session = self.session if self.session is not None else self.db_manager.session
+        # Taken before reading, so rows written during the load give a newer version next time
+        self.version = graph_version(session)
+        self._layouts.clear()
+        self._nodes_by_type = self._edges_by_type = None
+        # A new graph rather than clearing the old one: deleted entities go, and views from filter() keep theirs
+        self.graph = networkx.Graph()
+        self.graph.add_nodes_from((name, {'entity_type': type}) for name, type in stream_graph_nodes(session, batch_size))
+        self.graph.add_edges_from(
+            (source, target, {'relationship_type': relationship_type})
+            for source, target, relationship_type in stream_graph_edges(session, batch_size)
+        )
+
+    @METRICS.timed("graph.load_snapshot")
+    def load_snapshot(self, directory: str=None, name: str=None):
+        """Build the graph from a graph_snapshot snapshot (the latest by default) instead of the database.
+
+        Gives the same graph and version as load_graph() did when the snapshot was taken, so cached layouts still apply.
+        """
+        from graph_snapshot import SnapshotStore
+        index = SnapshotStore(directory).load_index(name)
+        self.version = index.version
+        self._layouts.clear()
+        self._nodes_by_type = self._edges_by_type = None
+        self.graph = index.to_networkx(multigraph=False)
+
     def populate_graph(self, entities: list, relationships: list):
         for entity in entities:
             self.graph.add_node(entity.name, entity_type=entity.type)
         for relationship in relationships:
-            self.graph.add_edge(self.db_manager.search_entities(entityID=relationship.sourceID)[0].name, 
-                                self.db_manager.search_entities(entityID=relationship.targetID)[0].name, 
-                                relationship_type=self.db_manager.search_relationship_types(typeID=relationship.typeID)[0].type_name
+            self.graph.add_edge(self.db_manager.get_entity_name(relationship.sourceID), 
+                                self.db_manager.get_entity_name(relationship.targetID), 
+                                relationship_type=self.db_manager.get_type_name(relationship.typeID)
                                 )
     
-    def draw_graph(self):
+    def _build_type_index(self):
+        self._nodes_by_type, self._edges_by_type = {}, {}
+        for node, entity_type in self.graph.nodes(data='entity_type'):
+            self._nodes_by_type.setdefault(entity_type, set()).add(node)
+        for source, target, relationship_type in self.graph.edges(data='relationship_type'):
+            self._edges_by_type.setdefault(relationship_type, []).append((source, target))
+
+    @METRICS.timed("graph.filter")
+    def filter(self, entity_types: list=None, relationship_types: list=None, center: str=None, depth: int=1,
+               max_nodes: int=None) -> 'KnowledgeGrapher':
+        """A view of the graph limited to entity types, relationship types and/or the depth-hop neighbourhood of center.
+
+        Works on in-memory type indexes and only walks the neighbourhood around center, so it doesn't touch the
+        database or rescan the whole graph. Beyond max_nodes, the best connected nodes are kept (center always).
+        The view reuses this graph's positions, so it needs no layout of its own.
+        """
+        import networkx
+        if self._nodes_by_type is None:
+            self._build_type_index()
+        adjacency = self.graph.adj
+        node_types = set(entity_types) if entity_types else None
+        edge_types = set(relationship_types) if relationship_types else None
+
+        def node_allowed(node):
+            return node_types is None or self.graph.nodes[node].get('entity_type') in node_types
+
+        if center is not None:
+            # Breadth-first over allowed edges and nodes only, so the cost is the size of the neighbourhood
+            nodes = {center} if center in self.graph and node_allowed(center) else set()
+            frontier = list(nodes)
+            for _ in range(depth):
+                next_frontier = []
+                for node in frontier:
+                    for neighbour, attributes in adjacency[node].items():
+                        if neighbour not in nodes and (edge_types is None or attributes.get('relationship_type') in edge_types) \
+                                and node_allowed(neighbour):
+                            nodes.add(neighbour)
+                            next_frontier.append(neighbour)
+                frontier = next_frontier
+        elif edge_types is not None:
+            nodes = {node for relationship_type in edge_types for edge in self._edges_by_type.get(relationship_type, ()) for node in edge}
+            if node_types is not None:
+                nodes = {node for node in nodes if node_allowed(node)}
+        elif node_types is not None:
+            nodes = set().union(*(self._nodes_by_type.get(entity_type, set()) for entity_type in node_types))
+        else:
+            nodes = set(self.graph)
+
+        if max_nodes is not None and len(nodes) > max_nodes:
+            degree = self.graph.degree
+            keep = {center} if center in nodes else set()
+            keep.update(sorted(nodes - keep, key=degree, reverse=True)[:max_nodes - len(keep)])
+            nodes = keep
+
+        graph = networkx.Graph()
+        graph.add_nodes_from((node, self.graph.nodes[node]) for node in nodes)
+        if edge_types is not None and center is None:
+            edges = (edge for relationship_type in edge_types for edge in self._edges_by_type.get(relationship_type, ()))
+            graph.add_edges_from((u, v, adjacency[u][v]) for u, v in edges if u in nodes and v in nodes)
+        else:
+            graph.add_edges_from(
+                (u, v, attributes) for u in nodes for v, attributes in adjacency[u].items()
+                if v in nodes and (edge_types is None or attributes.get('relationship_type') in edge_types)
+            )
+
+        view = KnowledgeGrapher(self._db_manager, self.session, self.layout_cache)
+        view.graph = graph
+        view._layouts = {engine: {node: positions[node] for node in view.graph} for engine, positions in self._layouts.items()}
+        return view
+
+    @METRICS.timed("graph.layout")
+    def layout(self, engine: str=None) -> dict:
+        """Node positions, computed once per graph version and engine and persisted across runs.
+
+        When the graph grew since the last layout, only the new nodes are placed.
+        """
+        from graph_layout import DEFAULT_LAYOUT_ENGINE, LayoutCache, get_layout, update_layout
+        engine = engine or DEFAULT_LAYOUT_ENGINE
+        positions = self._layouts.get(engine)
+        if positions is None or len(positions) != self.graph.number_of_nodes() or not all(node in positions for node in self.graph):
+            if self.version is not None:
+                if self.layout_cache is None:
+                    self.layout_cache = LayoutCache()
+                positions = get_layout(self.graph, self.version, engine, self.layout_cache)
+            else:
+                positions = update_layout(self.graph, positions, engine)
+            self._layouts[engine] = positions
+        return positions
+
+    @METRICS.timed("graph.render")
+    def to_html(self, engine: str=None, title: str="Knowledge graph", edge_label_limit: int=2000, label_threshold: float=8) -> str:
+        """Interactive WebGL page for the graph; fine for tens of thousands of nodes.
+
+        Edge labels are only drawn for graphs of at most edge_label_limit edges. Node labels show once a node is
+        label_threshold pixels across on screen, hubs first, more as you zoom in.
+        """
+        positions = self.layout(engine)
+        index = {node: i for i, node in enumerate(self.graph)}
+        types = {}
+        for _, entity_type in self.graph.nodes(data='entity_type'):
+            types[entity_type] = types.get(entity_type, 0) + 1
+        colors = {entity_type: PALETTE[i % len(PALETTE)] for i, entity_type in enumerate(sorted(types, key=types.get, reverse=True))}
+
+        degree = dict(self.graph.degree())
+        data = {
+            'nodes': [[str(node), round(positions[node][0], 5), round(positions[node][1], 5),
+                       round(2 + 2 * degree[node] ** 0.5, 2), attributes.get('entity_type')]
+                      for node, attributes in self.graph.nodes(data=True)],
+            'edges': [[index[source], index[target], relationship_type]
+                      for source, target, relationship_type in self.graph.edges(data='relationship_type')],
+            'colors': colors,
+            'edgeLabels': self.graph.number_of_edges() <= edge_label_limit,
+            'labelThreshold': label_threshold,
+        }
+        # Names come from LLM output: no "<" may reach the inline script, where "</script>" or "<!--" would break out
+        payload = json.dumps(data, separators=(',', ':')).replace('<', '\\u003c')
+        return HTML_TEMPLATE.replace('__TITLE__', html.escape(title)).replace('__DATA__', payload)
+
+    def export_html(self, path: str, engine: str=None, **options):
+        with open(path, 'w', encoding='utf-8') as html_file:
+            html_file.write(self.to_html(engine, **options))
+
+    def show_interactive(self, engine: str=None, height: int=750, **options):
+        """Render the interactive graph inside a Streamlit app."""
+        embed_html(self.to_html(engine, **options), height)
+
+    @METRICS.timed("graph.draw")
+    def draw_graph(self, engine: str=None, max_labels: int=200, edge_label_limit: int=300):
+        """Static matplotlib drawing. Only the max_labels best connected nodes get a label, edge labels only on small graphs."""
+        import matplotlib.pyplot as pyplot
+        import networkx
+        import streamlit
         pyplot.figure(figsize=(18, 8))
 
-        # Set a fixed layout for consistency, adjust k parameter to spread nodes more
-        pos = networkx.spring_layout(self.graph, k=1.5, iterations=100, seed=42)
+        # Cached per graph version instead of a fresh spring layout on every rerun
+        pos = self.layout(engine)
+        small = self.graph.number_of_nodes() <= max_labels
 
         entity_types = set()
         for node in self.graph.nodes():
@@ -37,20 +275,22 @@ class KnowledgeGrapher:
         node_colors = [single_color] * len(self.graph.nodes())
         
         # Increase node size for better visibility
-        networkx.draw_networkx_nodes(self.graph, pos, node_color=node_colors, node_size=900, alpha=0.8)
+        networkx.draw_networkx_nodes(self.graph, pos, node_color=node_colors, node_size=900 if small else 20, alpha=0.8)
 
         # Assign the same color to all edges
         edge_colors = [single_color] * len(self.graph.edges())
         
         # Improve edge visualization
-        networkx.draw_networkx_edges(self.graph, pos, edge_color=edge_colors, width=2, alpha=0.7)
+        networkx.draw_networkx_edges(self.graph, pos, edge_color=edge_colors, width=2 if small else 0.3, alpha=0.7)
 
         # Draw edge labels with relationship types - make them smaller and position them better
-        edge_labels = networkx.get_edge_attributes(self.graph, 'relationship_type')
-        networkx.draw_networkx_edge_labels(self.graph, pos, edge_labels=edge_labels, font_size=7, font_color='darkblue', bbox=dict(facecolor='white', alpha=0.7), rotate=False)
-                            
-        # Draw node labels with better visibility
-        networkx.draw_networkx_labels(self.graph, pos, font_weight='bold', font_size=10, font_color='black', bbox=dict(facecolor='white', alpha=0.7, pad=3))
+        if self.graph.number_of_edges() <= edge_label_limit:
+            edge_labels = networkx.get_edge_attributes(self.graph, 'relationship_type')
+            networkx.draw_networkx_edge_labels(self.graph, pos, edge_labels=edge_labels, font_size=7, font_color='darkblue', bbox=dict(facecolor='white', alpha=0.7), rotate=False)
+
+        # Draw node labels with better visibility, hubs only on big graphs
+        labelled = sorted(self.graph.degree(), key=lambda item: item[1], reverse=True)[:max_labels]
+        networkx.draw_networkx_labels(self.graph, pos, labels={node: node for node, _ in labelled}, font_weight='bold', font_size=10, font_color='black', bbox=dict(facecolor='white', alpha=0.7, pad=3))
 
         # Adjust plot margins to ensure everything fits
         pyplot.tight_layout()
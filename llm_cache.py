@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Run eviction once every this many writes instead of on every one
+EVICT_EVERY = 100
+
+def cache_key(model_name: str, template: str, inputs: dict) -> str:
+    """Content address of an LLM request: hash of the model, the prompt template and the prompt inputs (chunk text, entities)."""
+    payload = json.dumps([model_name, template, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SQLiteLLMCache:
+    """On-disk LLM response cache in a standalone SQLite file, with TTL and size-based (least recently used) eviction."""
+    def __init__(self, path: str=None, ttl: float=None, max_entries: int=100000):
+        self.path = path or os.getenv('LLM_CACHE_PATH', '.llm_cache.sqlite3')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock, self.connection:
+            row = self.connection.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self.connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        with self._lock, self.connection:
+            if self.ttl is not None:
+                self.connection.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            if self.max_entries is not None:
+                self.connection.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def clear(self):
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM llm_cache")
+
+    def close(self):
+        self.connection.close()
+
+
+class DatabaseLLMCache:
+    """LLM response cache stored in the llm_cache table of an existing DatabaseManager database."""
+    def __init__(self, db_manager, ttl: float=None, max_entries: int=100000):
+        self.db_manager = db_manager
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+
+    def get(self, key: str):
+        return self.db_manager.get_llm_response(key, self.ttl)
+
+    def set(self, key: str, response: str):
+        self.db_manager.set_llm_response(key, response)
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        self.db_manager.evict_llm_responses(self.ttl, self.max_entries)
+
+    def clear(self):
+        self.db_manager.evict_llm_responses(max_entries=0)
+
+    def close(self):
+        pass
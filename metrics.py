@@ -0,0 +1,263 @@
+"""Pipeline instrumentation: latency histograms, counters and an optional profiler hook.
+
+Stages record into the process-wide METRICS registry:
+- METRICS.timer(stage) / METRICS.timed(stage) time a block or function into the stage_seconds histogram and count
+  its calls and errors
+- METRICS.inc(name, value, **labels) bumps a counter (pages, tokens, queries, ...)
+
+Recording is a dict update under a lock, so it is cheap next to anything worth timing. Worker processes send
+METRICS.snapshot() to the parent, which merges it. METRICS.write(path) exports JSON (.json) or Prometheus text
+(anything else), METRICS.report() a readable summary.
+"""
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency buckets: a scrape or LLM call takes 10ms-2min, a query 100us-1s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120)
+# Prepended to every metric name in the Prometheus export
+PROMETHEUS_PREFIX = "kg_"
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class Histogram:
+    """Counts of observations per bucket of LATENCY_BUCKETS, plus their sum and maximum."""
+    def __init__(self, buckets: tuple=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one counts values over the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, counts: list, total: float, maximum: float):
+        for index, count in enumerate(counts):
+            self.counts[index] += count
+        self.count += sum(counts)
+        self.sum += total
+        self.max = max(self.max, maximum)
+
+    def quantile(self, q: float) -> float:
+        """Estimate of the q-quantile, interpolated within its bucket like Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99), "max": self.max,
+        }
+
+
+def _series(name: str, labels: tuple) -> str:
+    # name{key="value",...}, the Prometheus notation, also used as the JSON key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms, keyed on (name, sorted label items)."""
+    def __init__(self):
+        self.enabled = True
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time the block into stage_seconds{stage=...}; failures also count in stage_errors_total."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("stage_errors_total", stage=stage)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def timed(self, stage: str):
+        """Decorator form of timer()."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # Crossing process boundaries
+    def snapshot(self) -> dict:
+        """Picklable copy of everything recorded so far, for merge() in another process."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {key: (list(h.counts), h.sum, h.max) for key, h in self.histograms.items()},
+            }
+
+    def merge(self, snapshot: dict):
+        """Add a snapshot() taken elsewhere (e.g. in a worker process) to this registry."""
+        with self._lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (counts, total, maximum) in snapshot["histograms"].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(counts, total, maximum)
+
+    # Export
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {_series(name, labels): value for (name, labels), value in sorted(self.counters.items())},
+                "histograms": {_series(name, labels): h.summary() for (name, labels), h in sorted(self.histograms.items())},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format, e.g. for the node_exporter textfile collector."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count, h.buckets)) for key, h in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            name = PROMETHEUS_PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{_series(name, labels)} {value}")
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            name = PROMETHEUS_PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip((*buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(f"{_series(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {total}")
+            lines.append(f"{_series(name + '_count', labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Write the metrics to path: JSON if it ends in .json, Prometheus text otherwise."""
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        with open(path, "w") as metrics_file:
+            metrics_file.write(content)
+
+    def report(self) -> str:
+        """Latency per stage and every counter, as a plain-text table."""
+        data = self.to_dict()
+        width = max(map(len, (*data["histograms"], *data["counters"], "series")))
+        lines = [f"{'series':<{width}} {'count':>8} {'mean':>9} {'p50':>9} {'p95':>9} {'max':>9} {'total':>9}"]
+        for series, summary in data["histograms"].items():
+            lines.append(
+                f"{series:<{width}} {summary['count']:>8} "
+                + " ".join(f"{summary[column] * 1000:>7.1f}ms" for column in ("mean", "p50", "p95", "max"))
+                + f" {summary['sum']:>8.2f}s"
+            )
+        for series, value in data["counters"].items():
+            lines.append(f"{series:<{width}} {value:>8g}")
+        return "\n".join(lines)
+
+
+# The registry every module records into
+METRICS = Metrics()
+
+
+def profile_path(directory: str, name: str, profiler: str="cprofile") -> str:
+    """Where profiled() output for the named thread or process goes: <directory>/<name>.prof or .html."""
+    return os.path.join(directory, name + (".html" if profiler == "pyinstrument" else ".prof"))
+
+@contextmanager
+def profiled(path: str=None, profiler: str="cprofile"):
+    """Profile the calling thread while the block runs and write the result to path; does nothing when path is None.
+
+    "cprofile" writes pstats data (python -m pstats, snakeviz), "pyinstrument" (installed separately) an HTML report
+    that also follows asyncio tasks. Python 3.12+ runs one cProfile session per process at a time; when another one
+    is already active, the block runs unprofiled with a warning.
+    """
+    if path is None:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"profiler must be one of {PROFILERS}")
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(path, "w") as report:
+                report.write(session.output_html())
+            logger.info("Wrote pyinstrument profile to %s", path)
+        return
+
+    import cProfile
+    session = cProfile.Profile()
+    try:
+        session.enable()
+    except ValueError as e:
+        logger.warning("Not profiling into %s: %s", path, e)
+        yield
+        return
+    try:
+        yield
+    finally:
+        session.disable()
+        session.dump_stats(path)
+        logger.info("Wrote cProfile stats to %s", path)
@@ -0,0 +1,470 @@
+"""Scrape -> extract -> load pipeline.
+
+Each stage runs with its own workers, connected by bounded queues:
+- scraping: scrape_workers processes, each with its own Scraper in a ScraperPool of one warm Chrome driver (only
+  started for pages the HTTP tier can't read), fed from the URL list
+- extraction: one asyncio loop running up to llm_workers text batches at once against the LLM; relationships are
+  extracted per window of co-occurring entities (Extractor.relationship_windows). Responses are streamed and their
+  tuples handed to the writer in micro-batches as they complete
+- loading: a single writer thread that owns the DatabaseManager and writes in batches, mapping near-duplicate
+  entities onto canonical ones on the way (entity_resolution.EntityResolver)
+
+Scraped pages go through the text work queue (claim/ack/nack), so a crash loses nothing
+and rows left pending by an earlier run are picked up too.
+
+Every stage records latencies and counters into metrics.METRICS (scrape processes send theirs to the writer when
+they finish); --metrics-file exports them, --profile-dir profiles the stages into a file each.
+
+Usage:
+    python pipeline.py --search Python https://example.com/a https://example.com/b
+    python pipeline.py --search Python --seed-file urls.txt --scrape-workers 4 --llm-workers 8
+    python pipeline.py --search Python --seed-file urls.txt --metrics-file metrics.prom --profile-dir profiles
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+
+from database_manager import DatabaseManager, MicroBatchWriter, page_fingerprint
+from entity_resolution import EntityResolver
+from metrics import METRICS, profile_path, profiled
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stream on any of the queues
+STOP = None
+LOG_FORMAT = "%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s"
+
+
+def _scrape_worker(scraper_factory, url_queue, page_queue, search: str, log_level: int=logging.WARNING,
+                   profile_dir: str=None, profiler: str="cprofile", domain_delay: float=0.0):
+    # Runs in its own process: scrape (url, etag, last_modified) items until STOP
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent coordinates shutdown
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    path = profile_path(profile_dir, f"scrape-{os.getpid()}", profiler) if profile_dir else None
+    try:
+        from scraper import ScraperPool
+        # One page at a time per process, so one driver, kept warm across the pages that need Chrome
+        with profiled(path, profiler), ScraperPool(size=1, domain_delay=domain_delay, scraper=scraper_factory()) as pool:
+            while True:
+                item = url_queue.get()
+                if item is STOP:
+                    break
+                url, etag, last_modified = item
+                try:
+                    scraped = pool.scrape_page(url, search, etag=etag, last_modified=last_modified)
+                except Exception as e:
+                    METRICS.inc("scrape_failures_total")
+                    logger.warning("Scraping %s failed: %s", url, e)
+                    continue
+                page_queue.put((url, scraped))
+    finally:
+        # Always sent, so the writer knows this worker is done even if it crashed; its metrics go just before
+        page_queue.put(METRICS.snapshot())
+        page_queue.put(STOP)
+
+def _default_scraper():
+    from scraper import Scraper
+    return Scraper()
+
+
+class Pipeline:
+    def __init__(self, search: str="", scrape_workers: int=2, llm_workers: int=4, queue_size: int=16,
+                 text_batch_size: int=50, write_batch_size: int=200, flush_interval: float=1.0,
+                 scraper_factory=_default_scraper, extractor_factory=None, db_manager_factory=DatabaseManager,
+                 resolver_factory=EntityResolver, profile_dir: str=None, profiler: str="cprofile", domain_delay: float=0.0,
+                 stream_batch_size: int=20):
+        """Factories build each stage's component inside the worker that uses it; resolver_factory=None stores
+        entity names as extracted.
+
+        scraper_factory must be picklable (a top-level function or class) since it runs in the scrape processes,
+        where each Scraper goes into a ScraperPool spacing requests to a domain domain_delay seconds apart.
+        With profile_dir, every scrape process and the writer are profiled with profiler ("cprofile" or
+        "pyinstrument") into a file of their own there, and with pyinstrument the extractor too: Python 3.12+
+        allows only one cProfile session per process, so cProfile stays on the writer thread.
+        The extractor hands streamed tuples to the writer stream_batch_size at a time, which then writes
+        write_batch_size of them (or whatever it has every flush_interval seconds) at once.
+        """
+        self.search = search
+        self.scrape_workers = scrape_workers
+        self.llm_workers = llm_workers
+        self.queue_size = queue_size
+        self.text_batch_size = text_batch_size
+        self.write_batch_size = write_batch_size
+        self.stream_batch_size = stream_batch_size
+        self.flush_interval = flush_interval
+        self.scraper_factory = scraper_factory
+        self.extractor_factory = extractor_factory or self._default_extractor
+        self.db_manager_factory = db_manager_factory
+        self.resolver_factory = resolver_factory
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self.domain_delay = domain_delay
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:pipeline"
+
+        self.stats = {"pages": 0, "unchanged_pages": 0, "texts": 0, "entities": 0, "aliases": 0, "relationships": 0,
+                      "failed_batches": 0, "lost_leases": 0}
+        self._stopping = threading.Event()
+
+    def _default_extractor(self):
+        from extractor import Extractor
+        return Extractor(max_concurrency=self.llm_workers)
+
+    def stop(self):
+        """Graceful shutdown: stop handing out URLs and text, finish what is in flight."""
+        self._stopping.set()
+
+    def _profiled(self, name: str):
+        # Profiles the calling thread into profile_dir, if one is set
+        if not self.profile_dir or (name != "writer" and self.profiler == "cprofile"):
+            return profiled(None)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        return profiled(profile_path(self.profile_dir, name, self.profiler), self.profiler)
+
+    def run(self, urls: list) -> dict:
+        """Scrape urls and process everything pending in the text queue; returns the stats, which also end up in
+        METRICS as pipeline_<stat>_total counters next to the pipeline.run time."""
+        with METRICS.timer("pipeline.run"):
+            self._run(urls)
+        for key, value in self.stats.items():
+            METRICS.inc(f"pipeline_{key}_total", value)
+        return self.stats
+
+    def _run(self, urls: list):
+        context = multiprocessing.get_context("spawn")
+        url_queue = context.Queue()
+        page_queue = context.Queue(maxsize=self.queue_size)    # backpressure on the scrapers
+        extract_queue = queue.Queue()                          # bounded by the writer, see _write_loop
+        result_queue = queue.Queue()
+
+        db_ready = queue.Queue()      # the writer's setup error, None once it is ready
+        writer_error = queue.Queue()  # (stage, error) the writer stopped on: its own or the extractor's
+        validators = {}
+        writer = threading.Thread(
+            target=self._write_loop,
+            args=(page_queue, extract_queue, result_queue, db_ready, writer_error, validators, urls),
+            name="pipeline-writer",
+        )
+        extractor = threading.Thread(target=self._run_extract_loop, args=(extract_queue, result_queue), name="pipeline-extractor")
+        writer.start()
+        extractor.start()
+        error = db_ready.get()
+        if error is not None:
+            extract_queue.put(STOP)
+            extractor.join()
+            writer.join()
+            raise RuntimeError("Pipeline writer failed to start") from error
+
+        for url in urls:
+            url_queue.put((url, *validators.get(url, (None, None))))
+        scrape_workers = self.scrape_workers if urls else 0
+        for _ in range(scrape_workers):
+            url_queue.put(STOP)
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        worker_args = (self.scraper_factory, url_queue, page_queue, self.search, logging.getLogger().getEffectiveLevel(),
+                       self.profile_dir, self.profiler, self.domain_delay)
+        processes = [context.Process(target=_scrape_worker, args=worker_args, daemon=True) for _ in range(scrape_workers)]
+        for process in processes:
+            process.start()
+
+        drained = False
+        try:
+            while writer.is_alive():
+                try:
+                    writer.join(timeout=0.5)
+                except KeyboardInterrupt:
+                    logger.warning("Interrupted, finishing in-flight work...")
+                    self.stop()
+                if self._stopping.is_set() and not drained:
+                    # Drop the URLs nobody has started on; each scraper still gets its STOP
+                    try:
+                        while True:
+                            url_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                    for _ in processes:
+                        url_queue.put(STOP)
+                    drained = True
+        finally:
+            extractor.join(timeout=5)
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+        # An extractor that died after the writer had already finished only left its error on result_queue
+        while writer_error.empty() and not result_queue.empty():
+            kind, payload = result_queue.get()
+            if kind == "error":
+                writer_error.put(("extractor", payload))
+        if not writer_error.empty():
+            stage, error = writer_error.get()
+            raise RuntimeError(f"Pipeline {stage} failed") from error
+
+    # Loading stage
+    def _write_loop(self, *args):
+        with self._profiled("writer"):
+            self._write(*args)
+
+    def _write(self, page_queue, extract_queue, result_queue, db_ready, writer_error, validators: dict, urls: list):
+        resolver = None
+        try:
+            db_manager = self.db_manager_factory()
+            db_manager.create_tables()
+            validators.update(db_manager.get_page_validators(urls))
+            if self.resolver_factory is not None:
+                resolver = self.resolver_factory()
+                resolver.load(db_manager)
+        except Exception as e:
+            db_ready.put(e)
+            return
+        db_ready.put(None)
+
+        scrapers_left = self.scrape_workers if urls else 0
+        in_flight = {}           # claimed text batches handed to the extractor and not yet acked/nacked: first textID -> leases
+        extractor_error = None
+        claim_exhausted = False  # nothing left to claim since the last page was stored
+        pending_entities, pending_relationships, pending_acks, pending_nacks = [], [], [], []
+        last_flush = time.monotonic()
+
+        @METRICS.timed("pipeline.flush")
+        def flush():
+            nonlocal last_flush
+            entities, relationships = pending_entities, pending_relationships
+            if resolver is not None:
+                entities = resolver.resolve_batch(entities)
+                relationships = resolver.resolve_relationships(relationships)
+            if entities:
+                self.stats["entities"] += len(db_manager.bulk_upsert_entities(entities))
+            if resolver is not None:
+                aliases = resolver.take_aliases()
+                if aliases:
+                    entity_ids = db_manager.bulk_upsert_entities([(name, type) for _, name, type in aliases])
+                    self.stats["aliases"] += db_manager.add_aliases([(alias, entID) for (alias, _, _), entID in zip(aliases, entity_ids)])
+            if relationships:
+                self.stats["relationships"] += len(db_manager.bulk_upsert_named_relationships(relationships))
+            # Rows whose lease ran out mid-extraction belong to whoever claimed them since
+            if pending_acks:
+                self.stats["lost_leases"] += len(db_manager.ack_texts(pending_acks))
+            if pending_nacks:
+                self.stats["lost_leases"] += len(db_manager.nack_texts(pending_nacks))
+            for pending in (pending_entities, pending_relationships, pending_acks, pending_nacks):
+                pending.clear()
+            last_flush = time.monotonic()
+
+        try:
+            while True:
+                # Keep the extractor fed, but never more than queue_size batches ahead of it
+                while len(in_flight) < self.queue_size and not claim_exhausted and not self._stopping.is_set():
+                    claimed = db_manager.claim_texts(self.worker_id, limit=self.text_batch_size)
+                    if not claimed:
+                        claim_exhausted = True
+                        break
+                    extract_queue.put(claimed)
+                    in_flight[claimed[0].textID] = [(row.textID, row.lease_token) for row in claimed]
+
+                if scrapers_left == 0 and not in_flight and (claim_exhausted or self._stopping.is_set()):
+                    break
+
+                # Results first, so the extractor never waits on a full writer
+                try:
+                    kind, payload = result_queue.get(timeout=0.05)
+                except queue.Empty:
+                    kind = None
+                if kind == "error":
+                    # The extractor thread is gone: keep what it finished, hand the rest back to the queue and stop
+                    extractor_error = payload
+                    while not result_queue.empty():
+                        self._take_result(*result_queue.get(), in_flight, pending_entities, pending_relationships, pending_acks, pending_nacks)
+                    for leases in in_flight.values():
+                        pending_nacks.extend(leases)
+                    in_flight.clear()
+                    break
+                if kind is not None:
+                    self._take_result(kind, payload, in_flight, pending_entities, pending_relationships, pending_acks, pending_nacks)
+
+                # Only take new pages while the extractor isn't backed up
+                if scrapers_left and len(in_flight) < self.queue_size:
+                    try:
+                        item = page_queue.get(timeout=0.05)
+                    except queue.Empty:
+                        item = ()
+                    if item is STOP:
+                        scrapers_left -= 1
+                    elif isinstance(item, dict):
+                        METRICS.merge(item)  # a finished scrape worker's metrics
+                    elif item:
+                        self._store_page(db_manager, *item)
+                        claim_exhausted = False
+
+                if len(pending_entities) + len(pending_relationships) >= self.write_batch_size \
+                        or time.monotonic() - last_flush >= self.flush_interval:
+                    flush()
+            flush()
+            if extractor_error is not None:
+                writer_error.put(("extractor", extractor_error))
+        except Exception as e:
+            # Unacked batches keep their lease and are claimed again once it expires
+            logger.error("Pipeline writer failed: %s", e)
+            writer_error.put(("writer", e))
+        finally:
+            # Even when a write failed: the extractor thread only exits on STOP
+            extract_queue.put(STOP)
+            try:
+                db_manager.session.rollback()  # nothing to undo after a clean flush
+            finally:
+                db_manager.close_db()
+
+    def _take_result(self, kind: str, payload, in_flight: dict, entities: list, relationships: list, acks: list, nacks: list):
+        # One extractor message into the writer's pending lists
+        if kind == "entities":
+            entities.extend(payload)
+        elif kind == "relationships":
+            relationships.extend(payload)
+        elif kind in ("ack", "nack"):
+            (acks if kind == "ack" else nacks).extend(payload)
+            in_flight.pop(payload[0][0], None)
+            if kind == "nack":
+                self.stats["failed_batches"] += 1
+
+    @METRICS.timed("pipeline.store_page")
+    def _store_page(self, db_manager, url: str, scraped: dict):
+        self.stats["pages"] += 1
+        if scraped["not_modified"]:
+            self.stats["unchanged_pages"] += 1
+            db_manager.touch_page(url)
+            return
+        text = [instance for instance in scraped["text"] if instance.strip()]
+        pageID, changed = db_manager.record_page(url, page_fingerprint(text), scraped["etag"], scraped["last_modified"])
+        if changed:
+            self.stats["texts"] += len(db_manager.bulk_add_texts(text, pageID=pageID))
+        else:
+            self.stats["unchanged_pages"] += 1
+
+    # Extraction stage
+    def _run_extract_loop(self, extract_queue, result_queue):
+        # Whatever stops this thread, the writer hears about it and hands the batches in flight back
+        try:
+            with self._profiled("extractor"):
+                asyncio.run(self._extract_loop(extract_queue, result_queue))
+        except Exception as e:
+            logger.error("Pipeline extractor failed: %s", e)
+            result_queue.put(("error", e))
+
+    async def _extract_loop(self, extract_queue, result_queue):
+        extractor = self.extractor_factory()
+        loop = asyncio.get_running_loop()
+        llm_slots = asyncio.Semaphore(extractor.max_concurrency)
+        batch_slots = asyncio.Semaphore(self.llm_workers)
+        tasks = set()
+
+        while True:
+            claimed = await loop.run_in_executor(None, extract_queue.get)
+            if claimed is STOP:
+                break
+            await batch_slots.acquire()
+            task = asyncio.create_task(self._extract_batch(extractor, claimed, llm_slots, result_queue))
+            task.add_done_callback(lambda _: batch_slots.release())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def _extract_batch(self, extractor, claimed: list, llm_slots: asyncio.Semaphore, result_queue):
+        textIDs = [row.textID for row in claimed]
+        leases = [(row.textID, row.lease_token) for row in claimed]
+        try:
+            with METRICS.timer("extract.batch"):
+                chunks = extractor.chunk_text([row.body for row in claimed])
+                # Tuples reach the writer in stream_batch_size messages while the responses are still streaming in.
+                # Each name goes out once per batch, with the first type streamed for it
+                streamed = {}
+                with MicroBatchWriter(lambda batch: result_queue.put(("entities", batch)), self.stream_batch_size) as writer:
+                    chunk_entities = await asyncio.gather(*(
+                        self._forward(extractor.astream_entities(chunk, llm_slots), writer, streamed, lambda entity: entity[0])
+                        for chunk in chunks
+                    ))
+                entities = list(streamed.values())
+                # One call per window of co-occurring entities, instead of every entity of the batch in one prompt
+                windows = extractor.relationship_windows(chunks, entities, chunk_entities)
+                relationships = {}
+                with MicroBatchWriter(lambda batch: result_queue.put(("relationships", batch)), self.stream_batch_size) as writer:
+                    await asyncio.gather(*(
+                        self._forward(extractor.astream_relationships(text, window_entities, llm_slots), writer, relationships,
+                                      lambda relationship: relationship)
+                        for text, window_entities in windows
+                    ))
+        except Exception as e:
+            logger.error("Extraction of texts %s..%s failed: %s", textIDs[0], textIDs[-1], e)
+            result_queue.put(("nack", leases))
+            return
+        METRICS.inc("extracted_chunks_total", len(chunks))
+        METRICS.inc("relationship_windows_total", len(windows))
+        METRICS.inc("extracted_entities_total", len(entities))
+        METRICS.inc("extracted_relationships_total", len(relationships))
+        result_queue.put(("ack", leases))
+
+    async def _forward(self, stream, writer: MicroBatchWriter, seen: dict, key) -> list:
+        # Everything stream yields, in order; items whose key(item) the batch hasn't seen yet also go to writer
+        found = []
+        async for item in stream:
+            found.append(item)
+            if key(item) not in seen:
+                seen[key(item)] = item
+                writer.add(item)
+        return found
+
+
+def read_seed_file(path: str) -> list:
+    """One URL per line; blank lines and # comments are skipped."""
+    with open(path) as seed_file:
+        return [line.strip() for line in seed_file if line.strip() and not line.lstrip().startswith("#")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape pages, extract a knowledge graph with the LLM and load it into the database.")
+    parser.add_argument("urls", nargs="*", help="URLs to scrape")
+    parser.add_argument("--seed-file", help="file with one URL per line")
+    parser.add_argument("--search", default="", help="only keep page text containing this term")
+    parser.add_argument("--scrape-workers", type=int, default=2, help="scraper processes")
+    parser.add_argument("--llm-workers", type=int, default=4, help="concurrent LLM requests")
+    parser.add_argument("--domain-delay", type=float, default=0.0, help="seconds between requests to one domain, per scraper process")
+    parser.add_argument("--queue-size", type=int, default=16, help="max pages / text batches waiting between stages")
+    parser.add_argument("--text-batch-size", type=int, default=50, help="text rows claimed per extraction batch")
+    parser.add_argument("--write-batch-size", type=int, default=200, help="tuples buffered per database write")
+    parser.add_argument("--no-entity-resolution", action="store_true", help="store entity names exactly as extracted")
+    parser.add_argument("--metrics-file", help="write stage timings and counters here: JSON if it ends in .json, else Prometheus text")
+    parser.add_argument("--profile-dir", help="profile the scrape processes and the writer (with pyinstrument, the extractor too) into files in this directory")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile", help="profiler for --profile-dir")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="logging level")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT)
+
+    urls = list(args.urls)
+    if args.seed_file:
+        urls += read_seed_file(args.seed_file)
+
+    pipeline = Pipeline(
+        search=args.search, scrape_workers=args.scrape_workers, llm_workers=args.llm_workers, queue_size=args.queue_size,
+        text_batch_size=args.text_batch_size, write_batch_size=args.write_batch_size,
+        resolver_factory=None if args.no_entity_resolution else EntityResolver,
+        profile_dir=args.profile_dir, profiler=args.profiler, domain_delay=args.domain_delay,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: pipeline.stop())
+    stats = pipeline.run(urls)
+    logger.info("Pipeline finished: %s", stats)
+    logger.info("Stage timings and counters:\n%s", METRICS.report())
+    if args.metrics_file:
+        METRICS.write(args.metrics_file)
+        logger.info("Wrote metrics to %s", args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,546 @@
+import logging
 import os
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+import requests
 from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from lxml import etree
+from requests.adapters import HTTPAdapter
 import time
+from metrics import METRICS
+# selenium is imported where a browser is first needed; most pages never get that far with fetch_mode="auto"
+
+EXTRACTION_MODES = ("script", "xpath")
+FETCH_MODES = ("auto", "http", "browser")
+
+logger = logging.getLogger(__name__)
+
+# Collects every element under <body> with a direct text node containing arguments[0], in one round-trip.
+# Returns [{text, xpath, position}], text being the element's rendered text like WebElement.text
+EXTRACT_TEXT_SCRIPT = """
+const search = arguments[0];
+const skip = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE']);
+
+function xpathOf(element) {
+    const parts = [];
+    for (; element && element.nodeType === Node.ELEMENT_NODE; element = element.parentNode) {
+        let index = 1;
+        for (let sibling = element.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+            if (sibling.nodeName === element.nodeName) index++;
+        }
+        parts.unshift(element.nodeName.toLowerCase() + '[' + index + ']');
+    }
+    return '/' + parts.join('/');
+}
+
+const chunks = [];
+const seen = new Set();
+const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+    const element = node.parentElement;
+    if (!element || element === document.body || seen.has(element) || skip.has(element.nodeName)) continue;
+    if (!node.nodeValue.includes(search)) continue;
+    seen.add(element);
+    const text = (element.innerText || '').trim();
+    if (text) chunks.push({text: text, xpath: xpathOf(element), position: chunks.length});
+}
+return chunks;
+"""
+
+def declared_charset(content_type: str):
+    """The charset parameter of a Content-Type header value, None when it has none."""
+    for parameter in content_type.split(";")[1:]:
+        key, _, value = parameter.partition("=")
+        if key.strip().lower() == "charset":
+            return value.strip().strip("'\"") or None
+    return None
+
+def xpath_literal(value: str) -> str:
+    """Quote value as an XPath 1.0 string literal, using concat() when it contains both quote types."""
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    return "concat(" + ", \"'\", ".join(f"'{part}'" for part in value.split("'")) + ")"
+
+class HttpFetcher:
+    """Fast path for static pages: pooled keep-alive HTTP client plus a streaming lxml parse.
+
+    fetch_chunks returns the same {text, xpath, position} chunks as Scraper.extract_chunks, or None
+    when the page looks JavaScript-rendered and should go through Chrome instead. A page counts as
+    JS-rendered when its visible text is shorter than min_text_length, or when one of app_root_ids
+    (an SPA mount point) is present but empty.
+    """
+    SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+    def __init__(self, pool_size: int=10, timeout: float=15, min_text_length: int=200,
+                 app_root_ids: tuple=("root", "app", "__next", "__nuxt"), user_agent: str=None):
+        self.timeout = timeout
+        self.min_text_length = min_text_length
+        self.app_root_ids = set(app_root_ids)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+
+        # url -> (ETag, Last-Modified, search, chunks) for conditional GETs
+        self.validators = {}
+        self._validators_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def fetch_page(self, url: str, search: str="", etag: str=None, last_modified: str=None):
+        """Conditional GET of url: {"chunks", "etag", "last_modified", "not_modified"}, or None if it looks JS-rendered.
+
+        With the validators of a previous fetch, an unchanged page comes back as not_modified with chunks None.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        with METRICS.timer("scrape.http"), self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                METRICS.inc("scrape_pages_total", outcome="not_modified")
+                return {"chunks": None, "etag": etag, "last_modified": last_modified, "not_modified": True}
+            response.raise_for_status()
+            if "html" in response.headers.get("Content-Type", "text/html"):
+                chunks = self._parse(response, search)
+            else:
+                chunks = []
+
+        if chunks is None:
+            METRICS.inc("scrape_pages_total", outcome="js_rendered")
+            return None
+        METRICS.inc("scrape_pages_total", outcome="static")
+        return {"chunks": chunks, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"), "not_modified": False}
+
+    def fetch_chunks(self, url: str, search: str=""):
+        """Chunks of url, revalidating against the in-memory result of the previous fetch; None if it looks JS-rendered."""
+        with self._validators_lock:
+            cached = self.validators.get(url)
+        if cached and cached[2] == search:
+            page = self.fetch_page(url, search, cached[0], cached[1])
+        else:
+            page = self.fetch_page(url, search)
+
+        if page is None:
+            return None
+        if page["not_modified"]:
+            return cached[3]
+        with self._validators_lock:
+            self.validators[url] = (page["etag"], page["last_modified"], search, page["chunks"])
+        return page["chunks"]
+
+    def _parse(self, response, search: str):
+        # Feed the body to the parser as it downloads; elements are only inspected once closed
+        # Only a charset the server declared overrides the page's <meta charset>; requests' ISO-8859-1 fallback for
+        # text/html without one would garble UTF-8 pages
+        parser = etree.HTMLPullParser(events=("start", "end"), encoding=declared_charset(response.headers.get("Content-Type", "")))
+        order = {}
+        matches = []
+        visible_text = 0
+        empty_app_root = False
+
+        for block in response.iter_content(chunk_size=16384):
+            parser.feed(block)
+            for event, element in parser.read_events():
+                if not isinstance(element.tag, str):
+                    continue  # comments, processing instructions
+                if event == "start":
+                    order[element] = len(order)
+                    continue
+                if element.tag in self.SKIP_TAGS:
+                    continue
+                direct_text = [element.text or ""] + [child.tail or "" for child in element]
+                visible_text += sum(len(text.strip()) for text in direct_text)
+                if element.get("id") in self.app_root_ids and len(element) == 0 and not (element.text or "").strip():
+                    empty_app_root = True
+                if element.tag not in ("html", "body") and any(search in text for text in direct_text if text):
+                    matches.append(element)
+        parser.close()
+
+        if visible_text < self.min_text_length or empty_app_root:
+            return None
+
+        chunks = []
+        for element in sorted(matches, key=order.get):
+            if not self._in_body(element):
+                continue
+            text = " ".join("".join(self._visible_text(element)).split())
+            if text:
+                chunks.append({"text": text, "xpath": element.getroottree().getpath(element), "position": len(chunks)})
+        return chunks
+
+    def _in_body(self, element) -> bool:
+        return any(ancestor.tag == "body" for ancestor in element.iterancestors())
+
+    def _visible_text(self, element):
+        # itertext() minus the contents of script/style/... descendants
+        if element.text:
+            yield element.text
+        for child in element:
+            if isinstance(child.tag, str) and child.tag not in self.SKIP_TAGS:
+                yield from self._visible_text(child)
+            if child.tail:
+                yield child.tail
+
 
 class Scraper:
-    def __init__(self):
-        self.chrome_options = Options()
+    def __init__(self, extraction_mode: str="script", fetch_mode: str="auto", domain_rules: dict=None, http_fetcher: HttpFetcher=None):
+        """extraction_mode "script" reads all matching text in one execute_script call, "xpath" uses find_elements.
+
+        fetch_mode "auto" tries a plain HTTP fetch first and only starts Chrome for pages that look
+        JS-rendered or that it couldn't connect to; "http" and "browser" force one path. domain_rules maps a domain to "http" or
+        "browser" to override the choice per site.
+        """
+        if extraction_mode not in EXTRACTION_MODES:
+            raise ValueError(f"extraction_mode must be one of {EXTRACTION_MODES}")
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"fetch_mode must be one of {FETCH_MODES}")
+        self.extraction_mode = extraction_mode
+        self.fetch_mode = fetch_mode
+        self.domain_rules = domain_rules or {}
+        self.http_fetcher = http_fetcher or HttpFetcher()
         load_dotenv()
+        self.driver_location = os.getenv('CHROME_DRIVER_LOCATION')
+        self._chrome_options = None
+
+    @property
+    def chrome_options(self):
+        """Chrome options, built on first use so HTTP-only scraping never imports selenium."""
+        if self._chrome_options is None:
+            from selenium.webdriver.chrome.options import Options
+            self._chrome_options = self._build_chrome_options(Options())
+        return self._chrome_options
+
+    @property
+    def service(self):
+        """A fresh chromedriver service; every driver gets its own so several can run at once."""
+        from selenium.webdriver.chrome.service import Service
+        return Service(self.driver_location)
 
-        self.chrome_options.add_argument("--headless")  # Run in headless mode (no GUI)        
-        # self.chrome_options.add_argument("--disable-features=BraveShields") # Disable Brave Shields
-        # self.chrome_options.add_argument('--ignore-certificate-errors')  # Disable SSL certificate verification
-        # self.chrome_options.add_argument('--ignore-ssl-errors')
+    def _build_chrome_options(self, chrome_options):
+        chrome_options.add_argument("--headless")  # Run in headless mode (no GUI)
+        # chrome_options.add_argument("--disable-features=BraveShields") # Disable Brave Shields
+        # chrome_options.add_argument('--ignore-certificate-errors')  # Disable SSL certificate verification
+        # chrome_options.add_argument('--ignore-ssl-errors')
 
-        # self.chrome_options.add_argument('--incognito') # Incognito mode
-        # self.chrome_options.add_argument('--no-sandbox') # Bypass OS security model
-        # self.chrome_options.add_argument('--disable-dev-shm-usage') # Overcome limited resource problems
+        # chrome_options.add_argument('--incognito') # Incognito mode
+        # chrome_options.add_argument('--no-sandbox') # Bypass OS security model
+        # chrome_options.add_argument('--disable-dev-shm-usage') # Overcome limited resource problems
 
-        self.chrome_options.binary_location = os.getenv('CHROME_LOCATION')
-        self.service = Service(os.getenv('CHROME_DRIVER_LOCATION'))
+        # Only needed once a page actually goes through Chrome
+        if os.getenv('CHROME_LOCATION'):
+            chrome_options.binary_location = os.getenv('CHROME_LOCATION')
+        return chrome_options
+
+    @METRICS.timed("scrape.browser_start")
+    def new_driver(self, page_timeout: float=None):
+        """Start a headless Chrome."""
+        from selenium import webdriver
+        driver = webdriver.Chrome(service=self.service, options=self.chrome_options)
+        if page_timeout:
+            driver.set_page_load_timeout(page_timeout)
+        return driver
+
+    def fetch_static(self, url: str, search: str=""):
+        """Matching text via the HTTP tier, or None when the page has to go through Chrome."""
+        mode = self.domain_rules.get(urlsplit(url).netloc, self.fetch_mode)
+        if mode == "browser":
+            return None
+        try:
+            chunks = self.http_fetcher.fetch_chunks(url, search)
+        except requests.RequestException as e:
+            return None if self._falls_back(url, mode, e) else []
+        if chunks is None and mode == "http":
+            return []
+        return None if chunks is None else [chunk["text"] for chunk in chunks]
 
+    @METRICS.timed("scrape")
     def scrape(self, url: str, search: str="") -> list:
+        result_text = self.fetch_static(url, search)
+        if result_text is not None:
+            return result_text
+        return self._scrape_browser(url, search)
+
+    @METRICS.timed("scrape")
+    def scrape_page(self, url: str, search: str="", etag: str=None, last_modified: str=None) -> dict:
+        """scrape() with change detection: {"text", "etag", "last_modified", "not_modified"}.
+
+        Pass the validators stored from the previous fetch; if the server answers 304 the result is
+        not_modified with no text. Pages that go through Chrome always come back as modified.
+        """
+        page = self.fetch_static_page(url, search, etag, last_modified)
+        if page is not None:
+            return page
+        return {"text": self._scrape_browser(url, search), "etag": None, "last_modified": None, "not_modified": False}
+
+    def fetch_static_page(self, url: str, search: str="", etag: str=None, last_modified: str=None):
+        """scrape_page() via the HTTP tier, or None when the page has to go through Chrome."""
+        mode = self.domain_rules.get(urlsplit(url).netloc, self.fetch_mode)
+        if mode == "browser":
+            return None
         try:
-            with webdriver.Chrome(service=self.service, options=self.chrome_options) as driver:
-                driver.get(url)
+            page = self.http_fetcher.fetch_page(url, search, etag, last_modified)
+        except requests.RequestException as e:
+            if self._falls_back(url, mode, e):
+                return None
+            return {"text": [], "etag": None, "last_modified": None, "not_modified": False}
+        if page is not None:
+            page["text"] = [chunk["text"] for chunk in page.pop("chunks") or []]
+            return page
+        if mode == "http":
+            return {"text": [], "etag": None, "last_modified": None, "not_modified": False}
+        return None
 
-                # From the wonderful Kimi
-                # Wait for the page to load
-                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+    def _falls_back(self, url: str, mode: str, error: Exception) -> bool:
+        # Only a connection that failed outright is worth another go in Chrome (in auto mode); a 4xx/5xx would
+        # come back from Chrome too
+        if mode == "auto" and isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            logger.warning("HTTP fetch of %s failed, falling back to Chrome: %s", url, error)
+            return True
+        logger.warning("HTTP fetch of %s failed: %s", url, error)
+        return False
 
-                # # Use JavaScript to extract all text from the <body> tag
-                # all_text = driver.execute_script("return document.body.innerText;")
+    def _scrape_browser(self, url: str, search: str="") -> list:
+        try:
+            with self.new_driver() as driver:
+                return self.extract(driver, url, search)
+        except Exception as e:
+            logger.warning("Scraping %s in Chrome failed: %s", url, e)
+            return []
 
-                # # Split the text into meaningful chunks
-                # text_chunks = [chunk.strip() for chunk in all_text.split('\n') if chunk.strip()]
+    def extract(self, driver, url: str, search: str="", timeout: float=10) -> list:
+        """Load url in an already running driver and return the text of the elements containing search."""
+        return [chunk["text"] for chunk in self.extract_chunks(driver, url, search, timeout)]
 
-                # Extract the content
-                # result = driver.find_elements(By.XPATH, f"//a[contains(text(), '{search}')]")
-                result = driver.find_elements(By.XPATH, f"//body//*[contains(text(), '{search}')]")
+    @METRICS.timed("scrape.browser")
+    def extract_chunks(self, driver, url: str, search: str="", timeout: float=10) -> list:
+        """Like extract, but returns [{"text", "xpath", "position"}] for each matching element."""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+        driver.get(url)
 
-                # Print the results
-                result_text = [item.text for item in result]
-                # print(result_text)
-                driver.quit()
+        # From the wonderful Kimi
+        # Wait for the page to load
+        WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
 
+        if self.extraction_mode == "script":
+            # The search term goes in as a script argument, never spliced into the source
+            return driver.execute_script(EXTRACT_TEXT_SCRIPT, search)
 
-        except Exception as e:
+        # # Use JavaScript to extract all text from the <body> tag
+        # all_text = driver.execute_script("return document.body.innerText;")
+
+        # # Split the text into meaningful chunks
+        # text_chunks = [chunk.strip() for chunk in all_text.split('\n') if chunk.strip()]
+
+        # Extract the content
+        # result = driver.find_elements(By.XPATH, f"//a[contains(text(), '{search}')]")
+        # One WebDriver round-trip per element, so only the fallback mode
+        result = driver.find_elements(By.XPATH, f"//body//*[contains(text(), {xpath_literal(search)})]")
+
+        # Print the results
+        result_text = [{"text": item.text, "xpath": None, "position": position} for position, item in enumerate(result)]
+        # print(result_text)
+        return result_text
+
+
+class ScraperPool:
+    """Keeps up to size warm Chrome drivers and scrapes many URLs concurrently with them.
+
+    A driver is recycled after max_pages_per_driver pages or as soon as it crashes. Requests to
+    the same domain are limited to max_per_domain at a time and spaced domain_delay seconds apart.
+    Pages the HTTP tier can read never touch a driver.
+    """
+    def __init__(self, size: int=4, max_pages_per_driver: int=50, page_timeout: float=30, domain_delay: float=1.0,
+                 max_per_domain: int=2, retries: int=1, scraper: Scraper=None):
+        self.scraper = scraper or Scraper()
+        self.size = size
+        self.max_pages_per_driver = max_pages_per_driver
+        self.page_timeout = page_timeout
+        self.domain_delay = domain_delay
+        self.retries = retries
+
+        self._idle = queue.Queue()
+        self._pages = {}            # live driver -> pages served
+        self._starting = 0          # drivers currently being launched
+        self._in_use = 0            # drivers handed out and not yet released
+        self._closing = False
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._domain_slots = defaultdict(lambda: threading.Semaphore(max_per_domain))
+        self._next_slot = defaultdict(float)  # domain -> earliest time the next request may start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def warm_up(self):
+        """Start drivers until size are alive, so the first pages don't pay for browser startup."""
+        while True:
+            driver = self._start_driver(in_use=False)
+            if driver is None:
+                return
+            self._idle.put(driver)
+
+    def close(self, timeout: float=None):
+        """Quit every driver once the ones in use are released; RuntimeError if that takes longer than timeout.
+
+        No driver is handed out after close() was called.
+        """
+        with self._lock:
+            self._closing = True
+            if not self._released.wait_for(lambda: self._in_use == 0 and self._starting == 0, timeout):
+                raise RuntimeError(f"{self._in_use} drivers still in use after {timeout}s")
+            drivers = list(self._pages)
+            self._pages.clear()
+        for driver in drivers:
+            self._quit(driver)
+
+    def _start_driver(self, in_use: bool=True):
+        # A new driver if the pool is open and has room for one, otherwise None; one that finished starting after
+        # close() was called is quit right away
+        with self._lock:
+            if self._closing or len(self._pages) + self._starting >= self.size:
+                return None
+            self._starting += 1
+        driver = None
+        try:
+            driver = self.scraper.new_driver(self.page_timeout)
+        finally:
+            with self._lock:
+                self._starting -= 1
+                started = driver is not None and not self._closing
+                if started:
+                    self._pages[driver] = 0
+                    if in_use:
+                        self._in_use += 1
+                self._released.notify_all()
+        if driver is not None and not started:
+            self._quit(driver)
+            return None
+        return driver
+
+    def _acquire_driver(self):
+        # An idle driver, a new one if the pool has room, otherwise wait for one to be released. The close() check
+        # and counting the driver as in use happen under one lock, so close() can't miss a driver being handed out
+        while True:
+            with self._lock:
+                if self._closing:
+                    raise RuntimeError("ScraperPool is closed")
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+                else:
+                    self._in_use += 1
+                    return driver
+            driver = self._start_driver()
+            if driver is not None:
+                return driver
+            with self._lock:
+                if self._idle.empty() and not self._closing:
+                    self._released.wait(timeout=0.5)  # a recycled driver may also free a slot
+
+    def _release_driver(self, driver, crashed: bool=False):
+        with self._lock:
+            pages = self._pages.get(driver, 0) + 1
+            recycle = crashed or self._closing or pages >= self.max_pages_per_driver or driver not in self._pages
+            if recycle:
+                self._pages.pop(driver, None)
+            else:
+                self._pages[driver] = pages
+            self._in_use -= 1
+            self._released.notify_all()
+        if recycle:
+            self._quit(driver)
+        else:
+            self._idle.put(driver)
+
+    def _quit(self, driver):
+        try:
             driver.quit()
-            print(f"An error occurred: {e}")
-            return []
-        
-        return result_text
\ No newline at end of file
+        except Exception as e:
+            logger.warning("Failed to quit driver: %s", e)
+
+    def _wait_for_domain(self, domain: str):
+        # Reserve the next start time for this domain, then sleep until it comes up
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot[domain])
+            self._next_slot[domain] = start + self.domain_delay
+        if start > now:
+            time.sleep(start - now)
+
+    @METRICS.timed("scrape")
+    def scrape(self, url: str, search: str="") -> list:
+        domain = urlsplit(url).netloc
+        with self._lock:
+            domain_slot = self._domain_slots[domain]
+        with domain_slot:
+            self._wait_for_domain(domain)
+            result = self.scraper.fetch_static(url, search)
+            if result is not None:
+                return result
+            return self._scrape_browser(url, search, domain)
+
+    @METRICS.timed("scrape")
+    def scrape_page(self, url: str, search: str="", etag: str=None, last_modified: str=None) -> dict:
+        """Scraper.scrape_page, with the Chrome fallback on the pool's warm drivers."""
+        domain = urlsplit(url).netloc
+        with self._lock:
+            domain_slot = self._domain_slots[domain]
+        with domain_slot:
+            self._wait_for_domain(domain)
+            page = self.scraper.fetch_static_page(url, search, etag, last_modified)
+            if page is not None:
+                return page
+            text = self._scrape_browser(url, search, domain)
+        return {"text": text, "etag": None, "last_modified": None, "not_modified": False}
+
+    def _scrape_browser(self, url: str, search: str, domain: str) -> list:
+        # Called holding the domain's slot
+        from selenium.common.exceptions import WebDriverException
+        for attempt in range(self.retries + 1):
+            self._wait_for_domain(domain)
+            driver = None
+            try:
+                driver = self._acquire_driver()
+                result = self.scraper.extract(driver, url, search, timeout=self.page_timeout)
+            except Exception as e:
+                if driver is None and self._closing:
+                    raise
+                # Timeouts, dead browsers and browsers that never started alike: throw the driver away and try a fresh one
+                crashed = driver is None or isinstance(e, WebDriverException)
+                if driver is not None:
+                    self._release_driver(driver, crashed=crashed)
+                logger.warning("An error occurred scraping %s (attempt %d): %s", url, attempt + 1, e)
+                if crashed:
+                    continue
+                return []
+            self._release_driver(driver)
+            return result
+        METRICS.inc("scrape_pages_total", outcome="failed")
+        logger.error("Giving up on %s after %d attempts in Chrome", url, self.retries + 1)
+        return []
+
+    def scrape_many(self, urls: list, search: str=""):
+        """Scrape urls with up to size pages in flight, yielding (url, text) as each page finishes."""
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            futures = {executor.submit(self.scrape, url, search): url for url in urls}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
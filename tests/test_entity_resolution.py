@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from entity_resolution import EntityResolver, entity_key
+
+
+@pytest.mark.parametrize("first, second", [
+    ("World War 1", "World War 2"),
+    ("Windows 10", "Windows 11"),
+    ("iPhone 14", "iPhone 15"),
+])
+def test_numbered_names_stay_separate(first, second):
+    assert entity_key(first) != entity_key(second)
+    resolver = EntityResolver()
+    assert resolver.resolve_batch([(first, "product"), (second, "product")]) == [(first, "product"), (second, "product")]
+
+
+@pytest.mark.parametrize("name", ["Python v3", "Python 3.11", "python 2.7b", "The Python programming language"])
+def test_version_markers_and_qualifiers_are_stripped(name):
+    assert entity_key(name) == "python"
+    resolver = EntityResolver()
+    assert resolver.resolve_batch([("Python", "language"), (name, "language")])[1] == ("Python", "language")
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Internet Explorer 10", "Internet Explorer 11"),
+    ("Super Bowl LVII", "Super Bowl LVIII"),
+    ("Python 2.7", "Python 3.12"),
+])
+def test_differently_numbered_names_are_not_merged(first, second):
+    resolver = EntityResolver()
+    assert resolver.resolve_batch([(first, "product"), (second, "product")]) == [(first, "product"), (second, "product")]
+    assert resolver.resolve(second, "product") == (second, "product")
+
+
+def test_versions_merge_into_the_unnumbered_name_only():
+    resolver = EntityResolver()
+    resolved = resolver.resolve_batch([("Python", "language"), ("Python 2.7", "language"), ("Python 3.12", "language")])
+    assert resolved == [("Python", "language")] * 3
+
+
+@pytest.mark.parametrize("word", ["news", "series", "species"])
+def test_singular_words_keep_their_s(word):
+    assert entity_key(f"Fox {word}") == f"fox {word}"
+    resolver = EntityResolver()
+    assert resolver.resolve_batch([("Fox New", "organization"), (f"Fox {word}", "organization")])[1] == (f"Fox {word}", "organization")
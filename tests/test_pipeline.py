@@ -0,0 +1,97 @@
+import functools
+import os
+import sys
+import threading
+
+import pytest
+from sqlalchemy import select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_manager import DatabaseManager, Entity, Relationship, Text
+from pipeline import Pipeline
+
+TEXT = "Guido van Rossum created Python in 1991 while working at CWI in the Netherlands."
+
+
+def streaming_extractor():
+    from langchain_core.language_models.fake import FakeStreamingListLLM
+    from extractor import Extractor
+    llm = FakeStreamingListLLM(responses=[
+        '[("Python", "language"), ("Guido van Rossum", "person"), ("CWI", "organization")]',
+        '[("guido van rossum", "created", "python"), ("guido van rossum", "worked at", "cwi")]',
+    ])
+    return Extractor(llm=llm, cache=False)
+
+
+def broken_extractor():
+    raise RuntimeError("no API key")
+
+
+def run_in_thread(pipeline, urls):
+    # A hung pipeline fails the test instead of the test run
+    outcome = {}
+
+    def target():
+        try:
+            outcome["stats"] = pipeline.run(urls)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "pipeline hung"
+    return outcome
+
+
+@pytest.fixture
+def db_factory(tmp_path):
+    factory = functools.partial(DatabaseManager, f"sqlite:///{tmp_path / 'pipeline.db'}")
+    db_manager = factory()
+    db_manager.create_tables()
+    yield db_manager, factory
+    db_manager.close_db()
+
+
+def test_extractor_startup_error_is_raised_and_texts_go_back(db_factory):
+    db_manager, factory = db_factory
+    for i in range(5):
+        db_manager.add_text(f"text {i}")
+    pipeline = Pipeline(text_batch_size=2, extractor_factory=broken_extractor, db_manager_factory=factory,
+                        resolver_factory=None)
+
+    outcome = run_in_thread(pipeline, [])
+
+    assert isinstance(outcome.get("error"), RuntimeError)
+    assert "extractor" in str(outcome["error"])
+    assert str(outcome["error"].__cause__) == "no API key"
+    db_manager.session.expire_all()
+    statuses = db_manager.session.execute(select(Text.status)).scalars().all()
+    assert statuses == ["pending"] * 5
+
+
+def test_extractor_startup_error_without_work_is_raised(db_factory):
+    _, factory = db_factory
+    pipeline = Pipeline(extractor_factory=broken_extractor, db_manager_factory=factory, resolver_factory=None)
+
+    outcome = run_in_thread(pipeline, [])
+
+    assert isinstance(outcome.get("error"), RuntimeError)
+
+
+def test_streamed_tuples_are_stored_and_texts_acked(db_factory):
+    db_manager, factory = db_factory
+    db_manager.add_text(TEXT)
+    pipeline = Pipeline(stream_batch_size=2, extractor_factory=streaming_extractor, db_manager_factory=factory,
+                        resolver_factory=None)
+
+    outcome = run_in_thread(pipeline, [])
+
+    assert "error" not in outcome
+    assert outcome["stats"]["entities"] == 3
+    assert outcome["stats"]["relationships"] == 2
+    db_manager.session.expire_all()
+    assert sorted(db_manager.session.execute(select(Entity.name)).scalars()) == ["cwi", "guido van rossum", "python"]
+    assert db_manager.session.query(Relationship).count() == 2
+    assert db_manager.session.execute(select(Text.status)).scalars().all() == ["done"]
@@ -0,0 +1,103 @@
+import json
+import re
+
+# A quoted string element, either quote style, with backslash escapes
+_STRING = r'''"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*\''''
+ESCAPE_RE = re.compile(r'\\(.)', re.S)
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+# Unmatched text kept between feeds; nothing the model emits as one tuple gets near this
+MAX_PENDING = 4096
+
+_tuple_patterns = {}
+
+
+def tuple_pattern(arity: int):
+    """Regex for a tuple of exactly arity quoted strings: ("a", "b") or, inside a JSON array, ["a", "b"]."""
+    if arity not in _tuple_patterns:
+        elements = r'\s*,\s*'.join([f'({_STRING})'] * arity)
+        _tuple_patterns[arity] = re.compile(r'[(\[]\s*%s\s*,?\s*[)\]]' % elements, re.S)
+    return _tuple_patterns[arity]
+
+
+def _unescape(match) -> str:
+    return ESCAPES.get(match.group(1), match.group(1))
+
+
+def _to_tuple(groups: tuple):
+    """Unquoted, validated values of a matched tuple, None if any of them is empty."""
+    values = tuple(element[1:-1].strip() for element in groups)
+    if not all(values):
+        return None
+    if any('\\' in value for value in values):
+        values = tuple(ESCAPE_RE.sub(_unescape, value) for value in values)
+    return values
+
+
+class TupleStreamParser:
+    """Single-pass, incremental parser for LLM output in the [("a", "b"), ...] format.
+
+    feed() takes the response as it arrives and returns every tuple completed so far.
+    Code fences, prose around the list and quotes of either style are tolerated. Tuples
+    that don't have exactly arity non-empty string values are dropped.
+    """
+    def __init__(self, arity: int):
+        self.arity = arity
+        self.pattern = tuple_pattern(arity)
+        self._pending = ''
+
+    def feed(self, text: str) -> list:
+        buffer = self._pending + text
+        tuples = []
+        end = 0
+        for match in self.pattern.finditer(buffer):
+            end = match.end()
+            values = _to_tuple(match.groups())
+            if values is not None:
+                tuples.append(values)
+        self._pending = buffer[end:][-MAX_PENDING:]
+        return tuples
+
+    def close(self) -> list:
+        """Flush the stream, salvaging a final tuple that was truncated right before its closing paren."""
+        pending = self._pending.rstrip().rstrip(']').rstrip()
+        self._pending = ''
+        match = self.pattern.search(pending + ')') if pending else None
+        if match is None or match.end() != len(pending) + 1:
+            return []
+        values = _to_tuple(match.groups())
+        return [values] if values is not None else []
+
+
+def parse_tuples(text: str, arity: int) -> list:
+    """All valid tuples in a complete LLM response."""
+    parser = TupleStreamParser(arity)
+    return parser.feed(text) + parser.close()
+
+
+def parse_json_tuples(text: str, arity: int) -> list:
+    """Tuples from a JSON-mode response: an array of arrays or of objects, possibly wrapped in an object.
+
+    Falls back to parse_tuples when the response isn't valid JSON.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return parse_tuples(text, arity)
+
+    # {"entities": [...]} -> the first list inside the object
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    if not isinstance(data, list):
+        return []
+
+    tuples = []
+    for item in data:
+        if isinstance(item, dict):
+            item = list(item.values())
+        if not isinstance(item, list) or len(item) != arity:
+            continue
+        values = tuple(str(value).strip() for value in item)
+        if all(values):
+            tuples.append(values)
+    return tuples